@@ -1,21 +1,273 @@
-from typing import List, Optional, Dict, Tuple, Callable, Any
-from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Tuple, Callable, Any, Set
+from pydantic import BaseModel, Field, PrivateAttr
 from infinipy.entity import Entity, Statement, Attribute
 from infinipy.nodes import GameEntity, Node
 
+PrerequisiteEvaluator = Callable[[Entity, Entity], bool]
+
+
+class PrerequisiteFailure(BaseModel):
+    """
+    A prerequisite check that did not hold, as reported by Prerequisites.explain.
+    Attributes:
+        kind (str): The kind of the check: "source" or "target" for attribute conditions, "source_target" for
+            comparisons, "callable" for callables and "error" for checks that raised an exception.
+        statement_id (str): The ID of the statement the check belongs to.
+        statement_name (str): The name of the statement the check belongs to.
+        check (str): The attribute name of a condition, the name of a comparison or the name of a callable.
+        expected (Any): The desired value of a condition.
+        actual (Any): The actual value of a condition, or the (source, target) values of a comparison.
+        description (Optional[str]): The docstring of a comparison or callable, or the error message.
+    """
+    kind: str
+    statement_id: str
+    statement_name: str
+    check: str
+    expected: Any = None
+    actual: Any = None
+    description: Optional[str] = None
+
+    def describe(self) -> str:
+        statement = f"{self.statement_name} ({self.statement_id})"
+        if self.kind in ("source", "target"):
+            return f"{self.kind.capitalize()} prerequisite failed: {statement}: {self.check} is {self.actual!r}, expected {self.expected!r}"
+        if self.kind == "source_target":
+            return f"Source-Target prerequisite failed: {statement}: {self.check} does not hold for {self.actual!r}"
+        if self.kind == "callable":
+            return f"Callable prerequisite failed: {self.check} of {statement}\nDocstring: {self.description or 'No docstring available'}"
+        return f"Prerequisite check {self.check} of {statement} raised: {self.description}"
+
+
+PrerequisiteExplainer = Callable[[Entity, Entity], List[PrerequisiteFailure]]
+
+
+def _doc(func: Callable) -> Optional[str]:
+    return func.__doc__.strip() if func.__doc__ else None
+
+
+def _comparison_value(value: Any) -> Any:
+    if isinstance(value, Attribute):
+        return value.value
+    if isinstance(value, Node):
+        return value.position.value
+    return value
+
+
 class Prerequisites(BaseModel):
     source_statements: List[Statement] = Field(default_factory=list, description="Statements involving only the source entity")
     target_statements: List[Statement] = Field(default_factory=list, description="Statements involving only the target entity")
     source_target_statements: List[Statement] = Field(default_factory=list, description="Statements involving both source and target entities")
+    _compiled: Optional[PrerequisiteEvaluator] = PrivateAttr(default=None)
+    _compiled_residual: Optional[PrerequisiteEvaluator] = PrivateAttr(default=None)
+    _compiled_explainer: Optional[PrerequisiteExplainer] = PrivateAttr(default=None)
+    _compiled_split: Optional[Tuple[PrerequisiteEvaluator, Optional[PrerequisiteEvaluator]]] = PrivateAttr(default=None)
 
     def is_satisfied(self, source: Entity, target: Entity) -> bool:
-        try:
-            return all(statement.validate_condition(source) for statement in self.source_statements) and \
-                all(statement.validate_condition(target) for statement in self.target_statements) and \
-                all(statement.validate_comparisons(source, target) for statement in self.source_target_statements) and \
-                all(statement.validate_callables(source, target) for statement in self.source_statements + self.target_statements + self.source_target_statements)
-        except Exception as e:
-            return False
+        return self.compile()(source, target)
+
+    def compile(self) -> PrerequisiteEvaluator:
+        """
+        Compiles the statements into a single evaluator function with the same semantics as validating every
+        statement in turn. The conditions, comparisons and callables of all statements are flattened into tuples
+        once, the attributes of each entity are looked up once per evaluation instead of once per statement,
+        and the cheapest and most selective checks (the target conditions) run first.
+
+        The evaluator is built on first use and kept on the instance, so the statements must not be mutated
+        afterwards; build new Prerequisites instead.
+
+        Returns:
+            PrerequisiteEvaluator: A function of (source, target) returning whether the prerequisites hold.
+        """
+        # private attributes are read through __pydantic_private__ on hot paths,
+        # pydantic's __getattr__ fallback is an order of magnitude slower
+        private = self.__pydantic_private__
+        compiled = private["_compiled"]
+        if compiled is None:
+            compiled = private["_compiled"] = self._build_evaluator(include_conditions=True)
+        return compiled
+
+    def compile_residual(self) -> PrerequisiteEvaluator:
+        """
+        Compiles the comparisons and callables of the statements, leaving out the attribute conditions.
+        Used by batch evaluators that check the conditions of many entities at once and only run the
+        residual checks on the pairs that pass them.
+
+        Returns:
+            PrerequisiteEvaluator: A function of (source, target) returning whether the residual checks hold.
+        """
+        private = self.__pydantic_private__
+        compiled = private["_compiled_residual"]
+        if compiled is None:
+            compiled = private["_compiled_residual"] = self._build_evaluator(include_conditions=False)
+        return compiled
+
+    def compile_split(self) -> Tuple[PrerequisiteEvaluator, Optional[PrerequisiteEvaluator]]:
+        """
+        Compiles the statements into two evaluators whose conjunction is the compiled evaluator: the attribute
+        conditions and callables, which depend on the state of the entities and their containers, and the
+        comparisons, which relate the source and the target, e.g. the adjacency of their nodes. Used to cache
+        the first across moves and only re-run the comparisons.
+
+        Returns:
+            Tuple[PrerequisiteEvaluator, Optional[PrerequisiteEvaluator]]: The two evaluators, the second is None
+                if there are no comparisons.
+        """
+        private = self.__pydantic_private__
+        compiled = private["_compiled_split"]
+        if compiled is None:
+            has_comparisons = any(statement.comparisons for statement in self.source_target_statements)
+            compiled = private["_compiled_split"] = (
+                self._build_evaluator(include_conditions=True, include_comparisons=False),
+                self._build_evaluator(include_conditions=False, include_callables=False) if has_comparisons else None,
+            )
+        return compiled
+
+    def explain(self, source: Entity, target: Entity) -> List[PrerequisiteFailure]:
+        """
+        Evaluates the statements once and reports every check that does not hold, in the order of the compiled
+        evaluator, without short-circuiting. Every comparison and callable is called at most once, so explaining
+        a failure costs the same as checking a satisfied action.
+
+        Args:
+            source (Entity): The source entity.
+            target (Entity): The target entity.
+
+        Returns:
+            List[PrerequisiteFailure]: The failed checks, empty if the prerequisites hold.
+        """
+        private = self.__pydantic_private__
+        explainer = private["_compiled_explainer"]
+        if explainer is None:
+            explainer = private["_compiled_explainer"] = self._build_explainer()
+        return explainer(source, target)
+
+    def __getstate__(self) -> Dict[Any, Any]:
+        # the compiled evaluators are closures, which cannot be pickled; they are rebuilt on first use
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_compiled": None, "_compiled_residual": None, "_compiled_explainer": None,
+                                      "_compiled_split": None}
+        return state
+
+    def source_conditions(self) -> Tuple[Tuple[str, Any], ...]:
+        """
+        Returns the (attribute name, desired value) pairs of the conditions on the source entity.
+        """
+        return tuple(condition for statement in self.source_statements for condition in statement.conditions.items())
+
+    def target_conditions(self) -> Tuple[Tuple[str, Any], ...]:
+        """
+        Returns the (attribute name, desired value) pairs of the conditions on the target entity.
+        """
+        return tuple(condition for statement in self.target_statements for condition in statement.conditions.items())
+
+    def _build_evaluator(self, include_conditions: bool, include_comparisons: bool = True, include_callables: bool = True) -> PrerequisiteEvaluator:
+        check_source = include_conditions and bool(self.source_statements)
+        check_target = include_conditions and bool(self.target_statements)
+        source_conditions = self.source_conditions()
+        target_conditions = self.target_conditions()
+        # a node to node comparison settles the remaining comparisons of its statement, see Statement.validate_comparisons
+        comparison_groups = tuple(
+            tuple((source_attr, target_attr, comparison_func, source_attr == "node" and target_attr == "node")
+                  for source_attr, target_attr, comparison_func in statement.comparisons.values())
+            for statement in self.source_target_statements if statement.comparisons
+        ) if include_comparisons else ()
+        callables = tuple(callable_func for statement in self.source_statements + self.target_statements + self.source_target_statements
+                          for callable_func in statement.callables) if include_callables else ()
+
+        def evaluate(source: Entity, target: Entity) -> bool:
+            try:
+                if check_target:
+                    attributes = target.all_attributes()
+                    for attr_name, desired_value in target_conditions:
+                        attribute = attributes.get(attr_name)
+                        if attribute is None or attribute.value != desired_value:
+                            return False
+                if check_source:
+                    attributes = source.all_attributes()
+                    for attr_name, desired_value in source_conditions:
+                        attribute = attributes.get(attr_name)
+                        if attribute is None or attribute.value != desired_value:
+                            return False
+                for comparisons in comparison_groups:
+                    for source_attr, target_attr, comparison_func, compares_nodes in comparisons:
+                        source_value = getattr(source, source_attr, None)
+                        target_value = getattr(target, target_attr, None)
+                        if source_value is None or target_value is None:
+                            return False
+                        if compares_nodes:
+                            if not comparison_func(source_value, target_value):
+                                return False
+                            break
+                        if not comparison_func(source_value.value, target_value.value):
+                            return False
+                for callable_func in callables:
+                    if not callable_func(source, target):
+                        return False
+                return True
+            except Exception:
+                return False
+
+        return evaluate
+
+    def _build_explainer(self) -> PrerequisiteExplainer:
+        source_conditions = tuple((statement.id, statement.name, attr_name, desired_value)
+                                  for statement in self.source_statements for attr_name, desired_value in statement.conditions.items())
+        target_conditions = tuple((statement.id, statement.name, attr_name, desired_value)
+                                  for statement in self.target_statements for attr_name, desired_value in statement.conditions.items())
+        comparison_groups = tuple(
+            (statement.id, statement.name, tuple((comparison_name, source_attr, target_attr, comparison_func, source_attr == "node" and target_attr == "node")
+                                                 for comparison_name, (source_attr, target_attr, comparison_func) in statement.comparisons.items()))
+            for statement in self.source_target_statements if statement.comparisons
+        )
+        callables = tuple((statement.id, statement.name, callable_func)
+                          for statement in self.source_statements + self.target_statements + self.source_target_statements
+                          for callable_func in statement.callables)
+
+        def check_conditions(kind: str, entity: Entity, conditions: Tuple, failures: List[PrerequisiteFailure]):
+            attributes = entity.all_attributes() if entity is not None else {}
+            for statement_id, statement_name, attr_name, desired_value in conditions:
+                attribute = attributes.get(attr_name)
+                if attribute is None or attribute.value != desired_value:
+                    failures.append(PrerequisiteFailure(kind=kind, statement_id=statement_id, statement_name=statement_name, check=attr_name,
+                                                        expected=desired_value, actual=attribute.value if attribute is not None else None))
+
+        def explain(source: Entity, target: Entity) -> List[PrerequisiteFailure]:
+            failures: List[PrerequisiteFailure] = []
+            if target_conditions:
+                check_conditions("target", target, target_conditions, failures)
+            if source_conditions:
+                check_conditions("source", source, source_conditions, failures)
+            for statement_id, statement_name, comparisons in comparison_groups:
+                for comparison_name, source_attr, target_attr, comparison_func, compares_nodes in comparisons:
+                    source_value = getattr(source, source_attr, None)
+                    target_value = getattr(target, target_attr, None)
+                    try:
+                        if source_value is None or target_value is None:
+                            holds = False
+                        elif compares_nodes:
+                            holds = comparison_func(source_value, target_value)
+                        else:
+                            holds = comparison_func(source_value.value, target_value.value)
+                    except Exception as e:
+                        failures.append(PrerequisiteFailure(kind="error", statement_id=statement_id, statement_name=statement_name, check=comparison_name, description=str(e)))
+                        break
+                    if not holds:
+                        failures.append(PrerequisiteFailure(kind="source_target", statement_id=statement_id, statement_name=statement_name, check=comparison_name,
+                                                            actual=(_comparison_value(source_value), _comparison_value(target_value)), description=_doc(comparison_func)))
+                        break
+                    if compares_nodes:
+                        break
+            for statement_id, statement_name, callable_func in callables:
+                try:
+                    holds = callable_func(source, target)
+                except Exception as e:
+                    failures.append(PrerequisiteFailure(kind="error", statement_id=statement_id, statement_name=statement_name, check=callable_func.__name__, description=str(e)))
+                    continue
+                if not holds:
+                    failures.append(PrerequisiteFailure(kind="callable", statement_id=statement_id, statement_name=statement_name, check=callable_func.__name__, description=_doc(callable_func)))
+            return failures
+
+        return explain
 
 class Consequences(BaseModel):
     source_transformations: Dict[str, Any] = Field(default_factory=dict, description="Attribute transformations for the source entity")
@@ -29,19 +281,19 @@ class Consequences(BaseModel):
             if callable(value):
                 result = value(source=source, target=target)
                 if attr_name == "node" and isinstance(result, Node):
-                    updated_source_attributes[attr_name] = result.id  # Store the ID of the Node
+                    updated_source_attributes[attr_name] = result.handle  # Store the handle of the Node
                 elif attr_name == "stored_in" and (isinstance(result, GameEntity) or result is None):
-                    updated_source_attributes[attr_name] = result.id if result else None  # Store the ID of the entity or None
+                    updated_source_attributes[attr_name] = result.handle if result else None  # Store the handle of the entity or None
                 elif attr_name == "inventory":
-                    updated_source_attributes[attr_name] = [item.id for item in result]  # Store the IDs of the entities in the inventory
+                    updated_source_attributes[attr_name] = [item.handle for item in result]  # Store the handles of the entities in the inventory
                 else:
                     updated_source_attributes[attr_name] = Attribute(name=attr_name, value=result)
             elif attr_name == "node" and isinstance(value, Node):
-                updated_source_attributes[attr_name] = value.id  # Store the ID of the Node
+                updated_source_attributes[attr_name] = value.handle  # Store the handle of the Node
             elif attr_name == "stored_in" and (isinstance(value, GameEntity) or value is None):
-                updated_source_attributes[attr_name] = value.id if value else None  # Store the ID of the entity or None
+                updated_source_attributes[attr_name] = value.handle if value else None  # Store the handle of the entity or None
             elif attr_name == "inventory":
-                updated_source_attributes[attr_name] = [item.id for item in value]  # Store the IDs of the entities in the inventory
+                updated_source_attributes[attr_name] = [item.handle for item in value]  # Store the handles of the entities in the inventory
             else:
                 updated_source_attributes[attr_name] = Attribute(name=attr_name, value=value)
 
@@ -49,19 +301,19 @@ class Consequences(BaseModel):
             if callable(value):
                 result = value(source=source, target=target)
                 if attr_name == "node" and isinstance(result, Node):
-                    updated_target_attributes[attr_name] = result.id  # Store the ID of the Node
+                    updated_target_attributes[attr_name] = result.handle  # Store the handle of the Node
                 elif attr_name == "stored_in" and (isinstance(result, GameEntity) or result is None):
-                    updated_target_attributes[attr_name] = result.id if result else None  # Store the ID of the entity or None
+                    updated_target_attributes[attr_name] = result.handle if result else None  # Store the handle of the entity or None
                 elif attr_name == "inventory":
-                    updated_target_attributes[attr_name] = [item.id for item in result]  # Store the IDs of the entities in the inventory
+                    updated_target_attributes[attr_name] = [item.handle for item in result]  # Store the handles of the entities in the inventory
                 else:
                     updated_target_attributes[attr_name] = Attribute(name=attr_name, value=result)
             elif attr_name == "node" and isinstance(value, Node):
-                updated_target_attributes[attr_name] = value.id  # Store the ID of the Node
+                updated_target_attributes[attr_name] = value.handle  # Store the handle of the Node
             elif attr_name == "stored_in" and (isinstance(value, GameEntity) or value is None):
-                updated_target_attributes[attr_name] = value.id if value else None  # Store the ID of the entity or None
+                updated_target_attributes[attr_name] = value.handle if value else None  # Store the handle of the entity or None
             elif attr_name == "inventory":
-                updated_target_attributes[attr_name] = [item.id for item in value]  # Store the IDs of the entities in the inventory
+                updated_target_attributes[attr_name] = [item.handle for item in value]  # Store the handles of the entities in the inventory
             else:
                 updated_target_attributes[attr_name] = Attribute(name=attr_name, value=value)
 
@@ -77,18 +329,89 @@ class Consequences(BaseModel):
 
         return updated_source, updated_target
     
+_class_evaluators: Dict[type, PrerequisiteEvaluator] = {}
+_templates: Dict[type, "Action"] = {}
+
+
 class Action(BaseModel):
     name: str = Field("", description="The name of the action")
     prerequisites: Prerequisites = Field(default_factory=Prerequisites, description="The prerequisite conditions for the action")
     consequences: Consequences = Field(default_factory=Consequences, description="The consequences of the action")
+    _is_template: bool = PrivateAttr(default=False)
+
+    @classmethod
+    def template(cls) -> "Action":
+        """
+        Returns the shared template instance of the action class, built on first use. Applicability checks and
+        action instances reference the template instead of building a new action, with its prerequisites and
+        consequences, for every (source, target) pair.
+
+        Templates are immutable; instantiate the class to get an action that can be customized.
+        """
+        template = _templates.get(cls)
+        if template is None:
+            template = cls()
+            template._is_template = True
+            _templates[cls] = template
+        return template
+
+    def __setattr__(self, name: str, value: Any):
+        if self.__pydantic_private__["_is_template"]:
+            raise TypeError(f"Cannot set '{name}' on the shared template of {type(self).__name__}")
+        super().__setattr__(name, value)
+
+    @classmethod
+    def target_condition_names(cls) -> Set[str]:
+        """
+        Returns the names of the attributes the target conditions of the class-level prerequisites refer to.
+        A target lacking any of them can never satisfy the prerequisites.
+        """
+        prerequisites = cls.model_fields["prerequisites"].default
+        if not isinstance(prerequisites, Prerequisites):
+            prerequisites = cls().prerequisites
+        return {attr_name for attr_name, _ in prerequisites.target_conditions()}
 
     def is_applicable(self, source: GameEntity, target: GameEntity) -> bool:
-        return self.prerequisites.is_satisfied(source, target)
+        return self.compiled_prerequisites()(source, target)
+
+    def compiled_prerequisites(self) -> PrerequisiteEvaluator:
+        """
+        Returns the compiled evaluator of the prerequisites. Actions using the prerequisites declared on their
+        class share one evaluator per class, since pydantic copies field defaults into every new instance.
+        """
+        if "prerequisites" in self.__pydantic_fields_set__:
+            return self.prerequisites.compile()
+        action_class = type(self)
+        compiled = _class_evaluators.get(action_class)
+        if compiled is None:
+            default = action_class.model_fields["prerequisites"].default
+            if not isinstance(default, Prerequisites):
+                return self.prerequisites.compile()
+            compiled = _class_evaluators[action_class] = default.compile()
+        return compiled
+
+    def explain_prerequisites(self, source: GameEntity, target: GameEntity) -> List[PrerequisiteFailure]:
+        """
+        Reports the prerequisite checks of the action that do not hold, see Prerequisites.explain. Like
+        compiled_prerequisites, actions using the prerequisites declared on their class share one explainer.
+        """
+        if "prerequisites" in self.__pydantic_fields_set__:
+            return self.prerequisites.explain(source, target)
+        default = type(self).model_fields["prerequisites"].default
+        if not isinstance(default, Prerequisites):
+            return self.prerequisites.explain(source, target)
+        return default.explain(source, target)
 
     def apply(self, source: GameEntity, target: GameEntity) -> Tuple[GameEntity, GameEntity]:
         if not self.is_applicable(source, target):
             raise ValueError("Action prerequisites are not met")
+        return self.apply_consequences(source, target)
 
+    def apply_consequences(self, source: GameEntity, target: GameEntity) -> Tuple[GameEntity, GameEntity]:
+        """
+        Applies the consequences of the action without checking its prerequisites, for callers that already
+        checked them (see GridMap.apply_actions_batch). Actions with custom effects override this method.
+        """
         updated_source, updated_target = self.consequences.apply(source, target)
 
         if updated_source != source:
@@ -113,13 +436,39 @@ class Action(BaseModel):
         # Implement inventory consequence propagation logic here
         pass
     
+GoalDependency = Tuple[str, Optional[str]]
+
+
 class Goal(BaseModel):
     name: str
     source_entity_id: str
     target_entity_id: Optional[str] = None
     prerequisites: Prerequisites
+    dependencies: Optional[List[GoalDependency]] = Field(default=None, description="The (entity ID, attribute name) pairs the goal depends on, with None as attribute name for any change of the entity; inferred from the prerequisites when not provided")
 
     def is_achieved(self) -> bool:
         source_entity = GameEntity.get_instance(self.source_entity_id)
         target_entity = GameEntity.get_instance(self.target_entity_id) if self.target_entity_id else None
         return self.prerequisites.is_satisfied(source_entity, target_entity)
+
+    def get_dependencies(self) -> List[GoalDependency]:
+        """
+        Returns the declared dependencies of the goal, or infers them from the prerequisites: the attributes named
+        by the conditions of the source and target statements, and any change of the source and target entities
+        when the goal has comparisons or callables, whose reads cannot be inferred. Callables reading other
+        entities than the source and target require declared dependencies.
+
+        Returns:
+            List[GoalDependency]: The (entity ID, attribute name or None) pairs.
+        """
+        if self.dependencies is not None:
+            return list(self.dependencies)
+        prerequisites = self.prerequisites
+        entity_ids = [entity_id for entity_id in (self.source_entity_id, self.target_entity_id) if entity_id]
+        if prerequisites.source_target_statements or any(statement.comparisons or statement.callables
+                                                         for statement in prerequisites.source_statements + prerequisites.target_statements):
+            return [(entity_id, None) for entity_id in entity_ids]
+        dependencies = [(self.source_entity_id, attr_name) for attr_name, _ in prerequisites.source_conditions()]
+        if self.target_entity_id:
+            dependencies.extend((self.target_entity_id, attr_name) for attr_name, _ in prerequisites.target_conditions())
+        return dependencies
@@ -1,41 +1,83 @@
-from typing import List, Dict, Any, Optional, Union, Type, Tuple
+from typing import Callable, List, Dict, Any, Optional, Union, Type, Tuple
 from infinipy.actions import Goal, Action
 from infinipy.nodes import GameEntity, Node
 from infinipy.shapes import Shadow, Radius, Rectangle
-from infinipy.language_state import ObservationState, ActionState, GoalState
+from infinipy.language_state import ObservationState, DeltaObservationState, ActionState, GoalState
 from infinipy.payloads import ActionsPayload, ActionInstance, ActionsResults, ActionResult
 from infinipy.gridmap import GridMap
 from infinipy.language_state import StrActionConverter
 from infinipy.errors import AmbiguousEntityError
+from infinipy.mcts import MCTS
+from infinipy.goals import GoalMonitor, GoalTransition
+from infinipy.trace import TRACE, TraceLevel, Timing
+from infinipy.inference import InferenceService, InferenceRequest
+from infinipy.prompts import PromptAssembler, PromptSection, RollingSummary, CachedTokenCounter, approximate_token_count, tokenizer_counter
+import functools
 import random
+import time
 import typing
 import outlines
 from outlines import models, generate, samplers
 from outlines.generate.api import SequenceGenerator
 
 
+# tokens left out of the context for the generated action string
+GENERATION_RESERVE = 64
+PROMPT_SUFFIX = " <|im_end|>\n <|im_start|> After reviewing carefully the observation state, the result of the previous action and the current goal state I decided to take the action:"
+
 
 class Agent:
-    def __init__(self, goals: List[Goal], character_id: str, actions: Dict[str, Action], entity_type_map: Dict[str, Type[GameEntity]], llm:Optional[str]=None):
+    def __init__(self, goals: List[Goal], character_id: str, actions: Dict[str, Action], entity_type_map: Dict[str, Type[GameEntity]], llm:Optional[str]=None,
+                 observation_mode: str = "full", keyframe_interval: int = 10, n_ctx: int = 30000, prompt_budget: Optional[int] = None,
+                 summary_chunk: int = 8, generator_cache_size: int = 32, inference: Optional[InferenceService] = None):
+        """ observation_mode is "full" to put the whole observation in every prompt, or "delta" to put the latest
+        keyframe followed by the changes observed at every step since, see DeltaObservationState.
+        Prompts are assembled within prompt_budget tokens, by default the context size n_ctx minus a reserve for the
+        generated action; the oldest action log entries that do not fit are folded into a rolling summary,
+        summary_chunk entries beyond the overflow at a time so that the prompt prefix stays stable in between.
+        With a llama.cpp model, actions are decoded through one token trie over all the action strings, masking the
+        logits of the strings not allowed at the step; other models fall back to outlines choice generators, of
+        which the generator_cache_size most recently used are kept.
+        The model is held by an InferenceService, pass the same inference service to several agents to share one
+        model instance between them, and run them together with run_agents to batch their prompts of each tick. """
+        if observation_mode not in ("full", "delta"):
+            raise ValueError(f"Unknown observation mode: {observation_mode}")
         self.goals = goals
         self.character_id = character_id
         self.actions = actions
         self.entity_type_map = entity_type_map
         self.llm = llm
-        self.obs_state = ObservationState(character_id=character_id)
+        self.observation_mode = observation_mode
+        if observation_mode == "delta":
+            self.obs_state = DeltaObservationState(character_id=character_id, keyframe_interval=keyframe_interval)
+        else:
+            self.obs_state = ObservationState(character_id=character_id)
         self.action_state = ActionState()
         self.action_log = []
-        self.goal_state = GoalState(character_id=character_id, goals=goals)
+        # delta mode: the latest keyframe and the steps observed since, and the number of action log entries before it
+        self.observation_log: List[str] = []
+        self.keyframe_action_count = 0
+        self.n_ctx = n_ctx
+        self.summary_chunk = summary_chunk
+        self.history_summary = RollingSummary()
+        self.goal_monitor = GoalMonitor(goals)
+        self.goal_monitor.subscribe(self.on_goal_transition)
+        self.goal_state = GoalState(character_id=character_id, goals=goals, monitor=self.goal_monitor)
         self.history = []
         self.system_prompt = self.setup_system_prompt()
         self.str_action_converter = StrActionConverter(actions=self.actions, entity_type_map=self.entity_type_map)
         self.action_strings = self.generate_action_strings()
         self.allowed_strings_count = {}
-        if self.llm is not None:
-            
-            self.llm = models.llamacpp(llm, model_kwargs={"seed": 1337, "n_ctx": 30000, "n_gpu_layers": -1, "verbose": True})
-            self.generator_dict = {Tuple[str,str,str]:SequenceGenerator}
+        self.last_action_result: Optional[ActionResult] = None
+        if inference is None and self.llm is not None:
+            inference = InferenceService(llm, n_ctx=n_ctx, generator_cache_size=generator_cache_size)
+        self.inference = inference
+        if self.inference is not None:
+            self.llm = self.inference.llm
+            n_ctx = self.inference.n_ctx
             # self.generator_sampler =  generate.choice(self.llm, self.action_strings)
+        count_tokens = tokenizer_counter(self.llm) if self.llm is not None else CachedTokenCounter(approximate_token_count)
+        self.prompt_assembler = PromptAssembler(prompt_budget if prompt_budget is not None else n_ctx - GENERATION_RESERVE, count_tokens)
         
 
     def setup_system_prompt(self) -> str:
@@ -100,9 +142,55 @@ class Agent:
             self.generator_sampler = outlines.generate.strings(self.llm, action_strings)
 
     def generate_action_prompt(self, obs_state_text: str, action_state_text: str, goal_state_text: str) -> str:
-        prompt = f"{self.system_prompt}\n<|im_start|>user\nObservation:\n{obs_state_text}\n\nAction(s) before:\n{action_state_text}\n\nGoal:\n{goal_state_text} <|im_end|>\n <|im_start|> After reviewing carefully the observation state, the result of the previous action and the current goal state I decided to take the action:" 
+        # the sections are ordered from the most to the least stable, the action log only grows and the goals change
+        # every step, so consecutive prompts share the longest possible prefix and the llama.cpp prefix cache is reused
+        prompt = f"{self.system_prompt}\n<|im_start|>user\nAction(s) before:\n{action_state_text}\n\nObservation:\n{obs_state_text}\n\nGoal:\n{goal_state_text}{PROMPT_SUFFIX}" 
         return prompt
 
+    def prompt_sections(self, obs_state_text: str, history: List[str], goal_state_text: str) -> List[PromptSection]:
+        """ The sections of generate_action_prompt, for the PromptAssembler. The observation is allocated the budget
+        first, then the goals, the most recent action log entries and the summary of the older ones. """
+        return [
+            PromptSection(name="system", text=f"{self.system_prompt}\n<|im_start|>user\nAction(s) before:\n", required=True),
+            PromptSection(name="summary", text=self.history_summary.text, priority=3),
+            PromptSection(name="history", entries=history, priority=2),
+            PromptSection(name="observation", header="\n\nObservation:\n", text=obs_state_text, priority=0),
+            PromptSection(name="goal", header="\n\nGoal:\n", text=goal_state_text, priority=1),
+            PromptSection(name="suffix", text=PROMPT_SUFFIX, required=True),
+        ]
+
+    def record_observation(self, obs_state_text: str, action_state_text: str):
+        """ Adds the observation of a step to the observation log used by build_prompt in delta mode: a keyframe
+        restarts the log, and every other step appends the result of the previous action and the observed changes. """
+        if self.observation_mode != "delta":
+            return
+        if self.obs_state.is_keyframe:
+            self.observation_log = [obs_state_text]
+            self.keyframe_action_count = len(self.action_log)
+        else:
+            self.observation_log.append(f"## Step {self.obs_state.step - 1}\n{action_state_text}\n{obs_state_text}")
+
+    def build_prompt(self, obs_state_text: str, goal_state_text: str) -> str:
+        """ Builds the prompt of the current step within the token budget. In delta mode the action log entries up
+        to the keyframe come first, then the keyframe and the steps since, which are only appended to until the
+        next keyframe. Action log entries that no longer fit are folded into the rolling summary. """
+        if self.observation_mode == "delta":
+            observation = "\n\n".join(self.observation_log)
+            history = self.action_log[:self.keyframe_action_count]
+        else:
+            observation = obs_state_text
+            history = self.action_log
+        assembled = self.prompt_assembler.assemble(self.prompt_sections(observation, history[self.history_summary.count:], goal_state_text))
+        dropped = assembled.dropped_entries.get("history", 0)
+        if dropped:
+            folded = min(dropped + self.summary_chunk, len(history) - self.history_summary.count)
+            self.history_summary.extend(history[self.history_summary.count:self.history_summary.count + folded])
+            assembled = self.prompt_assembler.assemble(self.prompt_sections(observation, history[self.history_summary.count:], goal_state_text))
+        if "observation" in assembled.truncated and self.observation_mode == "delta":
+            # the steps since the keyframe no longer fit, restart them from a new keyframe
+            self.obs_state.request_keyframe()
+        return assembled.text
+
     def generate_random_action(self) -> Optional[str]:
         action_strings = self.generate_action_strings()
         if action_strings:
@@ -169,105 +257,109 @@ class Agent:
         ] with type hint:
         List[Tuple[Node, List[Tuple[GameEntity, List[Action]]]]]
         """
-        banned_strings = ["Center Move Floor", "Center Move Character"]
-        character = GameEntity.get_instance(self.character_id)
-        allowed_actions = grid_map.get_applicable_actions_in_neighborhood(source=character,radius=radius)
-        character_pos = character.position.value
-        allowed_strings = []
-        action_fstring_template = "{direction} {action_name} {entity_type}"
-        for node, entity_list in allowed_actions:
-            target_pos = node.position.value
-            for entity, entity_action_list in entity_list:
-                entity_type = entity.__class__.__name__
-                for actiontype in entity_action_list:
-                    action_name = actiontype.__class__.__name__
-                    direction = self.derive_direction_string_from_pos(character_pos, target_pos)
-                    if direction is not None:
-                        str_out = action_fstring_template.format(direction=direction, action_name=action_name, entity_type=entity_type)
-                        if str_out not in banned_strings:
-                            allowed_strings.append(action_fstring_template.format(direction=direction, action_name=action_name, entity_type=entity_type))
-
-        allowed_strings = sorted(allowed_strings)
-        return allowed_strings  
+        return self.str_action_converter.allowed_action_strings(grid_map, self.character_id, radius=radius)
        
-    def generator_from_allowed_strings(self,allowed_strings: List[str]) -> str:
-        """ return the generator object for the allowed strings, it uses a dictionary as cache to avoid recompiling generators for the same subsets of allowed strings"""
-        if self.llm is not None:
-
-            if self.generator_dict.get(tuple(allowed_strings)) is None:
-                print(f"Generating generator for {allowed_strings}")
-                self.generator_dict[tuple(allowed_strings)] = generate.choice(self.llm, allowed_strings,sampler=samplers.multinomial(top_k=1))
-            return self.generator_dict[tuple(allowed_strings)]
-    
-    def run(self, grid_map: GridMap, max_steps: Optional[int] = None, mdp: bool = True) -> None:
-        step = 0
-        action_result = None
-        actions_results = ActionsResults(results=[])
-
-        while True:
-            print(f"\n--- Step {step} ---")
-
-            if mdp:
-                shape = grid_map.get_rectangle()
-            else:
-                character_node = GameEntity.get_instance(self.character_id).node
-                shape = grid_map.get_shadow(source=character_node, max_radius=5)
-
-            obs_state_text = self.obs_state.generate(shape)
-            action_state_text = self.action_state.generate(action_result) if action_result else ""
-            goal_state_text = self.goal_state.generate(shape)
-            self.action_log.append(action_state_text)
-
-            allowed_action_strings = self.derive_allowed_strings(grid_map)
-            if self.allowed_strings_count.get(tuple(allowed_action_strings)) is None:
-                self.allowed_strings_count[tuple(allowed_action_strings)] = 0
-            self.allowed_strings_count[tuple(allowed_action_strings)] += 1
-            if self.llm:
-                generator_from_allowed_strings = self.generator_from_allowed_strings(allowed_action_strings)
-                joined_action_log = "\n".join(self.action_log)
-                prompt = self.generate_action_prompt(obs_state_text, joined_action_log, goal_state_text)
-                action_string = generator_from_allowed_strings(prompt)
-            else:
-                action_string = random.choice(allowed_action_strings)
+    def generator_from_allowed_strings(self, allowed_strings: List[str]) -> Callable[[str], str]:
+        """ return the generator for the allowed strings: the trie decoder restricted to them when the model is a
+        llama.cpp one, otherwise an outlines choice generator from a bounded LRU cache keyed on the allowed strings"""
+        if self.inference is not None:
+            return functools.partial(self.inference.choose, allowed_strings=allowed_strings, vocabulary=self.action_strings)
+
+    def inference_request(self, allowed_action_strings: List[str], obs_state_text: str, goal_state_text: str) -> Optional[InferenceRequest]:
+        """ The request for the inference service choosing the next action, or None if the agent chooses it with
+        select_action_string, e.g. without a model or with a policy overriding it. """
+        if self.inference is None or type(self).select_action_string is not Agent.select_action_string:
+            return None
+        prompt = self.build_prompt(obs_state_text, goal_state_text)
+        return InferenceRequest(agent_id=self.character_id, prompt=prompt, allowed_strings=allowed_action_strings, vocabulary=tuple(self.action_strings))
     
+    def select_action_string(self, grid_map: GridMap, allowed_action_strings: List[str], obs_state_text: str, goal_state_text: str) -> str:
+        """ Policy of the agent: chooses the next action string among the allowed ones, with the llm when one is
+        loaded and uniformly at random otherwise. Subclasses override it to plug other policies into run."""
+        if self.llm:
+            generator_from_allowed_strings = self.generator_from_allowed_strings(allowed_action_strings)
+            prompt = self.build_prompt(obs_state_text, goal_state_text)
+            return generator_from_allowed_strings(prompt)
+        return random.choice(allowed_action_strings)
+
+    def prepare_step(self, grid_map: GridMap, step: int, mdp: bool = True) -> Tuple[Union[Shadow, Radius, Rectangle], List[str], str, str]:
+        """ Observes the grid map at the start of a step, returns the observed shape, the allowed action strings
+        and the observation and goal texts the next action is chosen from. """
+        if TRACE.level >= TraceLevel.INFO:
+            TRACE.message(f"\n--- Step {step} ---", TraceLevel.INFO)
+
+        if mdp:
+            shape = grid_map.get_rectangle()
+        else:
+            character_node = GameEntity.get_instance(self.character_id).node
+            shape = grid_map.get_shadow(source=character_node, max_radius=5)
 
-            # print("Observation State:")
-            # print(obs_state_text)
-            print("\nAction State:")
-            print(action_state_text)
-            # print("\nGoal State:")
-            # print(goal_state_text)
-
-            print("\nGenerated Action:")
-            print(action_string)
-
-            action_payload = self.convert_action_string(action_string)
-            print("\nAction Payload:")
-            print(action_payload)
+        action_result = self.last_action_result
+        obs_state_text = self.obs_state.generate(shape)
+        action_state_text = self.action_state.generate(action_result) if action_result else ""
+        goal_state_text = self.goal_state.generate(shape)
+        self.action_log.append(action_state_text)
+        self.record_observation(obs_state_text, action_state_text)
+
+        allowed_action_strings = self.derive_allowed_strings(grid_map)
+        if self.allowed_strings_count.get(tuple(allowed_action_strings)) is None:
+            self.allowed_strings_count[tuple(allowed_action_strings)] = 0
+        self.allowed_strings_count[tuple(allowed_action_strings)] += 1
+        if TRACE.level >= TraceLevel.INFO:
+            TRACE.message(f"\nAction State:\n{action_state_text}", TraceLevel.INFO)
+        return shape, allowed_action_strings, obs_state_text, goal_state_text
+
+    def complete_step(self, grid_map: GridMap, shape: Union[Shadow, Radius, Rectangle], action_string: str) -> bool:
+        """ Applies the chosen action string to the grid map, returns whether all the goals are reached. """
+        traced = TRACE.level >= TraceLevel.INFO
+        if traced:
+            TRACE.message(f"\nGenerated Action:\n{action_string}", TraceLevel.INFO)
+
+        action_payload = self.convert_action_string(action_string)
+        if traced:
+            TRACE.message(f"\nAction Payload:\n{action_payload}", TraceLevel.INFO)
+
+        if isinstance(action_payload, str):
+            if traced:
+                TRACE.message(f"Error: {action_payload}", TraceLevel.INFO)
+            action_result = self.create_failed_action_result(action_string, action_payload)
+        else:
+            actions_results = grid_map.apply_actions_payload(action_payload)
+            if traced:
+                TRACE.message(f"\nAction Results:\n{actions_results}", TraceLevel.INFO)
 
-            if isinstance(action_payload, str):
-                print("Error:", action_payload)
-                action_result = self.create_failed_action_result(action_string, action_payload)
+            if actions_results.results:
+                action_result = actions_results.results[0]
             else:
-                actions_results = grid_map.apply_actions_payload(action_payload)
-                print("\nAction Results:")
-                print(actions_results)
-
-                if actions_results.results:
-                    action_result = actions_results.results[0]
-                else:
-                    action_result = None
-
-            self.update_history(action_result, shape, action_string)
+                action_result = None
 
-            if self.check_goals_reached():
-                print(f"\nAll goals reached! in {step} steps.")
-                break
+        self.last_action_result = action_result
+        self.update_history(action_result, shape, action_string)
+        return self.check_goals_reached()
 
-            step += 1
-            if max_steps is not None and step >= max_steps:
-                print(f"\nMax steps ({max_steps}) reached.")
-                break
+    def run(self, grid_map: GridMap, max_steps: Optional[int] = None, mdp: bool = True) -> None:
+        step = 0
+        self.last_action_result = None
+
+        # the goals are re-evaluated only after changes of their dependencies while the monitor follows the ChangeBus
+        self.goal_monitor.attach()
+        try:
+            while True:
+                shape, allowed_action_strings, obs_state_text, goal_state_text = self.prepare_step(grid_map, step, mdp)
+                action_string = self.select_action_string(grid_map, allowed_action_strings, obs_state_text, goal_state_text)
+
+                if self.complete_step(grid_map, shape, action_string):
+                    if TRACE.level >= TraceLevel.INFO:
+                        TRACE.message(f"\nAll goals reached! in {step} steps.", TraceLevel.INFO)
+                    break
+
+                step += 1
+                if max_steps is not None and step >= max_steps:
+                    if TRACE.level >= TraceLevel.INFO:
+                        TRACE.message(f"\nMax steps ({max_steps}) reached.", TraceLevel.INFO)
+                    break
+        finally:
+            self.goal_monitor.detach()
 
     def create_failed_action_result(self, action_string: str, error_message: str) -> Optional[ActionResult]:
         action_parts = action_string.split(" ")
@@ -283,7 +375,7 @@ class Agent:
                     "target": target_entity.get_state() if target_entity else {}
                 }
 
-                action_instance = ActionInstance(source_id=self.character_id, target_id=target_entity.id if target_entity else "", action=action_class())
+                action_instance = ActionInstance(source_id=self.character_id, target_id=target_entity.id if target_entity else "", action=action_class.template())
                 return ActionResult(
                     action_instance=action_instance,
                     success=False,
@@ -308,10 +400,96 @@ class Agent:
 
 
     def check_goals_reached(self) -> bool:
-        for goal in self.goals:
-            source_entity = GameEntity.get_instance(goal.source_entity_id)
-            target_entity = GameEntity.get_instance(goal.target_entity_id) if goal.target_entity_id else None
-            if not goal.prerequisites.is_satisfied(source_entity, target_entity):
-                return False
-        return True
+        return self.goal_monitor.all_satisfied()
+
+    def on_goal_transition(self, transition: GoalTransition):
+        if TRACE.level >= TraceLevel.INFO:
+            TRACE.message(f"Goal {'reached' if transition.satisfied else 'lost'}: {transition.goal_name}", TraceLevel.INFO)
+
+
+class MCTSAgent(Agent):
+    """ Agent choosing its actions with Monte Carlo Tree Search over the allowed action strings, see MCTS.
+    The search is created on the first step with the grid map passed to run, and its tree is reused between steps.
+    """
+    def __init__(self, goals: List[Goal], character_id: str, actions: Dict[str, Action], entity_type_map: Dict[str, Type[GameEntity]],
+                 time_budget: Optional[float] = 1.0, max_rollouts: Optional[int] = None, workers: Optional[int] = None,
+                 rollout_depth: int = 30, seed: int = 0, radius: int = 1):
+        super().__init__(goals, character_id, actions, entity_type_map)
+        self.mcts_kwargs = dict(time_budget=time_budget, max_rollouts=max_rollouts, workers=workers, rollout_depth=rollout_depth, seed=seed, radius=radius)
+        self.mcts: Optional[MCTS] = None
+
+    def select_action_string(self, grid_map: GridMap, allowed_action_strings: List[str], obs_state_text: str, goal_state_text: str) -> str:
+        if self.mcts is None or self.mcts.grid_map is not grid_map:
+            if self.mcts is not None:
+                self.mcts.close()
+            self.mcts = MCTS(grid_map, self.character_id, self.goals, self.actions, self.entity_type_map, **self.mcts_kwargs)
+        action_string = self.mcts.search()
+        stats = self.mcts.stats
+        if TRACE.level >= TraceLevel.INFO:
+            TRACE.record(Timing(time.perf_counter_ns(), "mcts_search", int(stats["elapsed"] * 1e9)))
+            TRACE.message(f"MCTS: {stats['rollouts']} rollouts in {stats['elapsed']:.2f}s, {stats['rollouts_per_second_per_core']:.1f} rollouts/s/core", TraceLevel.INFO)
+        if action_string is None:
+            return random.choice(allowed_action_strings)
+        return action_string
+
+    def close(self):
+        if self.mcts is not None:
+            self.mcts.close()
+
+
+def run_agents(agents: List[Agent], grid_map: GridMap, max_steps: Optional[int] = None, mdp: bool = True) -> int:
+    """
+    Runs several agents on the same grid map in ticks. In a tick every agent still pursuing its goals observes the
+    grid map, the prompts of the agents sharing an inference service are decoded together in one batch, and then
+    the agents act in turn; the actions of a tick are thus chosen from the state at its start.
+
+    Args:
+        agents (List[Agent]): The agents.
+        grid_map (GridMap): The grid map.
+        max_steps (Optional[int]): The maximum number of ticks.
+        mdp (bool): Whether the agents observe the whole grid map rather than their shadow.
+
+    Returns:
+        int: The number of ticks run.
+    """
+    active = list(agents)
+    step = 0
+    for agent in agents:
+        agent.last_action_result = None
+        agent.goal_monitor.attach()
+    try:
+        while active:
+            prepared = {}
+            batches: Dict[int, Tuple[InferenceService, List[InferenceRequest]]] = {}
+            choices: Dict[str, str] = {}
+            for agent in active:
+                shape, allowed_action_strings, obs_state_text, goal_state_text = agent.prepare_step(grid_map, step, mdp)
+                prepared[agent.character_id] = shape
+                request = agent.inference_request(allowed_action_strings, obs_state_text, goal_state_text)
+                if request is None:
+                    choices[agent.character_id] = agent.select_action_string(grid_map, allowed_action_strings, obs_state_text, goal_state_text)
+                else:
+                    batches.setdefault(id(agent.inference), (agent.inference, []))[1].append(request)
+            for inference, requests in batches.values():
+                choices.update(inference.run_batch(requests))
+                if TRACE.level >= TraceLevel.INFO:
+                    TRACE.message(f"Inference batch: {inference.stats['requests']} requests, {inference.stats['model_calls']} model calls in {inference.stats['elapsed']:.2f}s", TraceLevel.INFO)
+
+            remaining = []
+            for agent in active:
+                if agent.complete_step(grid_map, prepared[agent.character_id], choices[agent.character_id]):
+                    if TRACE.level >= TraceLevel.INFO:
+                        TRACE.message(f"\nAll goals of {agent.character_id} reached! in {step} steps.", TraceLevel.INFO)
+                else:
+                    remaining.append(agent)
+            active = remaining
 
+            step += 1
+            if max_steps is not None and step >= max_steps:
+                if TRACE.level >= TraceLevel.INFO:
+                    TRACE.message(f"\nMax steps ({max_steps}) reached.", TraceLevel.INFO)
+                break
+    finally:
+        for agent in agents:
+            agent.goal_monitor.detach()
+    return step
@@ -0,0 +1,170 @@
+# decoding.py
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+
+class TrieNode:
+    """
+    A node of the ActionTrie.
+    Attributes:
+        children (Dict[int, TrieNode]): The child nodes by token ID.
+        reachable (int): Bitmask of the IDs of the strings whose token sequence passes through the node.
+        terminal (Optional[int]): The ID of the string whose token sequence ends at the node.
+    """
+    __slots__ = ("children", "reachable", "terminal")
+
+    def __init__(self):
+        self.children: Dict[int, "TrieNode"] = {}
+        self.reachable = 0
+        self.terminal: Optional[int] = None
+
+
+class ActionTrie:
+    """
+    Token trie over the full vocabulary of action strings, tokenized once. The strings allowed at a step are
+    given as a bitmask over the string IDs, so constraining the decoding to any subset needs no compilation:
+    a token is allowed after a prefix if the child it leads to reaches an allowed string.
+
+    Attributes:
+        strings (List[str]): The action strings, indexed by string ID.
+        prefix (str): The text the strings are tokenized after, e.g. the space following the prompt.
+        max_depth (int): The length of the longest token sequence.
+    """
+
+    def __init__(self, strings: Sequence[str], encode: Callable[[str], List[int]], prefix: str = " "):
+        self.strings = list(strings)
+        self.prefix = prefix
+        self.index = {string: string_id for string_id, string in enumerate(self.strings)}
+        self.root = TrieNode()
+        self.max_depth = 0
+        for string_id, string in enumerate(self.strings):
+            tokens = encode(prefix + string)
+            self.max_depth = max(self.max_depth, len(tokens))
+            node = self.root
+            node.reachable |= 1 << string_id
+            for token in tokens:
+                node = node.children.setdefault(token, TrieNode())
+                node.reachable |= 1 << string_id
+            node.terminal = string_id
+
+    def mask(self, allowed_strings: Sequence[str]) -> int:
+        """
+        Returns the bitmask of the allowed strings; strings outside the vocabulary are ignored.
+        """
+        mask = 0
+        for string in allowed_strings:
+            string_id = self.index.get(string)
+            if string_id is not None:
+                mask |= 1 << string_id
+        return mask
+
+    def walk(self, tokens: Sequence[int]) -> Optional[TrieNode]:
+        """
+        Returns the node reached by a token sequence, or None if no string starts with it.
+        """
+        node = self.root
+        for token in tokens:
+            node = node.children.get(token)
+            if node is None:
+                return None
+        return node
+
+    def allowed_tokens(self, node: TrieNode, mask: int) -> List[int]:
+        """
+        Returns the tokens leading from a node towards an allowed string.
+        """
+        return [token for token, child in node.children.items() if child.reachable & mask]
+
+    def first_allowed(self, node: TrieNode, mask: int) -> Optional[str]:
+        """
+        Returns the allowed string of lowest ID reachable from a node.
+        """
+        reachable = node.reachable & mask
+        if not reachable:
+            return None
+        return self.strings[(reachable & -reachable).bit_length() - 1]
+
+
+class ActionLogitsProcessor:
+    """
+    Logits processor for llama.cpp (called with the input token IDs and the scores of the next token) masking
+    the scores of every token that does not lead to an allowed action string. The end of sequence token is only
+    allowed once a complete allowed string was generated. The prompt length is taken from the first call.
+
+    Attributes:
+        node (Optional[TrieNode]): The trie node reached by the generated tokens.
+    """
+
+    def __init__(self, trie: ActionTrie, mask: int, eos_token: int):
+        self.trie = trie
+        self.mask = mask
+        self.eos_token = eos_token
+        self.node: Optional[TrieNode] = trie.root
+        self._prompt_length: Optional[int] = None
+
+    def __call__(self, input_ids: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        if self._prompt_length is None:
+            self._prompt_length = len(input_ids)
+        self.node = self.trie.walk(input_ids[self._prompt_length:])
+        if self.node is None:
+            allowed = [self.eos_token]
+        else:
+            allowed = self.trie.allowed_tokens(self.node, self.mask)
+            if self.node.terminal is not None and (self.mask >> self.node.terminal) & 1:
+                allowed.append(self.eos_token)
+        masked = np.full_like(scores, -np.inf)
+        masked[allowed] = scores[allowed]
+        return masked
+
+    @property
+    def choice(self) -> Optional[str]:
+        """
+        The action string generated so far, completed to the first allowed string below the reached node.
+        """
+        if self.node is None:
+            return None
+        if self.node.terminal is not None and (self.mask >> self.node.terminal) & 1:
+            return self.trie.strings[self.node.terminal]
+        return self.trie.first_allowed(self.node, self.mask)
+
+
+class ConstrainedActionDecoder:
+    """
+    Greedy decoding of action strings with a llama.cpp model, constrained to the strings allowed at each step by
+    masking the logits through one ActionTrie built over the whole vocabulary, instead of compiling a
+    generator for every distinct set of allowed strings.
+
+    Attributes:
+        model (Any): The llama_cpp.Llama model.
+        trie (ActionTrie): The trie over the action vocabulary.
+    """
+
+    def __init__(self, model: Any, action_strings: Sequence[str], prefix: str = " "):
+        self.model = model
+        self.trie = ActionTrie(action_strings, lambda text: model.tokenize(text.encode("utf-8"), add_bos=False), prefix)
+
+    def choose(self, prompt: str, allowed_strings: Sequence[str]) -> str:
+        """
+        Generates the allowed action string the model prefers after the prompt.
+
+        Args:
+            prompt (str): The prompt.
+            allowed_strings (Sequence[str]): The allowed action strings.
+
+        Returns:
+            str: The chosen action string.
+
+        Raises:
+            ValueError: If none of the allowed strings is in the vocabulary of the trie.
+        """
+        mask = self.trie.mask(allowed_strings)
+        if not mask:
+            raise ValueError(f"None of the allowed strings is in the action vocabulary: {list(allowed_strings)}")
+        if mask & (mask - 1) == 0:
+            return self.trie.first_allowed(self.trie.root, mask)
+        processor = ActionLogitsProcessor(self.trie, mask, self.model.token_eos())
+        completion = self.model.create_completion(prompt, max_tokens=self.trie.max_depth + 1, temperature=0.0, top_k=1, logits_processor=processor)
+        string_id = self.trie.index.get(completion["choices"][0]["text"].strip())
+        if string_id is not None and (mask >> string_id) & 1:
+            return self.trie.strings[string_id]
+        return processor.choice or self.trie.first_allowed(self.trie.root, mask)
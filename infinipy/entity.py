@@ -1,15 +1,31 @@
-from pydantic import BaseModel, Field, ValidationError, validator, field_validator, ValidationInfo
+from pydantic import BaseModel, Field, ValidationError, validator, field_validator, ValidationInfo, PrivateAttr
 from typing import Annotated, Any, Dict, List, Optional, Set, Union, Tuple, Callable
 from pydantic.functional_validators import AfterValidator
+from infinipy.events import ChangeBus, AttributeValueChanged, FieldChanged
 import uuid
 
 
 class RegistryHolder:
     _registry: Dict[str, 'RegistryHolder'] = {}
     _types : Set[type] = set()
+    _handle_table: List[Optional['RegistryHolder']] = []
 
     @classmethod
     def register(cls, instance: 'RegistryHolder'):
+        # the handle is stored on the instance, under the _handle key of its pydantic private state; an instance
+        # registered again under the same ID takes over the handle of the previous one, while a handle carried over
+        # from another process, e.g. by unpickling, is never trusted
+        previous = cls._registry.get(instance.id)
+        handle = previous.handle if previous is not None else None
+        if handle is None:
+            handle = len(cls._handle_table)
+            cls._handle_table.append(instance)
+        else:
+            cls._handle_table[handle] = instance
+        if instance.__pydantic_private__ is None:
+            # models declaring no private attributes have no private state yet
+            object.__setattr__(instance, "__pydantic_private__", {})
+        instance.__pydantic_private__["_handle"] = handle
         cls._registry[instance.id] = instance
         cls._types.add(type(instance))
 
@@ -17,6 +33,33 @@ class RegistryHolder:
     def get_instance(cls, instance_id: str):
         return cls._registry.get(instance_id)
 
+    @classmethod
+    def get_handle(cls, instance_id: str) -> Optional[int]:
+        """
+        Returns the dense integer handle assigned to a registered instance, or None if the ID is unknown.
+        """
+        instance = cls._registry.get(instance_id)
+        return instance.handle if instance is not None else None
+
+    @classmethod
+    def get_instance_by_handle(cls, handle: int):
+        """
+        Returns the registered instance with the given handle, or None if the handle is unknown.
+        """
+        if 0 <= handle < len(cls._handle_table):
+            return cls._handle_table[handle]
+        return None
+
+    @property
+    def handle(self) -> Optional[int]:
+        """
+        Returns the dense integer handle of the instance. Handles index an array and are meant for hot paths and
+        compact wire formats, while the UUID stays the identifier for persistence and external APIs. Handles are
+        local to the process.
+        """
+        private = self.__pydantic_private__
+        return private.get("_handle") if private is not None else None
+
     @classmethod
     def all_instances(cls, filter_type=True):
         if filter_type:
@@ -32,10 +75,17 @@ class RegistryHolder:
         return cls._types
         
 
+# raw (owner ID, field name, previous value) records of the attribute value and field writes of entities and nodes,
+# appended to every open journal; a lighter alternative to ChangeBus subscribers on hot paths, see ActionStates
+WRITE_JOURNALS: List[List[Tuple[str, str, Any]]] = []
+
+
 class Attribute(BaseModel, RegistryHolder):
     name: str = Field("", description="The name of the attribute")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), description="The unique identifier of the attribute")
     value: Any
+    _owner_id: Optional[str] = PrivateAttr(default=None)
+    _owner_field: Optional[str] = PrivateAttr(default=None)
 
     def __init__(self, **data: Any):
         super().__init__(**data)
@@ -43,18 +93,102 @@ class Attribute(BaseModel, RegistryHolder):
             self.name = self.__class__.__name__
         self.register(self)
 
+    def bind_owner(self, owner_id: str, field_name: str):
+        """
+        Records the entity or node storing this attribute, so that value writes bump the owner's version
+        and can be reported on the ChangeBus.
+
+        Args:
+            owner_id (str): The ID of the owner.
+            field_name (str): The field name under which the owner stores the attribute.
+        """
+        private = self.__pydantic_private__
+        private["_owner_id"] = owner_id
+        private["_owner_field"] = field_name
+
+    def __setattr__(self, name: str, value: Any):
+        # private attributes are read through __pydantic_private__ on hot paths,
+        # pydantic's __getattr__ fallback is an order of magnitude slower
+        owner_id = self.__pydantic_private__["_owner_id"] if name == "value" else None
+        if owner_id is not None:
+            old_value = self.__dict__.get("value")
+            super().__setattr__(name, value)
+            if old_value != value:
+                owner = RegistryHolder.get_instance(owner_id)
+                if owner is not None:
+                    owner.touch()
+                if WRITE_JOURNALS:
+                    for journal in WRITE_JOURNALS:
+                        journal.append((owner_id, self.__pydantic_private__["_owner_field"], old_value))
+                if ChangeBus.active:
+                    ChangeBus.emit(AttributeValueChanged(owner_id=owner_id, attr_name=self._owner_field, old_value=old_value, new_value=value))
+        else:
+            super().__setattr__(name, value)
+
+
+def bind_attributes(owner: BaseModel):
+    """
+    Binds every Attribute stored in the fields of an entity or node to its owner.
+
+    Args:
+        owner (BaseModel): The entity or node owning the attributes.
+    """
+    for field_name, field_value in owner.__dict__.items():
+        if isinstance(field_value, Attribute):
+            field_value.bind_owner(owner.id, field_name)
+
+
+UNVERSIONED_FIELDS = {"hash_resolution"}
+
+
+def observe_field_write(owner: BaseModel, field_name: str, old_value: Any, new_value: Any):
+    """
+    Bookkeeping shared by the observed setters of entities and nodes after a field was reassigned.
+
+    Args:
+        owner (BaseModel): The entity or node whose field was reassigned.
+        field_name (str): The name of the reassigned field.
+        old_value (Any): The object stored in the field before the write.
+        new_value (Any): The object stored in the field after the write.
+    """
+    if old_value is new_value:
+        return
+    if isinstance(new_value, Attribute):
+        new_value.bind_owner(owner.id, field_name)
+    if field_name == "node":
+        # moves are counted apart, see GameEntity.state_version
+        owner.__pydantic_private__["_node_writes"] += 1
+    if field_name not in UNVERSIONED_FIELDS:
+        owner.touch()
+    if WRITE_JOURNALS:
+        for journal in WRITE_JOURNALS:
+            journal.append((owner.id, field_name, old_value))
+    if ChangeBus.active:
+        ChangeBus.emit(FieldChanged(owner_id=owner.id, field_name=field_name, old_value=old_value, new_value=new_value))
+
 
 
 class Entity(BaseModel, RegistryHolder):
     name: str = Field("", description="The name of the entity")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), description="The unique identifier of the entity")
+    _version: int = PrivateAttr(default=0)
+    _attributes_cache: Optional[Tuple[int, List[Tuple["Entity", int]], Dict[str, Attribute]]] = PrivateAttr(default=None)
 
     def __init__(self, **data: Any):
         super().__init__(**data)
         if not self.name:
             self.name = self.__class__.__name__
         self.register(self)
-        
+        bind_attributes(self)
+
+    def __setattr__(self, name: str, value: Any):
+        # __pydantic_fields__ is the dict behind the model_fields class property, a few times faster to read
+        if name in type(self).__pydantic_fields__:
+            old_value = self.__dict__.get(name)
+            super().__setattr__(name, value)
+            observe_field_write(self, name, old_value, value)
+        else:
+            super().__setattr__(name, value)
     
     @field_validator('*', mode='after')
     def check_attributes_and_entities(cls, v: Any, info: ValidationInfo):
@@ -62,15 +196,56 @@ class Entity(BaseModel, RegistryHolder):
             raise ValueError(f"Attributes must be instances of Attribute or Entity, got {type(v).__name__} for field {info.field_name}")
         return v
 
-    
+
+    def __eq__(self, other: Any) -> bool:
+        # entities with different IDs never compare equal, skip pydantic's comparison of private state and fields
+        if self is other:
+            return True
+        if isinstance(other, Entity) and self.id != other.id:
+            return False
+        return super().__eq__(other)
+
+    def __getstate__(self) -> Dict[Any, Any]:
+        # memoized views are local to the process, they are rebuilt on first use after unpickling
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_attributes_cache": None}
+        return state
+
+    @property
+    def version(self) -> int:
+        """
+        Returns a counter that is bumped every time a field or an owned attribute value of the entity changes.
+        """
+        return self.__pydantic_private__["_version"]
+
+    def touch(self):
+        """
+        Bumps the version of the entity, invalidating every cache keyed on it.
+        """
+        self.__pydantic_private__["_version"] += 1
+
     def all_attributes(self) -> Dict[str, 'Attribute']:
+        """
+        Returns the attributes of the entity and of its nested entities, keyed by field name.
+
+        The result is memoized until the version of the entity or of one of its nested entities changes,
+        so it is shared between callers and must be treated as read-only.
+        """
+        private = self.__pydantic_private__
+        cached = private["_attributes_cache"]
+        if cached is not None and cached[0] == private["_version"] and (not cached[1] or all(entity.version == version for entity, version in cached[1])):
+            return cached[2]
         attributes = {}
+        dependencies = []
         for attribute_name, attribute_value in self.__dict__.items():
             if isinstance(attribute_value, Attribute):
                 attributes[attribute_name] = attribute_value
             elif isinstance(attribute_value, Entity):
                 nested_attributes = attribute_value.all_attributes()
                 attributes.update(nested_attributes)
+                dependencies.append((attribute_value, attribute_value.version))
+                dependencies.extend(attribute_value.__pydantic_private__["_attributes_cache"][1])
+        private["_attributes_cache"] = (private["_version"], dependencies, attributes)
         return attributes
     
 
@@ -0,0 +1,123 @@
+# events.py
+from typing import Any, Callable, List, Optional, Tuple, Type
+from pydantic import BaseModel, Field
+
+
+class ChangeEvent(BaseModel):
+    """
+    Base class for the typed change records emitted on the ChangeBus.
+    """
+
+
+class AttributeValueChanged(ChangeEvent):
+    """
+    Emitted when the value of an Attribute owned by an entity or a node changes through an in-place write.
+    Attributes:
+        owner_id (str): The ID of the entity or node owning the attribute.
+        attr_name (str): The field name under which the owner stores the attribute.
+        old_value (Any): The value before the write.
+        new_value (Any): The value after the write.
+    """
+    owner_id: str = Field(description="The ID of the entity or node owning the attribute")
+    attr_name: str = Field(description="The field name under which the owner stores the attribute")
+    old_value: Any = Field(default=None, description="The value before the write")
+    new_value: Any = Field(default=None, description="The value after the write")
+
+
+class FieldChanged(ChangeEvent):
+    """
+    Emitted when a field of an entity or a node is reassigned to a different object, e.g. an Attribute replaced by
+    update_attributes or the node/stored_in/inventory references of a GameEntity.
+    Attributes:
+        owner_id (str): The ID of the entity or node whose field was reassigned.
+        field_name (str): The name of the reassigned field.
+        old_value (Any): The object stored in the field before the write.
+        new_value (Any): The object stored in the field after the write.
+    """
+    owner_id: str = Field(description="The ID of the entity or node whose field was reassigned")
+    field_name: str = Field(description="The name of the reassigned field")
+    old_value: Any = Field(default=None, description="The object stored in the field before the write")
+    new_value: Any = Field(default=None, description="The object stored in the field after the write")
+
+
+class NodeEntitiesChanged(ChangeEvent):
+    """
+    Emitted when an entity is added to or removed from the entity list of a node.
+    Attributes:
+        node_id (str): The ID of the node.
+        entity_id (str): The ID of the entity added or removed.
+        added (bool): True if the entity was added, False if it was removed.
+        index (int): The position in the entity list at which the entity was added or removed.
+    """
+    node_id: str = Field(description="The ID of the node")
+    entity_id: str = Field(description="The ID of the entity added or removed")
+    added: bool = Field(description="True if the entity was added, False if it was removed")
+    index: int = Field(description="The position in the entity list at which the entity was added or removed")
+
+
+class InventoryChanged(ChangeEvent):
+    """
+    Emitted when an item is added to or removed from the inventory list of an entity.
+    Attributes:
+        owner_id (str): The ID of the entity owning the inventory.
+        item_id (str): The ID of the item added or removed.
+        added (bool): True if the item was added, False if it was removed.
+        index (int): The position in the inventory list at which the item was added or removed.
+    """
+    owner_id: str = Field(description="The ID of the entity owning the inventory")
+    item_id: str = Field(description="The ID of the item added or removed")
+    added: bool = Field(description="True if the item was added, False if it was removed")
+    index: int = Field(description="The position in the inventory list at which the item was added or removed")
+
+
+ChangeCallback = Callable[[ChangeEvent], None]
+
+
+class ChangeBus:
+    """
+    Process wide observer registry for state changes of entities, attributes, nodes and inventories.
+
+    Emitters guard every emission with `if ChangeBus.active:` so that no event object is built
+    while nobody is subscribed.
+    """
+    _subscribers: List[Tuple[ChangeCallback, Optional[Tuple[Type[ChangeEvent], ...]]]] = []
+    active: bool = False
+
+    @classmethod
+    def subscribe(cls, callback: ChangeCallback, event_types: Optional[List[Type[ChangeEvent]]] = None) -> ChangeCallback:
+        """
+        Registers a callback for change events.
+
+        Args:
+            callback (ChangeCallback): The function called with each matching event.
+            event_types (Optional[List[Type[ChangeEvent]]]): The event types to receive. If not provided, all events are received.
+
+        Returns:
+            ChangeCallback: The registered callback, so that it can be passed to unsubscribe.
+        """
+        cls._subscribers.append((callback, tuple(event_types) if event_types else None))
+        cls.active = True
+        return callback
+
+    @classmethod
+    def unsubscribe(cls, callback: ChangeCallback):
+        """
+        Removes every registration of a callback.
+
+        Args:
+            callback (ChangeCallback): The callback to remove.
+        """
+        cls._subscribers = [(subscriber, types) for subscriber, types in cls._subscribers if subscriber != callback]
+        cls.active = bool(cls._subscribers)
+
+    @classmethod
+    def emit(cls, event: ChangeEvent):
+        """
+        Delivers an event to the subscribers registered for its type, in subscription order.
+
+        Args:
+            event (ChangeEvent): The event to deliver.
+        """
+        for callback, event_types in list(cls._subscribers):
+            if event_types is None or isinstance(event, event_types):
+                callback(event)
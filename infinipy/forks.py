@@ -0,0 +1,256 @@
+# forks.py
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from infinipy.entity import RegistryHolder
+from infinipy.nodes import change_in_grid_map
+from infinipy.events import ChangeBus, ChangeEvent
+from infinipy.transactions import undo_change, redo_change
+import pickle
+import weakref
+import typing
+if typing.TYPE_CHECKING:
+    from infinipy.gridmap import GridMap
+
+
+class WorldFork:
+    """
+    A lightweight fork of a world, stored as the log of changes made on top of its parent fork.
+
+    Entities, nodes and attributes are shared by all the forks of a world and keep their IDs, so forks never
+    collide in the global registry: a fork only owns its change log, and creating one costs a few allocations.
+    A single fork per grid map is active at a time and the shared objects hold its state. Activating another
+    fork reverts the changes of the active one up to their common ancestor and replays the changes down to the
+    new one, in O(changes) through the observed setters, so versions and ChangeBus subscribers stay consistent.
+    Changes made to the grid map while a fork is active are recorded into its log, changes to other grid maps
+    and to free entities are ignored. The active fork only listens to the ChangeBus while it has something to
+    record: a fork other than the root always does, and the root only until the next change after it was forked,
+    which marks its children stale.
+
+        root = WorldFork.root(grid_map)
+        with root.fork() as rollout:
+            grid_map.apply_action_instance(action_instance, record_states=False, verbose=False)
+        # the world is back to the state of root
+
+    Forks taken from a fork describe changes relative to its state at that moment, so a fork that is changed
+    after being forked marks its existing descendants stale, and activating a stale fork raises a RuntimeError.
+    Use export_world/import_world to hand the state of a fork to a worker process.
+
+    Attributes:
+        grid_map_id (str): The ID of the grid map the fork belongs to.
+        parent (Optional[WorldFork]): The fork this fork was taken from, None for the root.
+        changes (List[ChangeEvent]): The changes made on top of the parent, in order.
+    """
+    _roots: Dict[str, "WorldFork"] = {}
+    _active: Dict[str, "WorldFork"] = {}
+
+    def __init__(self, grid_map_id: str, parent: Optional["WorldFork"] = None):
+        self.grid_map_id = grid_map_id
+        self.parent = parent
+        self.changes: List[ChangeEvent] = []
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self._children: "weakref.WeakSet[WorldFork]" = weakref.WeakSet()
+        self._stale = False
+        self._subscribed = False
+        self._previous: List[WorldFork] = []
+
+    @classmethod
+    def root(cls, grid_map: "GridMap") -> "WorldFork":
+        """
+        Returns the root fork of a grid map, created from its current state and activated on first use.
+
+        Args:
+            grid_map (GridMap): The grid map.
+
+        Returns:
+            WorldFork: The root fork.
+        """
+        root = cls._roots.get(grid_map.id)
+        if root is None:
+            root = cls._roots[grid_map.id] = cls(grid_map.id)
+            cls._active[grid_map.id] = root
+        return root
+
+    @classmethod
+    def release(cls, grid_map: "GridMap"):
+        """
+        Drops the forks of a grid map, keeping the state of the active fork, and stops recording changes.
+        Existing forks become stale.
+
+        Args:
+            grid_map (GridMap): The grid map.
+        """
+        root = cls._roots.pop(grid_map.id, None)
+        active = cls._active.pop(grid_map.id, None)
+        if active is not None:
+            active._unsubscribe()
+        if root is not None:
+            root._stale = True
+
+    @classmethod
+    def active(cls, grid_map: "GridMap") -> Optional["WorldFork"]:
+        """
+        Returns the active fork of a grid map, or None if the grid map was never forked.
+        """
+        return cls._active.get(grid_map.id)
+
+    @property
+    def is_active(self) -> bool:
+        return WorldFork._active.get(self.grid_map_id) is self
+
+    @property
+    def is_stale(self) -> bool:
+        fork = self
+        while fork is not None:
+            if fork._stale:
+                return True
+            fork = fork.parent
+        return False
+
+    def fork(self) -> "WorldFork":
+        """
+        Creates a child fork sharing the current state of this fork. The child is not activated.
+
+        Returns:
+            WorldFork: The child fork.
+        """
+        child = WorldFork(self.grid_map_id, parent=self)
+        self._children.add(child)
+        if self.is_active:
+            # changes made to this fork from now on make the child stale
+            self._subscribe()
+        return child
+
+    def lineage(self) -> List["WorldFork"]:
+        """
+        Returns the forks from the root down to this fork.
+        """
+        forks = []
+        fork = self
+        while fork is not None:
+            forks.append(fork)
+            fork = fork.parent
+        return forks[::-1]
+
+    def _subscribe(self):
+        if not self._subscribed:
+            ChangeBus.subscribe(self.record)
+            self._subscribed = True
+
+    def _unsubscribe(self):
+        if self._subscribed:
+            ChangeBus.unsubscribe(self.record)
+            self._subscribed = False
+
+    def record(self, event: ChangeEvent):
+        if not change_in_grid_map(event, self.grid_map_id):
+            return
+        if self._children:
+            for child in list(self._children):
+                child._stale = True
+            self._children = weakref.WeakSet()
+        # the root is a common ancestor of every fork and is never reverted, so it keeps no log
+        if self.parent is not None:
+            self.changes.append(event)
+        else:
+            self._unsubscribe()
+
+    def activate(self) -> "WorldFork":
+        """
+        Makes the shared world objects hold the state of this fork and starts recording changes into it.
+
+        Returns:
+            WorldFork: The fork itself.
+
+        Raises:
+            RuntimeError: If the fork is stale, or if the root of the grid map was never created.
+        """
+        if self.is_stale:
+            raise RuntimeError("Cannot activate a fork whose ancestors changed after it was taken")
+        current = WorldFork._active.get(self.grid_map_id)
+        if current is None:
+            raise RuntimeError(f"No root fork for grid map {self.grid_map_id}, create it with WorldFork.root")
+        if current is self:
+            return self
+        current._unsubscribe()
+        target_lineage = self.lineage()
+        target_forks = set(map(id, target_lineage))
+        fork = current
+        while id(fork) not in target_forks:
+            for event in reversed(fork.changes):
+                undo_change(event)
+            fork = fork.parent
+        for descendant in target_lineage[fork.depth + 1:]:
+            for event in descendant.changes:
+                redo_change(event)
+        WorldFork._active[self.grid_map_id] = self
+        if self.parent is not None or self._children:
+            self._subscribe()
+        return self
+
+    def __enter__(self) -> "WorldFork":
+        self._previous.append(WorldFork._active[self.grid_map_id])
+        return self.activate()
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback) -> bool:
+        self._previous.pop().activate()
+        return False
+
+
+def register_world(grid_map: "GridMap"):
+    """
+    Registers the grid map and every registry object reachable from it (nodes, entities, stored items and
+    attributes) under their IDs, e.g. after unpickling it in another process.
+
+    Args:
+        grid_map (GridMap): The grid map.
+    """
+    seen = set()
+    stack = [grid_map]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, RegistryHolder):
+            RegistryHolder.register(value)
+        if isinstance(value, BaseModel):
+            stack.extend(value.__dict__.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+
+def export_world(grid_map: "GridMap") -> bytes:
+    """
+    Serializes a grid map with its nodes, entities and attributes in the state of the active fork,
+    to be loaded with import_world in a worker process. Only the world state is exported: the caches local
+    to the process (memoized hashes and attribute views, the applicability index and cache) are left out and
+    rebuilt on first use by the importing process.
+
+    Args:
+        grid_map (GridMap): The grid map.
+
+    Returns:
+        bytes: The pickled world.
+    """
+    return pickle.dumps(grid_map, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def import_world(data: bytes) -> "GridMap":
+    """
+    Loads a world serialized with export_world and registers its objects.
+
+    Args:
+        data (bytes): The pickled world.
+
+    Returns:
+        GridMap: The grid map.
+
+    Raises:
+        ValueError: If the grid map is already registered in this process, since importing it would
+            shadow the registry entries of the live objects.
+    """
+    grid_map = pickle.loads(data)
+    if RegistryHolder.get_instance(grid_map.id) is not None:
+        raise ValueError(f"Grid map {grid_map.id} is already registered in this process, use WorldFork to fork it")
+    register_world(grid_map)
+    return grid_map
@@ -179,7 +179,7 @@ class InputHandler:
     def get_available_actions(self, source: GameEntity, target: GameEntity) -> List[str]:
         available_actions = []
         for action_class in Action.__subclasses__():
-            action = action_class()
+            action = action_class.template()
             if action.is_applicable(source, target):
                 available_actions.append(action.name)
         return available_actions
@@ -0,0 +1,352 @@
+# goals.py
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from pydantic import BaseModel, Field
+from infinipy.actions import Goal
+from infinipy.nodes import GameEntity
+from infinipy.payloads import ActionInstance, ActionsPayload
+from infinipy.events import ChangeBus, ChangeEvent, AttributeValueChanged, FieldChanged, NodeEntitiesChanged, InventoryChanged
+from infinipy.forks import WorldFork
+from infinipy.hashing import WorldHasher, TranspositionTable, LOCATION_FIELDS
+import heapq
+import itertools
+import typing
+if typing.TYPE_CHECKING:
+    from infinipy.gridmap import GridMap
+
+
+class Plan(BaseModel):
+    """
+    A sequence of actions reaching a goal, found by the GoapPlanner.
+    Attributes:
+        goal_name (str): The name of the goal.
+        actions (List[ActionInstance]): The actions to apply, in order.
+        expanded (int): The number of search nodes expanded to find the plan.
+    """
+    goal_name: str = Field(description="The name of the goal")
+    actions: List[ActionInstance] = Field(default_factory=list, description="The actions to apply, in order")
+    expanded: int = Field(default=0, description="The number of search nodes expanded to find the plan")
+
+    @property
+    def cost(self) -> int:
+        return len(self.actions)
+
+    def to_payload(self) -> ActionsPayload:
+        """
+        Returns the plan as a payload for GridMap.apply_actions_payload, which applies the actions in order.
+        """
+        return ActionsPayload(actions=list(self.actions))
+
+
+class GoapPlanner:
+    """
+    Goal oriented action planner running A* over world states.
+
+    States are expanded by applying the applicable actions of the agent in its neighbourhood, through their
+    declared consequences, inside WorldFork children of the state they come from. The world is restored to
+    its initial state when planning ends. Every action costs 1, and the heuristic counts the unsatisfied goal
+    statements plus the distance of the agent to the goal entity. States are deduplicated through the Zobrist
+    hash of the world, maintained incrementally while the forks are switched, in a bounded transposition table.
+
+    Attributes:
+        grid_map (GridMap): The grid map to plan in.
+        radius (int): The radius of the neighbourhood searched for applicable actions.
+        max_expansions (int): The node budget: the maximum number of states expanded before giving up.
+        table_size (int): The maximum number of states kept in the transposition table.
+    """
+
+    def __init__(self, grid_map: "GridMap", radius: int = 1, max_expansions: int = 5000, table_size: int = 100_000):
+        self.grid_map = grid_map
+        self.radius = radius
+        self.max_expansions = max_expansions
+        self.hasher = WorldHasher(grid_map)
+        self.table_size = table_size
+
+    def state_key(self) -> int:
+        return self.hasher.value
+
+    def heuristic(self, agent: GameEntity, goal: Goal) -> int:
+        """
+        Estimates the number of actions left to reach the goal from the current state.
+
+        Args:
+            agent (GameEntity): The acting entity.
+            goal (Goal): The goal.
+
+        Returns:
+            int: The number of unsatisfied goal statements, plus the distance from the agent to the goal target,
+            or to the goal source when the goal has no target, minus one since actions reach neighbouring nodes.
+        """
+        source = GameEntity.get_instance(goal.source_entity_id)
+        target = GameEntity.get_instance(goal.target_entity_id) if goal.target_entity_id else None
+        prerequisites = goal.prerequisites
+        unsatisfied = 0
+        for statement in prerequisites.source_statements:
+            if not (statement.validate_condition(source) and statement.validate_callables(source, target)):
+                unsatisfied += 1
+        for statement in prerequisites.target_statements:
+            if target is None or not (statement.validate_condition(target) and statement.validate_callables(source, target)):
+                unsatisfied += 1
+        for statement in prerequisites.source_target_statements:
+            if target is None or not (statement.validate_comparisons(source, target) and statement.validate_callables(source, target)):
+                unsatisfied += 1
+        focus = target if target is not None else source
+        if focus is None or focus is agent or focus.stored_in is agent:
+            return unsatisfied
+        agent_x, agent_y = agent.position.value
+        focus_x, focus_y = focus.position.value
+        return unsatisfied + max(0, max(abs(agent_x - focus_x), abs(agent_y - focus_y)) - 1)
+
+    def applicable_action_instances(self, agent: GameEntity) -> List[ActionInstance]:
+        action_instances = []
+        for node, entity_actions in self.grid_map.get_applicable_actions_in_neighborhood(agent, self.radius):
+            for entity, actions in entity_actions:
+                for action in actions:
+                    action_instances.append(ActionInstance(source_id=agent.id, target_id=entity.id, action=action))
+        return action_instances
+
+    def plan(self, agent: GameEntity, goal: Goal) -> Optional[Plan]:
+        """
+        Searches for the shortest sequence of actions of the agent achieving the goal.
+
+        Args:
+            agent (GameEntity): The acting entity.
+            goal (Goal): The goal to achieve.
+
+        Returns:
+            Optional[Plan]: The plan, or None if the goal cannot be reached within the node budget.
+        """
+        owns_root = WorldFork.active(self.grid_map) is None
+        start = WorldFork.active(self.grid_map) or WorldFork.root(self.grid_map)
+        counter = itertools.count()
+        self.hasher.attach()
+        try:
+            if goal.is_achieved():
+                return Plan(goal_name=goal.name)
+            start_fork = start.fork()
+            open_heap = [(self.heuristic(agent, goal), next(counter), 0, start_fork, [])]
+            best_costs: TranspositionTable[int] = TranspositionTable(self.table_size)
+            best_costs.store(self.state_key(), 0)
+            expanded = 0
+            while open_heap and expanded < self.max_expansions:
+                _, _, cost, fork, actions = heapq.heappop(open_heap)
+                fork.activate()
+                expanded += 1
+                for action_instance in self.applicable_action_instances(agent):
+                    child = fork.fork()
+                    child.activate()
+                    result = self.grid_map.apply_action_instance(action_instance, record_states=False, verbose=False)
+                    if result.success:
+                        child_actions = actions + [action_instance]
+                        if goal.is_achieved():
+                            return Plan(goal_name=goal.name, actions=child_actions, expanded=expanded)
+                        key = self.state_key()
+                        if cost + 1 < best_costs.get(key, cost + 2):
+                            best_costs.store(key, cost + 1)
+                            heapq.heappush(open_heap, (cost + 1 + self.heuristic(agent, goal), next(counter), cost + 1, child, child_actions))
+                    fork.activate()
+            return None
+        finally:
+            start.activate()
+            self.hasher.detach()
+            if owns_root:
+                WorldFork.release(self.grid_map)
+
+
+class GoalTransition(BaseModel):
+    """
+    Reported by a GoalMonitor when a goal becomes satisfied or unsatisfied.
+    Attributes:
+        goal_name (str): The name of the goal.
+        satisfied (bool): Whether the goal is now satisfied.
+    """
+    goal_name: str = Field(description="The name of the goal")
+    satisfied: bool = Field(description="Whether the goal is now satisfied")
+
+
+GoalCallback = Callable[[GoalTransition], None]
+
+
+class GoalMonitor:
+    """
+    Tracks whether a set of goals is satisfied, re-evaluating a goal only after a change of one of its
+    dependencies (see Goal.get_dependencies) was reported on the ChangeBus. Changes only mark goals as dirty;
+    the dirty goals are evaluated on the next query, so many changes between two queries cost one evaluation.
+
+    Goals depending on any change of an entity also depend on its location, which follows the containers
+    storing it: moving a chest re-evaluates the goals on the items inside it.
+
+    While detached, the monitor cannot see changes and evaluates every goal on each query.
+
+    The goal list is shared with the caller, e.g. with the GoalState of an agent: goals appended to or removed
+    from it are picked up on the next query.
+
+    Attributes:
+        goals (List[Goal]): The monitored goals.
+        satisfied (List[bool]): Whether each goal was satisfied at the last evaluation.
+        evaluations (int): The number of goal evaluations so far.
+    """
+
+    def __init__(self, goals: List[Goal]):
+        self.goals = goals
+        self.satisfied: List[bool] = []
+        self.evaluations = 0
+        self._indexed: List[Goal] = []
+        self._versions: List[int] = []
+        self._dirty: Set[int] = set()
+        self._index: Dict[int, int] = {}
+        self._watchers: Dict[str, List[Tuple[int, Optional[str]]]] = {}
+        self._located: Dict[str, List[int]] = {}
+        self._callbacks: List[GoalCallback] = []
+        self._attached = False
+        self._sync()
+
+    def _sync(self):
+        """
+        Rebuilds the dependency index if the goal list changed since it was built. The goals kept retain their
+        status, so that only the goals added can report a transition, and every goal is re-evaluated once.
+        """
+        goals = self.goals
+        if len(goals) == len(self._indexed) and all(goal is indexed for goal, indexed in zip(goals, self._indexed)):
+            return
+        previous = {id(goal): (self.satisfied[index], self._versions[index]) for index, goal in enumerate(self._indexed)}
+        self._indexed = list(goals)
+        self.satisfied = [previous.get(id(goal), (False, 0))[0] for goal in goals]
+        self._versions = [previous.get(id(goal), (False, 0))[1] for goal in goals]
+        self._index = {id(goal): index for index, goal in enumerate(goals)}
+        self._watchers = {}
+        self._located = {}
+        for index, goal in enumerate(goals):
+            for entity_id, attr_name in goal.get_dependencies():
+                self._watchers.setdefault(entity_id, []).append((index, attr_name))
+                if attr_name is None:
+                    self._located.setdefault(entity_id, []).append(index)
+        self._dirty = set()
+        self._mark_all()
+
+    def add_goal(self, goal: Goal):
+        self.goals.append(goal)
+        self._sync()
+
+    def remove_goal(self, goal: Goal):
+        self.goals.remove(goal)
+        self._sync()
+
+    def subscribe(self, callback: GoalCallback) -> GoalCallback:
+        """
+        Registers a callback called with every transition found by refresh.
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def attach(self) -> "GoalMonitor":
+        """
+        Starts following the ChangeBus. Every goal is re-evaluated on the next query, since the state may have
+        changed while the monitor was detached.
+
+        Returns:
+            GoalMonitor: The monitor itself.
+        """
+        if not self._attached:
+            ChangeBus.subscribe(self.on_change)
+            self._attached = True
+            self._mark_all()
+        return self
+
+    def detach(self):
+        if self._attached:
+            ChangeBus.unsubscribe(self.on_change)
+            self._attached = False
+
+    @property
+    def attached(self) -> bool:
+        return self._attached
+
+    def version(self, goal: Goal) -> Optional[int]:
+        """
+        Returns a counter increased on every change that may affect the goal, to key caches of text derived from
+        it, or None when the goal is not monitored or the monitor is detached.
+        """
+        self._sync()
+        index = self._index.get(id(goal))
+        if index is None or not self._attached:
+            return None
+        return self._versions[index]
+
+    def on_change(self, event: ChangeEvent):
+        if isinstance(event, AttributeValueChanged):
+            self._touch(event.owner_id, event.attr_name)
+        elif isinstance(event, FieldChanged):
+            self._touch(event.owner_id, event.field_name)
+            if event.field_name in LOCATION_FIELDS:
+                self._touch_location(event.owner_id)
+        elif isinstance(event, NodeEntitiesChanged):
+            self._touch(event.entity_id, "node")
+        elif isinstance(event, InventoryChanged):
+            self._touch(event.owner_id, "inventory")
+            self._touch(event.item_id, "stored_in")
+            self._touch_location(event.item_id)
+
+    def _mark(self, index: int):
+        self._dirty.add(index)
+        self._versions[index] += 1
+
+    def _mark_all(self):
+        for index in range(len(self._indexed)):
+            self._mark(index)
+
+    def _touch(self, entity_id: str, name: str):
+        for index, attr_name in self._watchers.get(entity_id, ()):
+            if attr_name is None or attr_name == name:
+                self._mark(index)
+
+    def _touch_location(self, moved_id: str):
+        for entity_id, indices in self._located.items():
+            if entity_id == moved_id:
+                continue
+            entity = GameEntity.get_instance(entity_id)
+            container = entity.stored_in if entity is not None else None
+            while container is not None:
+                if container.id == moved_id:
+                    for index in indices:
+                        self._mark(index)
+                    break
+                container = container.stored_in
+
+    def refresh(self) -> List[GoalTransition]:
+        """
+        Evaluates the dirty goals and reports the goals whose status changed to the subscribed callbacks.
+
+        Returns:
+            List[GoalTransition]: The transitions, in the order of the goals.
+        """
+        self._sync()
+        if not self._attached:
+            self._mark_all()
+        transitions = []
+        for index in sorted(self._dirty):
+            goal = self._indexed[index]
+            satisfied = goal.is_achieved()
+            self.evaluations += 1
+            if satisfied != self.satisfied[index]:
+                self.satisfied[index] = satisfied
+                transitions.append(GoalTransition(goal_name=goal.name, satisfied=satisfied))
+        self._dirty.clear()
+        for transition in transitions:
+            for callback in self._callbacks:
+                callback(transition)
+        return transitions
+
+    def is_satisfied(self, goal: Goal) -> bool:
+        self.refresh()
+        return self.satisfied[self._index[id(goal)]]
+
+    def all_satisfied(self) -> bool:
+        self.refresh()
+        return all(self.satisfied)
+
+    def __enter__(self) -> "GoalMonitor":
+        return self.attach()
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback) -> bool:
+        self.detach()
+        return False
@@ -1,15 +1,35 @@
 # gridmap.py
-from typing import List, Tuple, Dict, Optional, Union, Type, Any
-from pydantic import BaseModel, Field
-from infinipy.entity import RegistryHolder
+from typing import List, Tuple, Dict, Optional, Union, Type, Any, Set, get_args, get_origin
+from pydantic import BaseModel, Field, PrivateAttr
+from infinipy.entity import RegistryHolder, Entity
 from infinipy.nodes import Node, GameEntity, Position
-from infinipy.actions import Action
-from infinipy.payloads import ActionsPayload, ActionInstance, SummarizedActionPayload, ActionResult, ActionsResults
+from infinipy.actions import Action, PrerequisiteFailure
+from infinipy.payloads import ActionsPayload, ActionInstance, SummarizedActionPayload, ActionResult, ActionsResults, ActionStates
 from infinipy.errors import ActionConversionError, AmbiguousEntityError
 from infinipy.spatial import VisibilityGraph, WalkableGraph, PathDistanceResult, shadow_casting, dijkstra, a_star, line_of_sight
 from infinipy.shapes import Radius, Shadow, RayCast, Path, Rectangle, BlockedRaycast
+from infinipy.trace import TRACE, TraceLevel, ActionAttempted, ActionCompleted, PrerequisiteFailed, StateDiff, Timing
+from collections import OrderedDict
+import time
 import uuid
 
+# the maximum number of (source, target) pairs whose applicable actions are cached
+APPLICABILITY_CACHE_SIZE = 100_000
+
+
+def may_hold_entity(annotation: Any) -> bool:
+    """
+    Checks whether a field annotation admits Entity values, whose attributes are merged into all_attributes.
+    """
+    if annotation is Any:
+        return True
+    if isinstance(annotation, type):
+        return issubclass(annotation, Entity)
+    if get_origin(annotation) is Union:
+        return any(may_hold_entity(arg) for arg in get_args(annotation))
+    return False
+
+
 class GridMap(BaseModel, RegistryHolder):
     id: str = Field("", description="The unique identifier of the grid map")
     width: int = Field(description="The width of the grid map")
@@ -17,6 +37,8 @@ class GridMap(BaseModel, RegistryHolder):
     grid: List[List[Node]] = Field(description="The 2D grid of nodes")
     actions: Dict[str, Type[Action]] = Field(default_factory=dict, description="The registered actions")
     entity_type_map: Dict[str, Type[GameEntity]] = Field(default_factory=dict, description="The mapping of entity type names to entity classes")
+    _applicability_index: Dict[Type[GameEntity], Tuple[List[str], List[Type[Action]]]] = PrivateAttr(default_factory=dict)
+    _applicability_cache: "OrderedDict[Tuple[str, str], Tuple[Tuple[int, int, int, int], List[Type[Action]]]]" = PrivateAttr(default_factory=OrderedDict)
 
     def __init__(self, width: int, height: int, **data):
         id = str(uuid.uuid4())
@@ -24,8 +46,16 @@ class GridMap(BaseModel, RegistryHolder):
         BaseModel.__init__(self,width=width, height=height, grid=grid,id=id, **data)
         self.register(self)
 
+    def __getstate__(self) -> Dict[Any, Any]:
+        # the applicability index and cache are local to the process, they are rebuilt on first use after unpickling
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_applicability_index": {}, "_applicability_cache": OrderedDict()}
+        return state
+
     def register_action(self, action_class: Type[Action]):
         self.actions[action_class.__name__] = action_class
+        self._applicability_index.clear()
+        self.invalidate_applicability_cache()
 
     def register_actions(self, action_classes: List[Type[Action]]):
         for action_class in action_classes:
@@ -155,17 +185,79 @@ class GridMap(BaseModel, RegistryHolder):
                     if entity_type_name not in self.entity_type_map:
                         self.entity_type_map[entity_type_name] = entity_type
 
+    def get_candidate_actions(self, target: GameEntity) -> List[Type[Action]]:
+        """
+        Returns the registered action classes that can possibly apply to the target, skipping the actions whose
+        target conditions refer to attributes the type of the target does not have, e.g. Unlock against a Floor.
+        The index is built per entity type on first use and cleared when an action is registered.
+
+        Args:
+            target (GameEntity): The target entity.
+
+        Returns:
+            List[Type[Action]]: The candidate action classes, in registration order.
+        """
+        index = self.__pydantic_private__["_applicability_index"]
+        entity_type = type(target)
+        entry = index.get(entity_type)
+        if entry is None:
+            attribute_names = set(entity_type.model_fields)
+            nested_fields = [field_name for field_name, field_info in entity_type.model_fields.items() if may_hold_entity(field_info.annotation)]
+            candidates = [action_class for action_class in self.actions.values() if action_class.target_condition_names() <= attribute_names]
+            entry = index[entity_type] = (nested_fields, candidates)
+        nested_fields, candidates = entry
+        # attributes of nested entities (e.g. the container of a stored item) show up in all_attributes,
+        # so the type alone does not bound the conditions such a target can satisfy
+        for field_name in nested_fields:
+            if isinstance(target.__dict__.get(field_name), Entity):
+                return list(self.actions.values())
+        return candidates
+
+    @staticmethod
+    def applicability_stamp(entity: GameEntity) -> Tuple[int, int]:
+        """
+        Returns the versions the conditions and callables of an applicability check involving the entity depend
+        on: the state of the entity itself and of its container (merged into all_attributes), but not their
+        locations, which only the comparisons depend on.
+        """
+        stored_in = entity.stored_in
+        return (entity.state_version, stored_in.state_version if stored_in is not None else -1)
+
+    def invalidate_applicability_cache(self):
+        """
+        Drops the cached applicable actions of every (source, target) pair, e.g. after a change that prerequisite
+        callables depend on but that does not bump the state version of the entities or containers involved,
+        such as the location of the entities.
+        """
+        self._applicability_cache.clear()
+
     def get_applicable_actions_for_entity(self, source:GameEntity, target:GameEntity ,return_payload = False) -> List[Union[Action,ActionsPayload]]:
-        available_actions = []
-        for action_class in self.actions.values():
-            action = action_class()
-            if action.is_applicable(source, target):
-                if not return_payload:
-                    available_actions.append(action)
-                else:
-                    action_payload = ActionsPayload(actions=[ActionInstance(source_id=source.id, target_id=target.id, action=action)])
-                    available_actions.append(action_payload)
-        return available_actions
+        # the actions of a pair passing the conditions and callables are cached with the state versions of both
+        # entities and their containers, which every write reported on the ChangeBus bumps, except the moves; only
+        # the comparisons (e.g. the adjacency of the nodes) are re-run on a hit, so a move does not re-evaluate the rest
+        cache = self.__pydantic_private__["_applicability_cache"]
+        key = (source.id, target.id)
+        stamp = self.applicability_stamp(source) + self.applicability_stamp(target)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            cache.move_to_end(key)
+            candidates = cached[1]
+        else:
+            # the cache holds the action classes, not their compiled evaluators, so that the grid map stays picklable
+            candidates = [action_class for action_class in self.get_candidate_actions(target)
+                          if action_class.template().prerequisites.compile_split()[0](source, target)]
+            cache[key] = (stamp, candidates)
+            if len(cache) > APPLICABILITY_CACHE_SIZE:
+                cache.popitem(last=False)
+        applicable_actions = []
+        for action_class in candidates:
+            action = action_class.template()
+            spatial = action.prerequisites.compile_split()[1]
+            if spatial is None or spatial(source, target):
+                applicable_actions.append(action)
+        if not return_payload:
+            return applicable_actions
+        return [ActionsPayload(actions=[ActionInstance(source_id=source.id, target_id=target.id, action=action)]) for action in applicable_actions]
     
     def get_appplicable_actions_entities_for_node(self, source:GameEntity, target_node:Node,return_payload = False) -> List[Tuple[GameEntity,List[Union[Action,ActionsPayload]]]]:
         available_actions = []
@@ -184,64 +276,262 @@ class GridMap(BaseModel, RegistryHolder):
                 node_tuples.append((node,node_actions))
         return node_tuples
             
+    def applicable_actions_batch(self, sources: List[GameEntity], radius: int) -> List[Tuple[GameEntity, Action, GameEntity]]:
+        """
+        Returns every applicable (source, action, target) triple for many sources in one call, evaluating the
+        attribute conditions of the actions as NumPy masks and running the comparisons and callables only on
+        the pairs that pass them. See infinipy.vectorized.
+
+        Args:
+            sources (List[GameEntity]): The source entities, e.g. all the characters acting in a tick.
+            radius (int): The radius of the neighbourhood searched for targets around each source.
+
+        Returns:
+            List[Tuple[GameEntity, Action, GameEntity]]: The applicable triples, with the action templates.
+        """
+        from infinipy.vectorized import applicable_actions_batch
+        return applicable_actions_batch(self, sources, radius)
+
     def apply_actions_payload(self, payload: ActionsPayload) -> ActionsResults:
         results = []
-        if len(payload.actions) > 0:
-            print(f"Applying {len(payload.actions)} actions")
+        traced = TRACE.level >= TraceLevel.INFO
+        if traced:
+            start = time.perf_counter_ns()
+            if len(payload.actions) > 0:
+                TRACE.message(f"Applying {len(payload.actions)} actions", TraceLevel.INFO)
         for action_instance in payload.actions:
-            source = GameEntity.get_instance(action_instance.source_id)
-            target = GameEntity.get_instance(action_instance.target_id)
-            action = action_instance.action
-            state_before = {
-                "source": source.get_state(),
-                "target": target.get_state()
-            }
-            print(f"Attempting to apply action: {action.name}")
-            # print(f"Source: {source}")
-            # print(f"Target: {target}")
-            if action.is_applicable(source, target):
-                try:
-                    updated_source, updated_target = action.apply(source, target)
-                    # Handle inventory-related updates
-                    if updated_source.stored_in != source.stored_in:
-                        if source.stored_in and source in source.stored_in.inventory:
-                            source.stored_in.inventory.remove(source)
-                        if updated_source.stored_in:
-                            updated_source.stored_in.inventory.append(updated_source)
-                    if updated_target.stored_in != target.stored_in:
-                        if target.stored_in and target in target.stored_in.inventory:
-                            target.stored_in.inventory.remove(target)
-                        if updated_target.stored_in:
-                            updated_target.stored_in.inventory.append(updated_target)
-                    state_after = {
-                        "source": updated_source.get_state(),
-                        "target": updated_target.get_state()
-                    }
-                    results.append(ActionResult(action_instance=action_instance, success=True, state_before=state_before, state_after=state_after))
-                    print(f"Action applied successfully: {action.name}")
-                except ValueError as e:
-                    results.append(ActionResult(action_instance=action_instance, success=False, error=str(e), state_before=state_before))
-                    print(f"Error applying action: {action.name}")
-                    print(f"Error message: {str(e)}")
+            results.append(self.apply_action_instance(action_instance))
+        if traced:
+            end = time.perf_counter_ns()
+            TRACE.record(Timing(end, "apply_actions_payload", end - start))
+        return ActionsResults(results=results)
+
+    def apply_action_instance(self, action_instance: ActionInstance, record_states: bool = True, verbose: bool = True) -> ActionResult:
+        """
+        Applies a single action instance and reports the outcome.
+
+        When the simulation trace is enabled, the attempt, the failed prerequisites, the state diff and the
+        duration of the application are recorded in it, see infinipy.trace.
+
+        Args:
+            action_instance (ActionInstance): The action instance to apply.
+            record_states (bool): Whether to record the changes of the source and target, from which their states before and after the action are built on access.
+            verbose (bool): Whether to trace the progress messages of the application.
+
+        Returns:
+            ActionResult: The result of the application.
+        """
+        if TRACE.level:
+            return self._apply_action_traced(action_instance, record_states, verbose)
+        source = action_instance.get_source()
+        target = action_instance.get_target()
+        if source is None or target is None:
+            return self._unresolved_result(action_instance, source)
+        if not record_states:
+            return self._apply_action(action_instance, source, target, False)
+        states = ActionStates(source, target)
+        try:
+            result = self._apply_action(action_instance, source, target, False, states)
+        finally:
+            states.close()
+        states.report(result)
+        return result
+
+    def _apply_action_traced(self, action_instance: ActionInstance, record_states: bool, verbose: bool) -> ActionResult:
+        start = time.perf_counter_ns()
+        source = action_instance.get_source()
+        target = action_instance.get_target()
+        action_name = action_instance.action.name
+        debug = TRACE.level >= TraceLevel.DEBUG
+        if debug:
+            TRACE.record(ActionAttempted(start, action_name, action_instance.source_id, action_instance.target_id))
+        verbose = verbose and debug
+        if source is None or target is None:
+            result = self._unresolved_result(action_instance, source)
+        elif not record_states:
+            result = self._apply_action(action_instance, source, target, verbose)
+        else:
+            states = ActionStates(source, target)
+            try:
+                result = self._apply_action(action_instance, source, target, verbose, states)
+            finally:
+                states.close()
+            states.report(result)
+        end = time.perf_counter_ns()
+        if debug and record_states and result.success:
+            TRACE.record(StateDiff(end, action_name, action_instance.source_id, action_instance.target_id, result.changes))
+        TRACE.record(ActionCompleted(end, action_name, action_instance.source_id, action_instance.target_id, result.success, result.error, end - start))
+        return result
+
+    @staticmethod
+    def _unresolved_result(action_instance: ActionInstance, source: Optional[GameEntity]) -> ActionResult:
+        # the source or target ID is not registered, e.g. a stale or mistyped ID in an external payload
+        role, entity_id = ("Target", action_instance.target_id) if source is not None else ("Source", action_instance.source_id)
+        return ActionResult(action_instance=action_instance, success=False, error=f"{role} entity not found: {entity_id}")
+
+    def _apply_action(self, action_instance: ActionInstance, source: GameEntity, target: GameEntity, verbose: bool, states: Optional[ActionStates] = None) -> ActionResult:
+        action = action_instance.action
+        if verbose:
+            TRACE.message(f"Attempting to apply action: {action.name}")
+        # a single pass reports every failed check, instead of checking and re-running the statements on failure
+        failures = action.explain_prerequisites(source, target)
+        if not failures:
+            return self._apply_consequences(action_instance, source, target, verbose, states)
+        return self._failed_result(action_instance, failures, verbose, states)
+
+    def _apply_consequences(self, action_instance: ActionInstance, source: GameEntity, target: GameEntity, verbose: bool, states: Optional[ActionStates] = None) -> ActionResult:
+        action = action_instance.action
+        try:
+            # the prerequisites were checked by the caller, unless the action still overrides apply
+            if type(action).apply is Action.apply:
+                updated_source, updated_target = action.apply_consequences(source, target)
             else:
-                # Check which prerequisite failed and provide a detailed error message
-                failed_prerequisites = []
-                for statement in action.prerequisites.source_statements:
-                    if not statement.validate_condition(source):
-                        failed_prerequisites.append(f"Source prerequisite failed: {statement}")
-                for statement in action.prerequisites.target_statements:
-                    if not statement.validate_condition(target):
-                        failed_prerequisites.append(f"Target prerequisite failed: {statement}")
-                for statement in action.prerequisites.source_target_statements:
-                    if not statement.validate_comparisons(source, target):
-                        failed_prerequisites.append(f"Source-Target prerequisite failed: {statement}")
-                    if not statement.validate_callables(source, target):
-                        for callable_obj in statement.callables:
-                            if not callable_obj(source, target):
-                                docstring = callable_obj.__doc__ or "No docstring available"
-                                failed_prerequisites.append(f"Callable prerequisite failed: {callable_obj.__name__}\nDocstring: {docstring}")
-                error_message = "Prerequisites not met:\n" + "\n".join(failed_prerequisites)
-                results.append(ActionResult(action_instance=action_instance, success=False, error=error_message, state_before=state_before, failed_prerequisites=failed_prerequisites))
-                print(f"Action prerequisites not met: {action.name}")
-                print(f"Failed prerequisites: {failed_prerequisites}")
-        return ActionsResults(results=results)
\ No newline at end of file
+                updated_source, updated_target = action.apply(source, target)
+            # Handle inventory-related updates
+            if updated_source.stored_in != source.stored_in:
+                if source.stored_in and source in source.stored_in.inventory:
+                    source.stored_in.detach_item(source)
+                if updated_source.stored_in:
+                    updated_source.stored_in.attach_item(updated_source)
+            if updated_target.stored_in != target.stored_in:
+                if target.stored_in and target in target.stored_in.inventory:
+                    target.stored_in.detach_item(target)
+                if updated_target.stored_in:
+                    updated_target.stored_in.attach_item(updated_target)
+            if verbose:
+                TRACE.message(f"Action applied successfully: {action.name}")
+            return ActionResult(action_instance=action_instance, success=True, states=states)
+        except ValueError as e:
+            if verbose:
+                TRACE.message(f"Error applying action: {action.name}\nError message: {str(e)}")
+            return ActionResult(action_instance=action_instance, success=False, error=str(e), states=states)
+
+    def _failed_result(self, action_instance: ActionInstance, failures: List[PrerequisiteFailure], verbose: bool, states: Optional[ActionStates] = None) -> ActionResult:
+        action = action_instance.action
+        failed_prerequisites = [failure.describe() for failure in failures]
+        if TRACE.level >= TraceLevel.DEBUG:
+            now = time.perf_counter_ns()
+            for failure, description in zip(failures, failed_prerequisites):
+                TRACE.record(PrerequisiteFailed(now, action.name, action_instance.source_id, action_instance.target_id, failure.kind, description))
+        error_message = "Prerequisites not met:\n" + "\n".join(failed_prerequisites)
+        if verbose:
+            TRACE.message(f"Action prerequisites not met: {action.name}\nFailed prerequisites: {failed_prerequisites}")
+        return ActionResult(action_instance=action_instance, success=False, error=error_message, failed_prerequisites=failed_prerequisites, failures=failures, states=states)
+
+    @staticmethod
+    def action_footprint(action_instance: ActionInstance) -> Set[str]:
+        """
+        Returns the IDs of the entities and nodes an action instance may read or write: the source and the target,
+        the nodes holding them and the entities storing them. Consequences move entities between these nodes and
+        inventories, so two instances with disjoint footprints can be applied in any order.
+
+        Args:
+            action_instance (ActionInstance): The action instance.
+
+        Returns:
+            Set[str]: The IDs in the footprint.
+        """
+        footprint = {action_instance.source_id, action_instance.target_id}
+        for entity in (action_instance.get_source(), action_instance.get_target()):
+            if entity is None:
+                continue
+            if entity.node is not None:
+                footprint.add(entity.node.id)
+            if entity.stored_in is not None:
+                footprint.add(entity.stored_in.id)
+        return footprint
+
+    def partition_actions_payload(self, payload: ActionsPayload) -> List[List[int]]:
+        """
+        Partitions the actions of a payload into independent groups, merging every two actions whose footprints
+        overlap. Actions in different groups touch disjoint entities and nodes, while the actions of a group
+        must be applied in payload order.
+
+        Args:
+            payload (ActionsPayload): The payload to partition.
+
+        Returns:
+            List[List[int]]: The indices of the actions in each group, in payload order, groups ordered by their first action.
+        """
+        parents = list(range(len(payload.actions)))
+
+        def find(index: int) -> int:
+            while parents[index] != index:
+                parents[index] = parents[parents[index]]
+                index = parents[index]
+            return index
+
+        owners: Dict[str, int] = {}
+        for index, action_instance in enumerate(payload.actions):
+            for item_id in self.action_footprint(action_instance):
+                owner = owners.setdefault(item_id, index)
+                root, owner_root = find(index), find(owner)
+                if root != owner_root:
+                    # the lower index becomes the root, so groups are keyed by their first action
+                    parents[max(root, owner_root)] = min(root, owner_root)
+        groups: Dict[int, List[int]] = {}
+        for index in range(len(payload.actions)):
+            groups.setdefault(find(index), []).append(index)
+        return list(groups.values())
+
+    def apply_actions_batch(self, payload: ActionsPayload, record_states: bool = False) -> ActionsResults:
+        """
+        Applies a payload of actions from many agents in one tick. The payload is partitioned into independent
+        groups with partition_actions_payload; conflicting actions (e.g. two characters picking up the same Key)
+        end up in the same group and are resolved deterministically in payload order, so the earlier action wins
+        and the later one is checked against the state it left behind. The outcome is the same as applying the
+        payload sequentially.
+
+        The groups are applied in waves, the n-th wave holding the n-th action of every group. The actions of a
+        wave touch disjoint entities and nodes, so their prerequisites are checked together before any of them is
+        applied, with infinipy.vectorized.prerequisites_batch, and only the failed ones are explained. Unlike
+        apply_actions_payload no progress messages are traced, and state snapshots are only taken if requested;
+        when the simulation trace is enabled the actions are applied one by one, to trace each of them.
+
+        Args:
+            payload (ActionsPayload): The payload to apply.
+            record_states (bool): Whether to record the changes and the states of the source and target of each action,
+                as apply_action_instance does; without it the results carry no changes nor states.
+
+        Returns:
+            ActionsResults: The results, in the order of the payload actions. Actions whose source or target
+                is not registered fail, as with apply_action_instance.
+        """
+        from infinipy.vectorized import prerequisites_batch
+        actions = payload.actions
+        results: List[Optional[ActionResult]] = [None] * len(actions)
+        groups = self.partition_actions_payload(payload)
+        if TRACE.level:
+            for group in groups:
+                for index in group:
+                    results[index] = self.apply_action_instance(actions[index], record_states=record_states, verbose=False)
+            return ActionsResults(results=results)
+        for wave in range(max((len(group) for group in groups), default=0)):
+            wave_indices = []
+            triples = []
+            for group in groups:
+                if wave >= len(group):
+                    continue
+                index = group[wave]
+                action_instance = actions[index]
+                source = action_instance.get_source()
+                target = action_instance.get_target()
+                if source is None or target is None:
+                    results[index] = self._unresolved_result(action_instance, source)
+                    continue
+                wave_indices.append(index)
+                triples.append((action_instance.action, source, target))
+            for index, (action, source, target), applicable in zip(wave_indices, triples, prerequisites_batch(triples)):
+                action_instance = actions[index]
+                states = ActionStates(source, target) if record_states else None
+                try:
+                    if applicable:
+                        results[index] = self._apply_consequences(action_instance, source, target, False, states)
+                    else:
+                        results[index] = self._failed_result(action_instance, action.explain_prerequisites(source, target), False, states)
+                finally:
+                    if states is not None:
+                        states.close()
+                if states is not None:
+                    states.report(results[index])
+        return ActionsResults(results=results)
@@ -0,0 +1,197 @@
+# hashing.py
+from typing import Any, Dict, Generic, Optional, Tuple, TypeVar
+from collections import OrderedDict
+from infinipy.entity import Attribute
+from infinipy.events import ChangeBus, ChangeEvent, AttributeValueChanged, FieldChanged, NodeEntitiesChanged, InventoryChanged
+from infinipy.nodes import GameEntity, change_in_grid_map
+import hashlib
+import typing
+if typing.TYPE_CHECKING:
+    from infinipy.gridmap import GridMap
+
+# fields holding references between entities, nodes and inventories, hashed as (owner, field, referenced id)
+LOCATION_FIELDS = ("node", "stored_in")
+NODE_MEMBER = "@entity"
+INVENTORY_MEMBER = "@item"
+
+
+class WorldHasher:
+    """
+    Incremental 64 bit Zobrist hash of the state of a grid map.
+
+    The hash is the XOR of one pseudo random key per (owner, attribute, value), per (entity, location field,
+    referenced node or container) and per node or inventory membership. The keys are derived from a hash of the
+    component, so they are the same in every process. Once computed, the hash is maintained from the events of
+    the ChangeBus by XOR-ing out the old component and XOR-ing in the new one, in O(1) per change, including the
+    changes replayed or reverted by transactions and world forks. Changes to other grid maps and to free entities
+    are ignored, like by compute. The keys of the most recently used components are memoized.
+
+    Attributes:
+        grid_map (GridMap): The hashed grid map.
+        value (int): The current hash.
+        key_cache_size (int): The maximum number of memoized keys.
+    """
+
+    def __init__(self, grid_map: "GridMap", key_cache_size: int = 100_000):
+        self.grid_map = grid_map
+        self.key_cache_size = key_cache_size
+        self._keys: "OrderedDict[Tuple[str, str, Any], int]" = OrderedDict()
+        self.value = self.compute()
+        self._attached = False
+
+    def key(self, owner_id: str, name: str, value: Any) -> int:
+        """
+        Returns the Zobrist key of a state component.
+
+        Args:
+            owner_id (str): The ID of the entity or node owning the component.
+            name (str): The attribute or field name, or a membership marker.
+            value (Any): The value of the component.
+
+        Returns:
+            int: The 64 bit key.
+        """
+        try:
+            component = (owner_id, name, value)
+            key = self._keys.get(component)
+        except TypeError:
+            component = (owner_id, name, repr(value))
+            key = self._keys.get(component)
+        if key is None:
+            digest = hashlib.blake2b(repr(component).encode(), digest_size=8).digest()
+            key = self._keys[component] = int.from_bytes(digest, "little")
+            if len(self._keys) > self.key_cache_size:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(component)
+        return key
+
+    def _model_hash(self, owner: Any) -> int:
+        value = 0
+        for field_name, field_value in owner.__dict__.items():
+            if isinstance(field_value, Attribute):
+                value ^= self.key(owner.id, field_name, field_value.value)
+            elif field_name in LOCATION_FIELDS:
+                value ^= self.key(owner.id, field_name, field_value.id if field_value is not None else None)
+        return value
+
+    def _entity_hash(self, entity: GameEntity) -> int:
+        value = self._model_hash(entity)
+        for item in entity.inventory:
+            value ^= self.key(entity.id, INVENTORY_MEMBER, item.id)
+            value ^= self._entity_hash(item)
+        return value
+
+    def compute(self) -> int:
+        """
+        Computes the hash of the grid map from scratch.
+        """
+        value = 0
+        for row in self.grid_map.grid:
+            for node in row:
+                value ^= self._model_hash(node)
+                for entity in node.entities:
+                    value ^= self.key(node.id, NODE_MEMBER, entity.id)
+                    value ^= self._entity_hash(entity)
+        return value
+
+    def attach(self) -> "WorldHasher":
+        """
+        Recomputes the hash and starts maintaining it from the ChangeBus.
+
+        Returns:
+            WorldHasher: The hasher itself.
+        """
+        if not self._attached:
+            self.value = self.compute()
+            ChangeBus.subscribe(self.on_change)
+            self._attached = True
+        return self
+
+    def detach(self):
+        """
+        Stops maintaining the hash.
+        """
+        if self._attached:
+            ChangeBus.unsubscribe(self.on_change)
+            self._attached = False
+
+    def on_change(self, event: ChangeEvent):
+        if not change_in_grid_map(event, self.grid_map.id):
+            return
+        if isinstance(event, AttributeValueChanged):
+            self.value ^= self.key(event.owner_id, event.attr_name, event.old_value) ^ self.key(event.owner_id, event.attr_name, event.new_value)
+        elif isinstance(event, FieldChanged):
+            old_value, new_value = event.old_value, event.new_value
+            if isinstance(old_value, Attribute) or isinstance(new_value, Attribute):
+                if isinstance(old_value, Attribute):
+                    self.value ^= self.key(event.owner_id, event.field_name, old_value.value)
+                if isinstance(new_value, Attribute):
+                    self.value ^= self.key(event.owner_id, event.field_name, new_value.value)
+            elif event.field_name in LOCATION_FIELDS:
+                old_id = old_value.id if old_value is not None else None
+                new_id = new_value.id if new_value is not None else None
+                self.value ^= self.key(event.owner_id, event.field_name, old_id) ^ self.key(event.owner_id, event.field_name, new_id)
+            elif event.field_name == "inventory":
+                for item in old_value or ():
+                    self.value ^= self.key(event.owner_id, INVENTORY_MEMBER, item.id)
+                for item in new_value or ():
+                    self.value ^= self.key(event.owner_id, INVENTORY_MEMBER, item.id)
+        elif isinstance(event, NodeEntitiesChanged):
+            self.value ^= self.key(event.node_id, NODE_MEMBER, event.entity_id)
+        elif isinstance(event, InventoryChanged):
+            self.value ^= self.key(event.owner_id, INVENTORY_MEMBER, event.item_id)
+
+    def __enter__(self) -> "WorldHasher":
+        return self.attach()
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback) -> bool:
+        self.detach()
+        return False
+
+
+V = TypeVar("V")
+
+
+class TranspositionTable(Generic[V]):
+    """
+    Bounded map from state hashes to search data (e.g. the best cost or visit statistics of a state),
+    evicting the least recently used entry when full. Lookups and stores are O(1).
+
+    Attributes:
+        capacity (int): The maximum number of entries.
+        hits (int): The number of successful lookups.
+        misses (int): The number of failed lookups.
+    """
+
+    def __init__(self, capacity: int = 1_000_000):
+        self.capacity = capacity
+        self._entries: "OrderedDict[int, V]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: int, default: Optional[V] = None) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def store(self, key: int, value: V):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,135 @@
+# inference.py
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from pydantic import BaseModel, Field
+from infinipy.decoding import ConstrainedActionDecoder
+from infinipy.trace import TRACE, TraceLevel, Timing
+from outlines import models, generate, samplers
+from outlines.generate.api import SequenceGenerator
+import functools
+import time
+
+
+class InferenceRequest(BaseModel):
+    """
+    The action an agent asks the InferenceService to choose in a tick.
+    Attributes:
+        agent_id (str): The ID of the requesting agent's character, used to route the result back.
+        prompt (str): The prompt.
+        allowed_strings (List[str]): The action strings allowed at the step.
+        vocabulary (Tuple[str, ...]): All the action strings of the agent, the decoder is shared between the
+            agents with the same vocabulary.
+    """
+    agent_id: str = Field(description="The ID of the requesting agent's character")
+    prompt: str = Field(description="The prompt")
+    allowed_strings: List[str] = Field(description="The action strings allowed at the step")
+    vocabulary: Tuple[str, ...] = Field(description="All the action strings of the agent")
+
+
+class InferenceService:
+    """
+    A single model instance shared by all the agents. The agents submit their prompts of a tick together and
+    run_batch decodes them in the order that maximizes the prompt prefix shared by consecutive requests, so
+    that llama.cpp only evaluates the tokens past the prefix already in its KV cache: the system prompt, which
+    is the same for all the agents, is evaluated once per tick rather than once per agent. With
+    state_cache_bytes, the KV states of previous prompts are also kept in a bounded RAM cache, so each agent
+    resumes from its own previous prompt, which the current one extends.
+
+    The memory used is that of the one model plus the bounded caches, whatever the number of agents.
+
+    Attributes:
+        llm (Any): The outlines model.
+        n_ctx (int): The context size of the model.
+        stats (Dict[str, float]): The requests, the distinct requests, the model calls and the elapsed time of the last batch.
+    """
+
+    def __init__(self, model: Union[str, Any], n_ctx: int = 30000, state_cache_bytes: Optional[int] = None,
+                 generator_cache_size: int = 32, model_kwargs: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            model (Union[str, Any]): The path of a llama.cpp model to load, or an already loaded outlines model.
+            n_ctx (int): The context size of the loaded model.
+            state_cache_bytes (Optional[int]): The size of the RAM cache of KV states, disabled by default.
+            generator_cache_size (int): The number of outlines choice generators kept, for models without llama.cpp.
+            model_kwargs (Optional[Dict[str, Any]]): Extra arguments for the llama.cpp model.
+        """
+        if isinstance(model, str):
+            kwargs = {"seed": 1337, "n_ctx": n_ctx, "n_gpu_layers": -1, "verbose": True}
+            kwargs.update(model_kwargs or {})
+            model = models.llamacpp(model, model_kwargs=kwargs)
+        self.llm = model
+        self.n_ctx = n_ctx
+        self.llama = getattr(model, "model", None)
+        if not hasattr(self.llama, "create_completion"):
+            self.llama = None
+        if self.llama is not None and state_cache_bytes:
+            from llama_cpp import LlamaRAMCache
+            self.llama.set_cache(LlamaRAMCache(capacity_bytes=state_cache_bytes))
+        self._decoders: Dict[Tuple[str, ...], ConstrainedActionDecoder] = {}
+        self.choice_generator = functools.lru_cache(maxsize=generator_cache_size)(self._compile_choice_generator)
+        self.stats: Dict[str, float] = {}
+
+    def decoder(self, vocabulary: Sequence[str]) -> Optional[ConstrainedActionDecoder]:
+        """
+        Returns the decoder over a vocabulary of action strings, built on first use, or None without llama.cpp.
+        """
+        if self.llama is None:
+            return None
+        vocabulary = tuple(vocabulary)
+        decoder = self._decoders.get(vocabulary)
+        if decoder is None:
+            decoder = self._decoders[vocabulary] = ConstrainedActionDecoder(self.llama, vocabulary)
+        return decoder
+
+    def _compile_choice_generator(self, allowed_strings: Tuple[str, ...]) -> SequenceGenerator:
+        if TRACE.level >= TraceLevel.DEBUG:
+            TRACE.message(f"Generating generator for {list(allowed_strings)}")
+        return generate.choice(self.llm, list(allowed_strings), sampler=samplers.multinomial(top_k=1))
+
+    def choose(self, prompt: str, allowed_strings: Sequence[str], vocabulary: Sequence[str]) -> str:
+        """
+        Generates the allowed action string the model prefers after the prompt.
+
+        Args:
+            prompt (str): The prompt.
+            allowed_strings (Sequence[str]): The allowed action strings.
+            vocabulary (Sequence[str]): All the action strings of the agent.
+
+        Returns:
+            str: The chosen action string.
+        """
+        decoder = self.decoder(vocabulary)
+        if decoder is not None:
+            return decoder.choose(prompt, allowed_strings)
+        if len(set(allowed_strings)) == 1:
+            return allowed_strings[0]
+        return self.choice_generator(tuple(allowed_strings))(prompt)
+
+    def run_batch(self, requests: List[InferenceRequest]) -> Dict[str, str]:
+        """
+        Chooses the actions of the requests of a tick. Identical requests are decoded once, and the others in
+        lexicographic order of their prompts, which places the prompts with the longest common prefixes next
+        to each other.
+
+        Args:
+            requests (List[InferenceRequest]): The requests of the tick, at most one per agent.
+
+        Returns:
+            Dict[str, str]: The chosen action string by agent ID.
+        """
+        start = time.perf_counter()
+        distinct: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...]], List[str]] = {}
+        for request in requests:
+            distinct.setdefault((request.prompt, tuple(request.allowed_strings), request.vocabulary), []).append(request.agent_id)
+        choices: Dict[str, str] = {}
+        model_calls = 0
+        for key in sorted(distinct, key=lambda key: key[0]):
+            prompt, allowed_strings, vocabulary = key
+            model_calls += len(set(allowed_strings)) > 1
+            choice = self.choose(prompt, allowed_strings, vocabulary)
+            for agent_id in distinct[key]:
+                choices[agent_id] = choice
+        elapsed = time.perf_counter() - start
+        self.stats = {"requests": len(requests), "distinct": len(distinct), "model_calls": model_calls, "elapsed": elapsed}
+        if TRACE.level >= TraceLevel.INFO:
+            TRACE.record(Timing(time.perf_counter_ns(), "inference_batch", int(elapsed * 1e9)))
+        return choices
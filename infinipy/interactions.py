@@ -1,6 +1,7 @@
 from infinipy.actions import Action, Prerequisites, Consequences
 from infinipy.entity import Attribute, Statement, Entity
 from infinipy.nodes import GameEntity, Node, BlocksMovement, BlocksLight
+from infinipy.trace import TRACE, TraceLevel
 from typing import Callable, Dict, Tuple, Optional, List, Union
 from pydantic import Field
 
@@ -22,7 +23,9 @@ class IsPickupable(Attribute):
 class Material(Attribute):
     value: str = Field("", description="The material composition of the entity")
 
-class Open(Attribute):
+class IsOpen(Attribute):
+    # keeps the attribute name of the former Open attribute class, which the Open action shadowed
+    name: str = Field("Open", description="The name of the attribute")
     value: bool = Field(False, description="Indicates whether the door is open")
 
 
@@ -61,7 +64,7 @@ class Monster(LivingEntity):
     pass
 
 class Door(InanimateEntity):
-    open: Open = Open()
+    open: IsOpen = IsOpen()
     is_locked: Attribute = Attribute(name="is_locked", value=False)
     required_key: Attribute = Attribute(name="required_key", value="")
     blocks_movement: BlocksMovement = BlocksMovement()
@@ -72,7 +75,8 @@ class Door(InanimateEntity):
         self.update_block_attributes()
 
     def update_block_attributes(self):
-        print("Updating block attributes... for door")
+        if TRACE.level >= TraceLevel.DEBUG:
+            TRACE.message("Updating block attributes... for door")
         if self.open.value:
             self.blocks_movement = BlocksMovement(value=False)
             self.blocks_light = BlocksLight(value=False)
@@ -186,9 +190,7 @@ class Pickup(Action):
         target_transformations={"stored_in": SetStoredIn, "node": None}
     )
 
-    def apply(self, source: GameEntity, target: GameEntity) -> Tuple[GameEntity, GameEntity]:
-        if not self.is_applicable(source, target):
-            raise ValueError("Action prerequisites are not met")
+    def apply_consequences(self, source: GameEntity, target: GameEntity) -> Tuple[GameEntity, GameEntity]:
         # Remove the target entity from its current node
         if target.node:
             target.node.remove_entity(target)
@@ -297,10 +299,7 @@ class Open(Action):
         target_transformations={"open": True}
     )
 
-    def apply(self, source: GameEntity, target: Door) -> Tuple[GameEntity, Door]:
-        if not self.is_applicable(source, target):
-            raise ValueError("Action prerequisites are not met")
-
+    def apply_consequences(self, source: GameEntity, target: Door) -> Tuple[GameEntity, Door]:
         updated_source, updated_target = self.consequences.apply(source, target)
         updated_target.update_block_attributes()
         updated_target.node.update_blocking_properties()
@@ -320,10 +319,7 @@ class Close(Action):
         source_transformations={},
         target_transformations={"open": False}
     )
-    def apply(self, source: GameEntity, target: Door) -> Tuple[GameEntity, Door]:
-        if not self.is_applicable(source, target):
-            raise ValueError("Action prerequisites are not met")
-
+    def apply_consequences(self, source: GameEntity, target: Door) -> Tuple[GameEntity, Door]:
         updated_source, updated_target = self.consequences.apply(source, target)
         updated_target.update_block_attributes()
         updated_target.node.update_blocking_properties()
@@ -1,19 +1,32 @@
-from typing import Optional, Tuple, List, Dict, Any, Union, Type
+from typing import Optional, Tuple, List, Dict, Any, Union, Type, Callable
 from infinipy.entity import Entity, Statement, Attribute
 from infinipy.shapes import Shadow, Path, Radius,Rectangle, RayCast, BlockedRaycast
 from infinipy.gridmap import GridMap
 from infinipy.nodes import Node, GameEntity, BlocksMovement, BlocksLight
-from infinipy.spatial import WalkableGraph
+from infinipy.spatial import WalkableGraph, a_star
 from infinipy.interactions import Character, Door, Key, Treasure, Floor, Wall, InanimateEntity, IsPickupable, TestItem, Open, Close, Unlock, Lock, Pickup, Drop, Move
 from infinipy.payloads import ActionsPayload, ActionInstance, ActionResult
 from pydantic import BaseModel
 from infinipy.actions import Prerequisites, Consequences, Goal, Action
 from infinipy.errors import ActionConversionError, AmbiguousEntityError
+from infinipy.trace import TRACE, TraceLevel
+import typing
+if typing.TYPE_CHECKING:
+    from infinipy.goals import GoalMonitor
 
 class GoalState:
-    def __init__(self, character_id: str, goals: Optional[List[Goal]] = []):
+    def __init__(self, character_id: str, goals: Optional[List[Goal]] = [], monitor: Optional["GoalMonitor"] = None):
+        """
+        Args:
+            character_id (str): The ID of the character pursuing the goals.
+            goals (Optional[List[Goal]]): The goals.
+            monitor (Optional[GoalMonitor]): A monitor of the goals. While it is attached, the prerequisites section
+                of a goal is only rebuilt after a change of one of the goal dependencies.
+        """
         self.character_id = character_id
         self.goals = goals
+        self.monitor = monitor
+        self._prerequisites_info: Dict[int, Tuple[int, str]] = {}
 
     def add_goal(self, goal: Goal):
         self.goals.append(goal)
@@ -34,7 +47,15 @@ class GoalState:
             (target_entity and (target_entity.id != character.id or target_entity not in character.inventory)):
                 goal_message += self.generate_spatial_info(character, source_entity, target_entity, shape)
 
-            goal_message += self.generate_prerequisites_info(goal.prerequisites, source_entity, target_entity)
+            version = self.monitor.version(goal) if self.monitor is not None else None
+            cached = self._prerequisites_info.get(id(goal))
+            if version is not None and cached is not None and cached[0] == version:
+                prerequisites_info = cached[1]
+            else:
+                prerequisites_info = self.generate_prerequisites_info(goal.prerequisites, source_entity, target_entity)
+                if version is not None:
+                    self._prerequisites_info[id(goal)] = (version, prerequisites_info)
+            goal_message += prerequisites_info
             goal_message += "\n"
 
         return goal_message.strip()
@@ -167,28 +188,145 @@ class GoalState:
                 return f"Blocked Ray: {ray_path} (Blocked by {blocking_entity_name} at {raycast.blocking_node.position.value}, Attributes: {blocking_entity_attributes})"
         return "Ray: Not available"
 
+class ObservationContext:
+    """
+    The data shared by the sections of an observation: the character, its node, the grid map and the observed
+    nodes, fetched once per ObservationState.generate call, and the cache keys of the sections built from them.
+    Attributes:
+        shape (Union[Shadow, Rectangle, Radius]): The observed shape.
+        character (Optional[GameEntity]): The observing character.
+        character_node (Optional[Node]): The node of the character.
+        grid_map (Optional[GridMap]): The grid map of the character node.
+        nodes (List[Node]): The observed nodes.
+    """
+
+    def __init__(self, shape: Union[Shadow, Rectangle, Radius], character_id: str):
+        self.shape = shape
+        self.character_id = character_id
+        self.character = GameEntity.get_instance(character_id)
+        self.character_node = self.character.node if self.character is not None else None
+        self.grid_map = GridMap.get_instance(self.character_node.gridmap_id) if self.character_node is not None else None
+        if isinstance(shape, (Shadow, Radius)):
+            self.nodes = shape.nodes
+        else:
+            grid_map = self.grid_map or GridMap.get_instance(shape.nodes[0].gridmap_id)
+            self.nodes = grid_map.get_nodes_in_rect(shape)
+        self._nodes_key: Optional[Tuple[Tuple[str, int], ...]] = None
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+        self._walkable_graph: Optional[WalkableGraph] = None
+
+    @property
+    def error(self) -> Optional[str]:
+        """
+        The message reported by the sections needing the character node and grid map, when one of them is missing.
+        """
+        if self.character is None:
+            return "Character not found."
+        if self.character_node is None:
+            return "Character is not in a node."
+        if self.grid_map is None:
+            return "Grid map not found."
+        return None
+
+    @property
+    def nodes_key(self) -> Tuple[Tuple[str, int], ...]:
+        """
+        The IDs and versions of the observed nodes. The version of a node is bumped by every change of its entity
+        list, of its fields and of the entities it holds, so sections reading only the observed nodes are unchanged
+        as long as this key is.
+        """
+        if self._nodes_key is None:
+            self._nodes_key = tuple((node.id, node.version) for node in self.nodes)
+        return self._nodes_key
+
+    @property
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """
+        The (min x, max x, min y, max y) bounds of the observed nodes.
+        """
+        if self._bounds is None:
+            xs = [node.position.value[0] for node in self.nodes]
+            ys = [node.position.value[1] for node in self.nodes]
+            self._bounds = (min(xs), max(xs), min(ys), max(ys))
+        return self._bounds
+
+    def walkable_graph(self) -> WalkableGraph:
+        """
+        The walkable graph of the grid map, built once instead of once per path.
+        """
+        if self._walkable_graph is None:
+            self._walkable_graph = self.grid_map.get_walkable_graph()
+        return self._walkable_graph
+
+    def walkable_key(self) -> Tuple[bool, ...]:
+        """
+        The walkability of every node of the grid map, which paths leaving the observed nodes depend on.
+        """
+        return tuple(not node.blocks_movement.value for row in self.grid_map.grid for node in row)
+
+
 class ObservationState:
+    """
+    Generates the observation text of a character. Each section is cached with a key built from the versions of
+    the nodes and entities it reads (see ObservationContext), and reused verbatim while the key is unchanged.
+    Call invalidate after changes that bypass the observed setters and do not bump versions.
+    """
     def __init__(self, character_id: str):
         self.character_id = character_id
         self.paths = {}
+        self._sections: Dict[str, Tuple[Any, Any]] = {}
+
+    def invalidate(self):
+        """
+        Drops the cached sections.
+        """
+        self._sections.clear()
+
+    def _cached(self, name: str, key: Any, build: Callable[[], Any]) -> Any:
+        if key is None:
+            return build()
+        cached = self._sections.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        section = build()
+        self._sections[name] = (key, section)
+        return section
 
     def generate(self, shape: Union[Shadow, Rectangle, Radius]) -> str:
+        context = ObservationContext(shape, self.character_id)
+        character = context.character
+        character_node = context.character_node
+        located = context.error is None
+        node_ids = tuple(node_id for node_id, _ in context.nodes_key)
         observation_message = ""
-        observation_message += self._generate_character_summary(self.character_id, shape)
-        observation_message += self._generate_visibility_matrix(shape, self.character_id)
-        observation_message += self._generate_movement_matrix(shape, self.character_id)
-        path_matrix_content, paths = self._generate_path_matrix(shape, self.character_id)
+        observation_message += self._cached("character_summary", (character.version, character.position.value) if character is not None else None,
+                                            lambda: self._generate_character_summary(self.character_id, shape, context))
+        observation_message += self._cached("visibility_matrix", (context.nodes_key, character_node.id) if located else None,
+                                            lambda: self._generate_visibility_matrix(shape, self.character_id, context))
+        observation_message += self._cached("movement_matrix", (context.nodes_key, character_node.id) if located else None,
+                                            lambda: self._generate_movement_matrix(shape, self.character_id, context))
+        path_matrix_content, paths = self._cached("path_matrix", (node_ids, character_node.id, context.walkable_key()) if located else None,
+                                                  lambda: self._generate_path_matrix(shape, self.character_id, context))
         observation_message += path_matrix_content
-        observation_message += self._generate_immediate_neighbors(shape, self.character_id)
-        observation_message += self._generate_node_equivalence_classes(shape)
-        observation_message += self._generate_living_entities(shape, self.character_id)
-        observation_message += self._generate_attribute_summary(shape)
+        neighbors_key = None
+        if character_node is not None:
+            neighbors_key = (character_node.id, character_node.version, tuple(node.version for node in character_node.neighbors()))
+        observation_message += self._cached("immediate_neighbors", neighbors_key,
+                                            lambda: self._generate_immediate_neighbors(shape, self.character_id, context))
+        observation_message += self._cached("node_equivalence_classes", context.nodes_key,
+                                            lambda: self._generate_node_equivalence_classes(shape, context))
+        source = getattr(shape, "source", None)
+        observation_message += self._cached("living_entities", (context.nodes_key, source.id if source is not None else self.character_id),
+                                            lambda: self._generate_living_entities(shape, self.character_id))
+        observation_message += self._cached("attribute_summary", context.nodes_key,
+                                            lambda: self._generate_attribute_summary(shape, context))
         # observation_message += self._generate_pathfinding_information(paths)
         return observation_message.strip()
 
     @staticmethod
-    def _generate_character_summary(character_id: str, shape: Union[Shadow, Rectangle, Radius]) -> str:
-        character = GameEntity.get_instance(character_id)
+    def _generate_character_summary(character_id: str, shape: Union[Shadow, Rectangle, Radius], context: Optional[ObservationContext] = None) -> str:
+        context = context or ObservationContext(shape, character_id)
+        character = context.character
         if character is None:
             return "Character not found."
         position = character.position.value
@@ -206,21 +344,14 @@ class ObservationState:
         return f"{header}{content}\n"
 
     @staticmethod
-    def _generate_visibility_matrix(shape: Union[Shadow, Rectangle, Radius], character_id: str) -> str:
-        character = GameEntity.get_instance(character_id)
-        if character is None:
-            return "Character not found."
-        character_node = character.node
-        if character_node is None:
-            return "Character is not in a node."
-        grid_map = GridMap.get_instance(character_node.gridmap_id)
-        if grid_map is None:
-            return "Grid map not found."
-        nodes = shape.nodes if isinstance(shape, (Shadow, Radius)) else grid_map.get_nodes_in_rect(shape)
-        min_x = min(node.position.value[0] for node in nodes)
-        max_x = max(node.position.value[0] for node in nodes)
-        min_y = min(node.position.value[1] for node in nodes)
-        max_y = max(node.position.value[1] for node in nodes)
+    def _generate_visibility_matrix(shape: Union[Shadow, Rectangle, Radius], character_id: str, context: Optional[ObservationContext] = None) -> str:
+        context = context or ObservationContext(shape, character_id)
+        if context.error is not None:
+            return context.error
+        character_node = context.character_node
+        grid_map = context.grid_map
+        nodes = context.nodes
+        min_x, max_x, min_y, max_y = context.bounds
         visibility_matrix = [["?" for _ in range(max_x - min_x + 1)] for _ in range(max_y - min_y + 1)]
         character_x, character_y = character_node.position.value
         visibility_matrix[character_y - min_y][character_x - min_x] = "c"
@@ -235,21 +366,14 @@ class ObservationState:
         return f"{header}{content}\n\n"
 
     @staticmethod
-    def _generate_movement_matrix(shape: Union[Shadow, Rectangle, Radius], character_id: str) -> str:
-        character = GameEntity.get_instance(character_id)
-        if character is None:
-            return "Character not found."
-        character_node = character.node
-        if character_node is None:
-            return "Character is not in a node."
-        grid_map = GridMap.get_instance(character_node.gridmap_id)
-        if grid_map is None:
-            return "Grid map not found."
-        nodes = shape.nodes if isinstance(shape, (Shadow, Radius)) else grid_map.get_nodes_in_rect(shape)
-        min_x = min(node.position.value[0] for node in nodes)
-        max_x = max(node.position.value[0] for node in nodes)
-        min_y = min(node.position.value[1] for node in nodes)
-        max_y = max(node.position.value[1] for node in nodes)
+    def _generate_movement_matrix(shape: Union[Shadow, Rectangle, Radius], character_id: str, context: Optional[ObservationContext] = None) -> str:
+        context = context or ObservationContext(shape, character_id)
+        if context.error is not None:
+            return context.error
+        character_node = context.character_node
+        grid_map = context.grid_map
+        nodes = context.nodes
+        min_x, max_x, min_y, max_y = context.bounds
         movement_matrix = [["?" for _ in range(max_x - min_x + 1)] for _ in range(max_y - min_y + 1)]
         character_x, character_y = character_node.position.value
         movement_matrix[character_y - min_y][character_x - min_x] = "c"
@@ -264,21 +388,14 @@ class ObservationState:
         return f"{header}{content}\n\n"
 
     @staticmethod
-    def _generate_path_matrix(shape: Union[Shadow, Rectangle, Radius], character_id: str) -> str:
-        character = GameEntity.get_instance(character_id)
-        if character is None:
-            return "Character not found."
-        character_node = character.node
-        if character_node is None:
-            return "Character is not in a node."
-        grid_map = GridMap.get_instance(character_node.gridmap_id)
-        if grid_map is None:
-            return "Grid map not found."
-        nodes = shape.nodes if isinstance(shape, (Shadow, Radius)) else grid_map.get_nodes_in_rect(shape)
-        min_x = min(node.position.value[0] for node in nodes)
-        max_x = max(node.position.value[0] for node in nodes)
-        min_y = min(node.position.value[1] for node in nodes)
-        max_y = max(node.position.value[1] for node in nodes)
+    def _generate_path_matrix(shape: Union[Shadow, Rectangle, Radius], character_id: str, context: Optional[ObservationContext] = None) -> str:
+        context = context or ObservationContext(shape, character_id)
+        if context.error is not None:
+            return context.error
+        character_node = context.character_node
+        grid_map = context.grid_map
+        nodes = context.nodes
+        min_x, max_x, min_y, max_y = context.bounds
         path_matrix = [["?" for _ in range(max_x - min_x + 1)] for _ in range(max_y - min_y + 1)]
         character_x, character_y = character_node.position.value
         path_matrix[character_y - min_y][character_x - min_x] = "c"
@@ -286,7 +403,8 @@ class ObservationState:
         for node in nodes:
             x = node.position.value[0] - min_x
             y = node.position.value[1] - min_y
-            path = grid_map.get_path(character_node, node)
+            path_positions = a_star(character_node.position.value, node.position.value, context.walkable_graph(), True)
+            path = Path(start=character_node, end=node, nodes=grid_map.positions_to_nodes(path_positions)) if path_positions else None
             if path:
                 path_matrix[y][x] = str(len(path.nodes) - 1)
                 paths[node.position.value] = path
@@ -309,11 +427,11 @@ class ObservationState:
         return f"{header}{content}\n\n"
 
     @staticmethod
-    def _generate_immediate_neighbors(shape: Union[Shadow, Rectangle, Radius], character_id: str) -> str:
-        character = GameEntity.get_instance(character_id)
-        if character is None:
+    def _generate_immediate_neighbors(shape: Union[Shadow, Rectangle, Radius], character_id: str, context: Optional[ObservationContext] = None) -> str:
+        context = context or ObservationContext(shape, character_id)
+        if context.character is None:
             return "Character not found."
-        character_node = character.node
+        character_node = context.character_node
         if character_node is None:
             return "Character is not in a node."
         neighbors = character_node.neighbors()
@@ -364,8 +482,8 @@ class ObservationState:
         return direction_map[direction]
 
     @staticmethod
-    def _generate_node_equivalence_classes(shape: Union[Shadow, Rectangle, Radius]) -> str:
-        nodes = shape.nodes if isinstance(shape, (Shadow, Radius)) else GridMap.get_instance(shape.nodes[0].gridmap_id).get_nodes_in_rect(shape)
+    def _generate_node_equivalence_classes(shape: Union[Shadow, Rectangle, Radius], context: Optional[ObservationContext] = None) -> str:
+        nodes = context.nodes if context is not None else shape.nodes if isinstance(shape, (Shadow, Radius)) else GridMap.get_instance(shape.nodes[0].gridmap_id).get_nodes_in_rect(shape)
         equivalence_classes = {}
         for node in nodes:
             entity_types = tuple(sorted(type(entity).__name__ for entity in node.entities if not isinstance(entity, Character)))
@@ -415,8 +533,8 @@ class ObservationState:
         content = "Movement Sub-Goal: Not implemented yet."
         return f"{header}{content}\n\n"
     @staticmethod
-    def _generate_attribute_summary(shape: Union[Shadow, Rectangle, Radius]) -> str:
-        nodes = shape.nodes if isinstance(shape, (Shadow, Radius)) else GridMap.get_instance(shape.nodes[0].gridmap_id).get_nodes_in_rect(shape)
+    def _generate_attribute_summary(shape: Union[Shadow, Rectangle, Radius], context: Optional[ObservationContext] = None) -> str:
+        nodes = context.nodes if context is not None else shape.nodes if isinstance(shape, (Shadow, Radius)) else GridMap.get_instance(shape.nodes[0].gridmap_id).get_nodes_in_rect(shape)
         attribute_groups = {
             "Walkable and Visible": [],
             "Walkable and Not Visible": [],
@@ -463,6 +581,128 @@ class ObservationState:
         content = "Cognitive Insights: Not implemented yet."
         return f"{header}{content}\n"
 
+
+CellSnapshot = Tuple[bool, bool, Tuple[str, ...]]
+EntitySnapshot = Tuple[str, Tuple[int, int], Tuple[Tuple[str, Any], ...]]
+
+
+class DeltaObservationState(ObservationState):
+    """
+    Observation that reports only what changed since the previous step, with a full observation (a keyframe)
+    every keyframe_interval steps. A delta frame lists the cells whose walkability, visibility or entities
+    changed, the entities that moved, appeared or left the view, and the changed attributes, followed by the
+    character summary and immediate neighbors, which the next action depends on.
+
+    Snapshots of the observed nodes are cached per node version, so only changed nodes are re-read.
+    Attributes:
+        keyframe_interval (int): The number of steps between two keyframes.
+        step (int): The number of observations generated so far.
+        last_keyframe_step (Optional[int]): The step of the latest keyframe.
+        is_keyframe (bool): Whether the latest observation was a keyframe.
+    """
+    def __init__(self, character_id: str, keyframe_interval: int = 10):
+        super().__init__(character_id)
+        self.keyframe_interval = keyframe_interval
+        self.step = 0
+        self.last_keyframe_step: Optional[int] = None
+        self.is_keyframe = False
+        self._cells: Dict[Tuple[int, int], CellSnapshot] = {}
+        self._entities: Dict[str, EntitySnapshot] = {}
+        self._node_snapshots: Dict[str, Tuple[int, CellSnapshot, Dict[str, EntitySnapshot]]] = {}
+
+    def request_keyframe(self):
+        """
+        Makes the next observation a keyframe, e.g. after the prompt history was trimmed.
+        """
+        self.last_keyframe_step = None
+
+    def generate(self, shape: Union[Shadow, Rectangle, Radius]) -> str:
+        context = ObservationContext(shape, self.character_id)
+        cells, entities = self._snapshot(context)
+        self.is_keyframe = self.last_keyframe_step is None or self.step - self.last_keyframe_step >= self.keyframe_interval
+        if self.is_keyframe:
+            observation_message = super().generate(shape)
+            self.last_keyframe_step = self.step
+        else:
+            observation_message = self._generate_changes(cells, entities)
+            observation_message += self._cached("character_summary", (context.character.version, context.character.position.value) if context.character is not None else None,
+                                                lambda: self._generate_character_summary(self.character_id, shape, context))
+            character_node = context.character_node
+            neighbors_key = None
+            if character_node is not None:
+                neighbors_key = (character_node.id, character_node.version, tuple(node.version for node in character_node.neighbors()))
+            observation_message += self._cached("immediate_neighbors", neighbors_key,
+                                                lambda: self._generate_immediate_neighbors(shape, self.character_id, context))
+            observation_message = observation_message.strip()
+        self._cells, self._entities = cells, entities
+        self.step += 1
+        return observation_message
+
+    def _snapshot(self, context: ObservationContext) -> Tuple[Dict[Tuple[int, int], CellSnapshot], Dict[str, EntitySnapshot]]:
+        cells = {}
+        entities = {}
+        for node in context.nodes:
+            cached = self._node_snapshots.get(node.id)
+            if cached is None or cached[0] != node.version:
+                position = node.position.value
+                node_entities = {}
+                for entity in node.entities:
+                    attributes = tuple(sorted((attr_name, attribute.value) for attr_name, attribute in entity.all_attributes().items()
+                                              if not isinstance(attribute, (BlocksMovement, BlocksLight))))
+                    inventory = tuple(f"{type(item).__name__} '{item.name}'" for item in entity.inventory)
+                    node_entities[entity.id] = (f"{type(entity).__name__} '{entity.name}'", position, attributes + (("inventory", inventory),))
+                cell = (not node.blocks_movement.value, not node.blocks_light.value, tuple(type(entity).__name__ for entity in node.entities))
+                cached = self._node_snapshots[node.id] = (node.version, cell, node_entities)
+            cells[node.position.value] = cached[1]
+            entities.update(cached[2])
+        return cells, entities
+
+    def _generate_changes(self, cells: Dict[Tuple[int, int], CellSnapshot], entities: Dict[str, EntitySnapshot]) -> str:
+        cell_changes = []
+        for position, cell in cells.items():
+            previous = self._cells.get(position)
+            if previous is None:
+                cell_changes.append(f"- {position}: now observed, {'Walkable' if cell[0] else 'Not Walkable'}, {'Visible' if cell[1] else 'Not Visible'}, Entities: {list(cell[2])}")
+            elif previous != cell:
+                details = []
+                if previous[0] != cell[0]:
+                    details.append("Walkable" if cell[0] else "Not Walkable")
+                if previous[1] != cell[1]:
+                    details.append("Visible" if cell[1] else "Not Visible")
+                if previous[2] != cell[2]:
+                    details.append(f"Entities: {list(previous[2])} -> {list(cell[2])}")
+                cell_changes.append(f"- {position}: {', '.join(details)}")
+        for position in self._cells:
+            if position not in cells:
+                cell_changes.append(f"- {position}: no longer observed")
+        moves = []
+        attribute_changes = []
+        for entity_id, (label, position, attributes) in entities.items():
+            previous = self._entities.get(entity_id)
+            if previous is None:
+                moves.append(f"- {label}: appeared at {position}")
+                continue
+            if previous[1] != position:
+                moves.append(f"- {label}: {previous[1]} -> {position}")
+            if previous[2] != attributes:
+                before = dict(previous[2])
+                changed = [f"{attr_name}: {before.get(attr_name)} -> {value}" for attr_name, value in attributes if before.get(attr_name) != value]
+                attribute_changes.append(f"- {label} at {position}: {', '.join(changed)}")
+        for entity_id, (label, position, _) in self._entities.items():
+            if entity_id not in entities:
+                moves.append(f"- {label}: left {position} (picked up or out of view)")
+        header = f"# Observation Changes (since step {self.step - 1}, keyframe at step {self.last_keyframe_step})\n"
+        if not (cell_changes or moves or attribute_changes):
+            return f"{header}No changes since the previous step.\n\n"
+        content = ""
+        if cell_changes:
+            content += "## Cells\n" + "\n".join(cell_changes) + "\n"
+        if moves:
+            content += "## Entities Moved\n" + "\n".join(moves) + "\n"
+        if attribute_changes:
+            content += "## Attributes Changed\n" + "\n".join(attribute_changes) + "\n"
+        return f"{header}{content}\n"
+
 class ActionState:
     def __init__(self, action_result: Optional[ActionResult] = None):
         self.action_result = action_result
@@ -550,49 +790,49 @@ class ActionState:
         analysis += f"## Action: {action_name}\n"
         analysis += "### Result: Failure\n"
 
-        if self.action_result.error:
+        failures = self.action_result.failures
+        if self.action_result.error and not failures:
             analysis += f"### Error: {self.action_result.error}\n"
         else:
             analysis += "### Reason: Prerequisites not met\n"
             analysis += "### Prerequisites:\n"
 
+            # the checks were evaluated once when the action was applied, the report of the failed ones is reused
             prerequisites = self.action_result.action_instance.action.prerequisites
-            failed_prerequisites = self.action_result.failed_prerequisites
+            failed_checks = {(failure.statement_id, failure.check): failure for failure in failures}
+            failed_statements = {failure.statement_id for failure in failures}
 
             for statement_type in ["source_statements", "target_statements", "source_target_statements"]:
                 statements = getattr(prerequisites, statement_type)
                 for statement in statements:
-                    is_failed = any(statement.id in prerequisite for prerequisite in failed_prerequisites)
-                    status = "Failed" if is_failed else "Passed"
+                    status = "Failed" if statement.id in failed_statements else "Passed"
                     analysis += f"- {statement_type.capitalize().replace('_', ' ')}:\n"
                     analysis += f"  - Status: {status}\n"
 
                     if statement.conditions:
                         analysis += "  - Conditions:\n"
                         for attr_name, desired_value in statement.conditions.items():
-                            actual_value = source_state.get(attr_name) if statement_type == "source_statements" else target_state.get(attr_name)
-                            condition_met = actual_value == desired_value
-                            analysis += f"    - {attr_name}: {'Met' if condition_met else 'Not Met'} (Desired: {desired_value}, Actual: {actual_value})\n"
+                            failure = failed_checks.get((statement.id, attr_name))
+                            actual_value = failure.actual if failure is not None else desired_value
+                            analysis += f"    - {attr_name}: {'Not Met' if failure is not None else 'Met'} (Desired: {desired_value}, Actual: {actual_value})\n"
 
                     if statement.comparisons:
                         analysis += "  - Comparisons:\n"
                         for comparison_name, (source_attr, target_attr, comparison_func) in statement.comparisons.items():
                             comparison_description = comparison_func.__doc__.strip() if comparison_func.__doc__ else "No description available"
-                            source_value = source_state.get(source_attr) if source_attr in source_state else getattr(source_entity, source_attr, None)
-                            target_value = target_state.get(target_attr) if target_attr in target_state else getattr(target_entity, target_attr, None)
-                            comparison_met = comparison_func(source_value, target_value) if source_value is not None and target_value is not None else False
+                            comparison_met = status == "Passed" or (statement.id, comparison_name) not in failed_checks
                             analysis += f"    - {comparison_name.capitalize()}:\n"
                             analysis += f"      - Source Attribute: {source_attr}\n"
                             analysis += f"      - Target Attribute: {target_attr}\n"
-                            analysis += f"      - Comparison: {'Met' if comparison_met and status == 'Passed' else 'Not Met'}\n"
+                            analysis += f"      - Comparison: {'Met' if comparison_met else 'Not Met'}\n"
                             analysis += f"      - Description: {comparison_description}\n"
 
                     if statement.callables:
                         analysis += "  - Callables:\n"
                         for callable_func in statement.callables:
                             callable_description = callable_func.__doc__.strip() if callable_func.__doc__ else "No description available"
-                            callable_met = callable_func(source_entity, target_entity) if source_entity and target_entity else False
-                            analysis += f"    - {'Met' if callable_met and status == 'Passed' else 'Not Met'}\n"
+                            callable_met = (statement.id, callable_func.__name__) not in failed_checks
+                            analysis += f"    - {'Met' if callable_met else 'Not Met'}\n"
                             analysis += f"      - Description: {callable_description}\n"
 
         return analysis
@@ -614,12 +854,25 @@ class ActionState:
         position = entity_state.get("position", (0, 0))
         return f"{entity_type} '{entity.name}'"
     
+DIRECTION_OFFSETS = {
+    "North": (0, -1),
+    "South": (0, 1),
+    "East": (1, 0),
+    "West": (-1, 0),
+    "NorthEast": (1, -1),
+    "NorthWest": (-1, -1),
+    "SouthEast": (1, 1),
+    "SouthWest": (-1, 1),
+    "Center": (0, 0),
+}
+
+
 class StrActionConverter:
     def __init__(self, actions: Dict[str, Action], entity_type_map: Dict[str, Type[GameEntity]]):
         self.actions = actions
         self.entity_type_map = entity_type_map
 
-    def convert_action_string(self, action_string: str, character_id: str) -> Union[str, ActionsPayload]:
+    def convert_action_string(self, action_string: str, character_id: str, verbose: bool = True) -> Union[str, ActionsPayload]:
         parts = action_string.split(" ")
         if len(parts) != 3:
             return "Invalid action string format. Expected: 'direction action_name target_type'"
@@ -636,7 +889,8 @@ class StrActionConverter:
         target_entity_type = self.entity_type_map.get(target_type)
         if target_entity_type is None:
             return f"Target entity type '{target_type}' not found"
-        print(f"Attemping to find entity of type {target_entity_type} in node {target_node} starting from action string {action_string}")
+        if verbose and TRACE.level >= TraceLevel.DEBUG:
+            TRACE.message(f"Attemping to find entity of type {target_entity_type} in node {target_node} starting from action string {action_string}")
         target_entity = target_node.find_entity(entity_type=target_entity_type)
         if isinstance(target_entity, AmbiguousEntityError):
             return f"Ambiguous target entity: {target_entity.get_error_message()}"
@@ -645,22 +899,34 @@ class StrActionConverter:
         action_class = self.actions.get(action_name)
         if action_class is None:
             return f"Action '{action_name}' not found"
-        action_instance = ActionInstance(source_id=character_id, target_id=target_entity.id, action=action_class())
+        action_instance = ActionInstance(source_id=character_id, target_id=target_entity.id, action=action_class.template())
         return ActionsPayload(actions=[action_instance])
 
+    def allowed_action_strings(self, grid_map: GridMap, character_id: str, radius: int = 1) -> List[str]:
+        """ Derive the allowed strings for a character from the actions applicable in its neighborhood,
+        in the "direction action target_type" format accepted by convert_action_string. The strings are sorted
+        and repeated once per applicable (entity, action) pair.
+        """
+        banned_strings = ["Center Move Floor", "Center Move Character"]
+        character = GameEntity.get_instance(character_id)
+        character_x, character_y = character.position.value
+        offset_directions = {offset: direction for direction, offset in DIRECTION_OFFSETS.items()}
+        allowed_strings = []
+        for node, entity_list in grid_map.get_applicable_actions_in_neighborhood(source=character, radius=radius):
+            target_x, target_y = node.position.value
+            direction = offset_directions.get((target_x - character_x, target_y - character_y))
+            if direction is None:
+                continue
+            for entity, entity_action_list in entity_list:
+                entity_type = entity.__class__.__name__
+                for action in entity_action_list:
+                    str_out = f"{direction} {action.__class__.__name__} {entity_type}"
+                    if str_out not in banned_strings:
+                        allowed_strings.append(str_out)
+        return sorted(allowed_strings)
+
     def _get_target_node(self, character_node: Node, direction: str) -> Optional[Node]:
-        direction_map = {
-            "North": (0, -1),
-            "South": (0, 1),
-            "East": (1, 0),
-            "West": (-1, 0),
-            "NorthEast": (1, -1),
-            "NorthWest": (-1, -1),
-            "SouthEast": (1, 1),
-            "SouthWest": (-1, 1),
-            "Center": (0, 0),
-        }
-        offset = direction_map.get(direction)
+        offset = DIRECTION_OFFSETS.get(direction)
         if offset is None:
             return None
         target_position = (character_node.position.x + offset[0], character_node.position.y + offset[1])
@@ -0,0 +1,368 @@
+# mcts.py
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+from concurrent.futures import ProcessPoolExecutor
+from infinipy.actions import Action, Goal
+from infinipy.nodes import GameEntity
+from infinipy.forks import WorldFork, export_world, import_world
+from infinipy.hashing import WorldHasher
+from infinipy.language_state import StrActionConverter
+import multiprocessing
+import math
+import os
+import random
+import time
+import typing
+if typing.TYPE_CHECKING:
+    from infinipy.gridmap import GridMap
+
+# (reward, allowed action strings at the leaf, whether the leaf is terminal, world hash at the leaf)
+RolloutResult = Tuple[float, List[str], bool, int]
+
+
+def goals_reward(goals: Sequence[Goal]) -> float:
+    """
+    Returns the fraction of the goals achieved in the current state.
+    """
+    if not goals:
+        return 0.0
+    return sum(1 for goal in goals if goal.is_achieved()) / len(goals)
+
+
+def apply_action_string(grid_map: "GridMap", converter: StrActionConverter, character_id: str, action_string: str) -> bool:
+    """
+    Applies an action string the way Agent.run does, without printing.
+
+    Returns:
+        bool: Whether the string converted to actions that were all applied successfully.
+    """
+    payload = converter.convert_action_string(action_string, character_id, verbose=False)
+    if isinstance(payload, str):
+        return False
+    success = True
+    for action_instance in payload.actions:
+        success &= grid_map.apply_action_instance(action_instance, record_states=False, verbose=False).success
+    return success
+
+
+def rollout(grid_map: "GridMap", converter: StrActionConverter, hasher: WorldHasher, character_id: str, goals: Sequence[Goal],
+            path: Sequence[str], seed: int, depth: int, discount: float, radius: int) -> RolloutResult:
+    """
+    Applies the action strings of a tree path to the current state, then plays uniformly random allowed action
+    strings until every goal is achieved or the depth is reached. The caller is responsible for running it on a
+    forked or disposable world.
+
+    Args:
+        grid_map (GridMap): The grid map.
+        converter (StrActionConverter): The converter resolving action strings.
+        hasher (WorldHasher): An attached hasher of the grid map.
+        character_id (str): The ID of the acting character.
+        goals (Sequence[Goal]): The goals rewarding the rollout.
+        path (Sequence[str]): The action strings leading from the root of the tree to the evaluated leaf.
+        seed (int): The seed of the random rollout policy.
+        depth (int): The maximum number of random steps.
+        discount (float): The discount applied to the reward per random step.
+        radius (int): The radius of the neighbourhood searched for allowed actions.
+
+    Returns:
+        RolloutResult: The discounted reward, the sorted distinct allowed action strings at the leaf, whether the
+        leaf is terminal (every goal achieved or no allowed action) and the world hash at the leaf.
+    """
+    for action_string in path:
+        apply_action_string(grid_map, converter, character_id, action_string)
+    state_key = hasher.value
+    allowed_strings = sorted(set(converter.allowed_action_strings(grid_map, character_id, radius)))
+    reward = goals_reward(goals)
+    terminal = reward == 1.0 or not allowed_strings
+    rng = random.Random(seed)
+    action_strings = allowed_strings
+    steps = 0
+    while reward < 1.0 and action_strings and steps < depth:
+        apply_action_string(grid_map, converter, character_id, rng.choice(action_strings))
+        steps += 1
+        reward = goals_reward(goals)
+        action_strings = converter.allowed_action_strings(grid_map, character_id, radius)
+    return reward * discount ** steps, allowed_strings, terminal, state_key
+
+
+# per process state of the rollout workers, set by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(world: bytes, character_id: str, goals: List[Goal], actions: Dict[str, Type[Action]], entity_type_map: Dict[str, Type[GameEntity]], radius: int):
+    grid_map = import_world(world)
+    root = WorldFork.root(grid_map)
+    _worker.update(grid_map=grid_map, root=root, history=(), history_fork=root, character_id=character_id, goals=goals, radius=radius,
+                   converter=StrActionConverter(actions=actions, entity_type_map=entity_type_map), hasher=WorldHasher(grid_map).attach())
+
+
+def _worker_rollout(history: Tuple[str, ...], path: Tuple[str, ...], seed: int, depth: int, discount: float) -> RolloutResult:
+    # the world of the worker is the exported one; the moves played since the export are replayed once into a
+    # fork that is kept while the history only grows
+    worker = _worker
+    if history != worker["history"]:
+        known = worker["history"]
+        if history[:len(known)] == known:
+            base, suffix = worker["history_fork"], history[len(known):]
+        else:
+            base, suffix = worker["root"], history
+        base.activate()
+        history_fork = base.fork().activate()
+        for action_string in suffix:
+            apply_action_string(worker["grid_map"], worker["converter"], worker["character_id"], action_string)
+        worker["history"], worker["history_fork"] = history, history_fork
+    history_fork = worker["history_fork"]
+    history_fork.fork().activate()
+    try:
+        return rollout(worker["grid_map"], worker["converter"], worker["hasher"], worker["character_id"], worker["goals"],
+                       path, seed, depth, discount, worker["radius"])
+    finally:
+        history_fork.activate()
+
+
+class MCTSNode:
+    """
+    A node of the search tree, reached from its parent by playing an action string.
+
+    Attributes:
+        action_string (Optional[str]): The action string leading to the node, None for the root.
+        parent (Optional[MCTSNode]): The parent node.
+        children (Dict[str, MCTSNode]): The expanded children by action string.
+        untried (Optional[List[str]]): The action strings not expanded yet, None until the node was evaluated.
+        visits (int): The number of rollouts through the node.
+        value (float): The sum of the discounted rewards of the rollouts through the node.
+        pending (int): The number of rollouts through the node still running, counted as losses by the selection.
+        terminal (bool): Whether every goal is achieved at the node or no action is allowed.
+        state_key (Optional[int]): The world hash at the node.
+    """
+
+    def __init__(self, action_string: Optional[str] = None, parent: Optional["MCTSNode"] = None):
+        self.action_string = action_string
+        self.parent = parent
+        self.children: Dict[str, MCTSNode] = {}
+        self.untried: Optional[List[str]] = None
+        self.visits = 0
+        self.value = 0.0
+        self.pending = 0
+        self.terminal = False
+        self.state_key: Optional[int] = None
+
+    def path(self) -> Tuple[str, ...]:
+        """
+        Returns the action strings leading from the root to the node.
+        """
+        action_strings = []
+        node = self
+        while node.parent is not None:
+            action_strings.append(node.action_string)
+            node = node.parent
+        return tuple(action_strings[::-1])
+
+    def uct(self, parent_visits: int, exploration: float) -> float:
+        visits = self.visits + self.pending
+        if visits == 0:
+            return math.inf
+        return self.value / visits + exploration * math.sqrt(math.log(parent_visits) / visits)
+
+
+class MCTS:
+    """
+    Monte Carlo Tree Search over the action strings allowed to a character.
+
+    The branching set of a state is the set of distinct strings returned by
+    StrActionConverter.allowed_action_strings, the strings the Agent chooses from. Leaves are evaluated by random
+    rollouts rewarded with the fraction of the goals achieved (Goal.is_achieved), discounted per step so that
+    shorter solutions score higher. With workers, rollouts run in a ProcessPoolExecutor whose processes load
+    the world exported when the tree was created, and replay the moves played since then; batches of leaves are
+    selected with virtual losses so that concurrent rollouts explore different branches. Without workers,
+    rollouts run in WorldFork children of the live world.
+
+    The search keeps its tree between moves: after a move, the subtree of the chosen action is reused as long
+    as the world hash matches the one predicted by the search, and the tree is rebuilt otherwise.
+
+    All the random choices derive from the seed and batches are processed in submission order, so two searches
+    bounded by max_rollouts rather than time_budget, with the same seed and worker count, build the same tree.
+
+    Attributes:
+        grid_map (GridMap): The grid map.
+        character_id (str): The ID of the acting character.
+        goals (List[Goal]): The goals rewarding the search.
+        workers (int): The number of rollout processes, 0 to run rollouts in the current process.
+        time_budget (Optional[float]): The time limit of a search in seconds.
+        max_rollouts (Optional[int]): The limit on the number of rollouts of a search.
+        rollout_depth (int): The maximum number of random steps of a rollout.
+        exploration (float): The exploration constant of UCT.
+        discount (float): The discount applied to rewards per step.
+        stats (Dict[str, float]): The rollouts, elapsed time and rollouts per second per core of the last search.
+    """
+
+    def __init__(self, grid_map: "GridMap", character_id: str, goals: List[Goal], actions: Dict[str, Type[Action]],
+                 entity_type_map: Dict[str, Type[GameEntity]], radius: int = 1, workers: Optional[int] = None,
+                 time_budget: Optional[float] = 1.0, max_rollouts: Optional[int] = None, rollout_depth: int = 30,
+                 exploration: float = 1.4, discount: float = 0.95, seed: int = 0, mp_context: str = "spawn"):
+        if time_budget is None and max_rollouts is None:
+            raise ValueError("MCTS needs a time_budget or a max_rollouts limit")
+        self.grid_map = grid_map
+        self.character_id = character_id
+        self.goals = goals
+        self.actions = actions
+        self.entity_type_map = entity_type_map
+        self.radius = radius
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.time_budget = time_budget
+        self.max_rollouts = max_rollouts
+        self.rollout_depth = rollout_depth
+        self.exploration = exploration
+        self.discount = discount
+        self.mp_context = mp_context
+        self.converter = StrActionConverter(actions=actions, entity_type_map=entity_type_map)
+        self.rng = random.Random(seed)
+        self.root: Optional[MCTSNode] = None
+        self.history: List[str] = []
+        self.stats: Dict[str, float] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _reset(self, state_key: int):
+        self.root = MCTSNode()
+        self.root.state_key = state_key
+        self.history = []
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.mp_context),
+                initializer=_init_worker,
+                initargs=(export_world(self.grid_map), self.character_id, self.goals, self.actions, self.entity_type_map, self.radius),
+            )
+
+    def close(self):
+        """
+        Shuts down the rollout processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        self.root = None
+
+    def select(self) -> Optional[MCTSNode]:
+        """
+        Descends the tree with UCT and expands one untried action string.
+
+        Returns:
+            Optional[MCTSNode]: The leaf to evaluate, or None if the descent reached a node still being evaluated.
+        """
+        node = self.root
+        while True:
+            if node.terminal:
+                return node
+            if node.untried is None:
+                return node if node.pending == 0 else None
+            if node.untried:
+                action_string = node.untried.pop()
+                child = node.children[action_string] = MCTSNode(action_string, node)
+                return child
+            if not node.children:
+                return node
+            parent_visits = max(1, node.visits + node.pending)
+            node = max(node.children.values(), key=lambda child: child.uct(parent_visits, self.exploration))
+
+    def backpropagate(self, leaf: MCTSNode, result: RolloutResult):
+        reward, allowed_strings, terminal, state_key = result
+        if leaf.untried is None:
+            leaf.untried = list(allowed_strings)
+            self.rng.shuffle(leaf.untried)
+            leaf.terminal = terminal
+            leaf.state_key = state_key
+        node = leaf
+        while node is not None:
+            node.pending -= 1
+            node.visits += 1
+            node.value += reward
+            reward *= self.discount
+            node = node.parent
+
+    def _run_inline(self, paths: List[Tuple[str, ...]], seeds: List[int]) -> List[RolloutResult]:
+        owns_root = WorldFork.active(self.grid_map) is None
+        start = WorldFork.active(self.grid_map) or WorldFork.root(self.grid_map)
+        hasher = WorldHasher(self.grid_map).attach()
+        results = []
+        try:
+            for path, seed in zip(paths, seeds):
+                start.fork().activate()
+                results.append(rollout(self.grid_map, self.converter, hasher, self.character_id, self.goals,
+                                       path, seed, self.rollout_depth, self.discount, self.radius))
+                start.activate()
+        finally:
+            start.activate()
+            hasher.detach()
+            if owns_root:
+                WorldFork.release(self.grid_map)
+        return results
+
+    def search(self) -> Optional[str]:
+        """
+        Searches from the current state of the world within the budget and returns the most visited action string.
+        The subtree of the returned action is kept as the root of the next search.
+
+        Returns:
+            Optional[str]: The chosen action string, or None if no action is allowed.
+        """
+        state_key = WorldHasher(self.grid_map).value
+        if self.root is None or self.root.state_key != state_key:
+            self._reset(state_key)
+        root = self.root
+        if root.untried is None:
+            root.untried = sorted(set(self.converter.allowed_action_strings(self.grid_map, self.character_id, self.radius)))
+            self.rng.shuffle(root.untried)
+        if not root.untried and not root.children:
+            return None
+        batch_size = max(1, self.workers)
+        rollouts = 0
+        start_time = time.perf_counter()
+        while True:
+            elapsed = time.perf_counter() - start_time
+            if self.time_budget is not None and elapsed >= self.time_budget:
+                break
+            if self.max_rollouts is not None and rollouts >= self.max_rollouts:
+                break
+            if self.max_rollouts is not None:
+                batch_size = min(batch_size, self.max_rollouts - rollouts)
+            leaves = []
+            for _ in range(batch_size):
+                leaf = self.select()
+                if leaf is None:
+                    break
+                node = leaf
+                while node is not None:
+                    node.pending += 1
+                    node = node.parent
+                leaves.append(leaf)
+            if not leaves:
+                break
+            paths = [leaf.path() for leaf in leaves]
+            seeds = [self.rng.getrandbits(64) for _ in leaves]
+            if self._executor is not None:
+                history = tuple(self.history)
+                results = list(self._executor.map(_worker_rollout, [history] * len(leaves), paths, seeds,
+                                                  [self.rollout_depth] * len(leaves), [self.discount] * len(leaves)))
+            else:
+                results = self._run_inline(paths, seeds)
+            for leaf, result in zip(leaves, results):
+                self.backpropagate(leaf, result)
+            rollouts += len(leaves)
+        elapsed = time.perf_counter() - start_time
+        rollouts_per_second = rollouts / elapsed if elapsed > 0 else 0.0
+        self.stats = {
+            "rollouts": rollouts,
+            "elapsed": elapsed,
+            "rollouts_per_second": rollouts_per_second,
+            "rollouts_per_second_per_core": rollouts_per_second / max(1, self.workers),
+        }
+        if not root.children:
+            return None
+        best = max(root.children.values(), key=lambda child: (child.visits, child.value))
+        best.parent = None
+        self.root = best
+        self.history.append(best.action_string)
+        return best.action_string
@@ -1,8 +1,9 @@
 # nodes.py
 
 from typing import List, Optional, Dict, Any, Union, Type, Tuple
-from pydantic import BaseModel, Field, ConfigDict
-from infinipy.entity import Entity, Attribute, RegistryHolder
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr
+from infinipy.entity import Entity, Attribute, RegistryHolder, bind_attributes, observe_field_write
+from infinipy.events import ChangeBus, ChangeEvent, FieldChanged, NodeEntitiesChanged, InventoryChanged
 import typing
 
 import uuid
@@ -47,6 +48,8 @@ class GameEntity(Entity):
     inventory: List["GameEntity"] = Field(default_factory=list, description="The entities stored inside this entity's inventory")
     stored_in: Optional["GameEntity"] = Field(default=None, description="The entity this entity is stored inside, if any")
     hash_resolution: str = Field(default="default", description="The resolution level for hashing and string representation")
+    _hash_cache: Dict[str, Tuple[Any, int]] = PrivateAttr(default_factory=dict)
+    _node_writes: int = PrivateAttr(default=0)
 
     @classmethod
     def get_instance(cls, instance_id: str) -> Optional["GameEntity"]:
@@ -55,6 +58,40 @@ class GameEntity(Entity):
             raise TypeError(f"Instance with ID {instance_id} is not of type {cls.__name__}")
         return instance
 
+    @classmethod
+    def get_instance_by_handle(cls, handle: int) -> Optional["GameEntity"]:
+        instance = super().get_instance_by_handle(handle)
+        if instance is not None and not isinstance(instance, cls):
+            raise TypeError(f"Instance with handle {handle} is not of type {cls.__name__}")
+        return instance
+
+    def __getstate__(self) -> Dict[Any, Any]:
+        # memoized hashes depend on the string hashing of the process, which is salted per process
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_hash_cache": {}}
+        return state
+
+    @property
+    def state_version(self) -> int:
+        """
+        Returns a counter bumped like the version, except by the moves of the entity between nodes, to key caches
+        of checks that do not depend on its location.
+        """
+        private = self.__pydantic_private__
+        return private["_version"] - private["_node_writes"]
+
+    def touch(self):
+        """
+        Bumps the version of the entity and of the container and node holding it,
+        since their inventory and entity hashes depend on the state of the entity.
+        """
+        self.__pydantic_private__["_version"] += 1
+        fields = self.__dict__
+        if fields["stored_in"] is not None:
+            fields["stored_in"].touch()
+        if fields["node"] is not None:
+            fields["node"].touch()
+
     @property
     def position(self) -> Position:
         """
@@ -98,12 +135,13 @@ class GameEntity(Entity):
             self.node.remove_entity(self)
             self.node = None
 
-    def update_attributes(self, attributes: Dict[str, Union[Attribute, "Node", str, List[str]]]) -> "GameEntity":
+    def update_attributes(self, attributes: Dict[str, Union[Attribute, "Node", str, int, List[Union[str, int]]]]) -> "GameEntity":
         """
         Updates the attributes of the entity.
 
         Args:
-            attributes (Dict[str, Union[Attribute, Node, str, List[str]]]): The attributes to update.
+            attributes (Dict[str, Union[Attribute, Node, str, int, List[Union[str, int]]]]): The attributes to update.
+                Node, stored_in and inventory references can be given as IDs or as registry handles.
 
         Returns:
             GameEntity: The updated entity.
@@ -116,15 +154,19 @@ class GameEntity(Entity):
             if attr_name == "node":
                 if isinstance(value, Node):
                     new_node = value
+                elif isinstance(value, int):
+                    new_node = Node.get_instance_by_handle(value)  # Retrieve the Node instance using the handle
                 elif isinstance(value, str):
                     new_node = Node.get_instance(value)  # Retrieve the Node instance using the ID
             elif attr_name == "stored_in":
-                if value is not None:
+                if isinstance(value, int):
+                    new_stored_in = GameEntity.get_instance_by_handle(value)  # Retrieve the GameEntity instance using the handle
+                elif value is not None:
                     new_stored_in = GameEntity.get_instance(value)  # Retrieve the GameEntity instance using the ID
                 else:
                     new_stored_in = None  # Set new_stored_in to None if the value is None
             elif attr_name == "inventory" and isinstance(value, list):
-                new_inventory = [GameEntity.get_instance(item_id) for item_id in value]  # Retrieve GameEntity instances using their IDs
+                new_inventory = [GameEntity.get_instance_by_handle(item) if isinstance(item, int) else GameEntity.get_instance(item) for item in value]  # Retrieve GameEntity instances using their handles or IDs
             elif isinstance(value, Attribute):
                 updated_attributes[attr_name] = value
         if new_stored_in is not None:
@@ -133,7 +175,7 @@ class GameEntity(Entity):
             self.stored_in = new_stored_in  # Update the stored_in attribute with the retrieved GameEntity instance
         elif new_node:
             if self.stored_in:
-                self.stored_in.inventory.remove(self)  # Remove the entity from its current stored_in inventory
+                self.stored_in.detach_item(self)  # Remove the entity from its current stored_in inventory
             if self.node:
                 self.node.remove_entity(self)  # Remove the entity from its current node
             new_node.add_entity(self)  # Add the entity to the new node
@@ -152,7 +194,7 @@ class GameEntity(Entity):
             entity (GameEntity): The entity to add to the inventory.
         """
         if entity not in self.inventory:
-            self.inventory.append(entity)
+            self.attach_item(entity)
             entity.stored_in = self
 
     def remove_from_inventory(self, entity: "GameEntity"):
@@ -163,9 +205,37 @@ class GameEntity(Entity):
             entity (GameEntity): The entity to remove from the inventory.
         """
         if entity in self.inventory:
-            self.inventory.remove(entity)
+            self.detach_item(entity)
             entity.stored_in = None
 
+    def attach_item(self, entity: "GameEntity", index: Optional[int] = None):
+        """
+        Adds an entity to the inventory list without touching its stored_in reference.
+
+        Args:
+            entity (GameEntity): The entity to add.
+            index (Optional[int]): The position at which to insert the entity. If not provided, the entity is appended.
+        """
+        if index is None:
+            index = len(self.inventory)
+        self.inventory.insert(index, entity)
+        self.touch()
+        if ChangeBus.active:
+            ChangeBus.emit(InventoryChanged(owner_id=self.id, item_id=entity.id, added=True, index=index))
+
+    def detach_item(self, entity: "GameEntity"):
+        """
+        Removes an entity from the inventory list without touching its stored_in reference.
+
+        Args:
+            entity (GameEntity): The entity to remove.
+        """
+        index = self.inventory.index(entity)
+        del self.inventory[index]
+        self.touch()
+        if ChangeBus.active:
+            ChangeBus.emit(InventoryChanged(owner_id=self.id, item_id=entity.id, added=False, index=index))
+
     def set_stored_in(self, entity: Optional["GameEntity"]):
         """
         Sets the entity this entity is stored inside.
@@ -285,19 +355,31 @@ class GameEntity(Entity):
 
         Returns:
             int: The hash value of the entity.
+
+        The "attributes" and "inventory" hashes are memoized per resolution and invalidated by the entity version,
+        which is also bumped when an item in the inventory changes.
         """
         resolution = resolution or self.hash_resolution
         if resolution == "default":
             return hash(self.id)
-        elif resolution == "attributes":
-            attribute_values = [f"{attr_name}={attr_value.value}" for attr_name, attr_value in self.__dict__.items() if isinstance(attr_value, Attribute)]
-            return hash((self.id, tuple(attribute_values)))
+        private = self.__pydantic_private__
+        if resolution == "attributes":
+            stamp = private["_version"]
         elif resolution == "inventory":
-            attribute_values = [f"{attr_name}={attr_value.value}" for attr_name, attr_value in self.__dict__.items() if isinstance(attr_value, Attribute)]
-            inventory_hashes = tuple(hash(item) for item in self.inventory)
-            return hash((self.id, tuple(attribute_values), inventory_hashes))
+            stamp = (private["_version"], tuple(item.hash_resolution for item in self.inventory))
         else:
             raise ValueError(f"Invalid resolution level: {resolution}")
+        cached = private["_hash_cache"].get(resolution)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        attribute_values = [f"{attr_name}={attr_value.value}" for attr_name, attr_value in self.__dict__.items() if isinstance(attr_value, Attribute)]
+        if resolution == "attributes":
+            hash_value = hash((self.id, tuple(attribute_values)))
+        else:
+            inventory_hashes = tuple(hash(item) for item in self.inventory)
+            hash_value = hash((self.id, tuple(attribute_values), inventory_hashes))
+        private["_hash_cache"][resolution] = (stamp, hash_value)
+        return hash_value
         
 
 # nodes.py
@@ -327,6 +409,11 @@ class Node(BaseModel, RegistryHolder):
     blocks_light: BlocksLight = Field(default_factory=BlocksLight, description="Indicates if the node blocks light, True if any entity in the node blocks light, False otherwise")
 
     hash_resolution: str = Field(default="default", description="The resolution level for hashing and string representation")
+    _version: int = PrivateAttr(default=0)
+    _hash_cache: Dict[str, Tuple[Any, int]] = PrivateAttr(default_factory=dict)
+    _type_index: Dict[Type[GameEntity], List[GameEntity]] = PrivateAttr(default_factory=dict)
+    _id_index: Dict[str, GameEntity] = PrivateAttr(default_factory=dict)
+    _gridmap_handle: Optional[int] = PrivateAttr(default=None)
 
     class Config(ConfigDict):
         arbitrary_types_allowed = True
@@ -334,6 +421,46 @@ class Node(BaseModel, RegistryHolder):
     def __init__(self, **data: Any):
         super().__init__(**data)
         self.register(self)
+        bind_attributes(self)
+        self.rebuild_entity_index()
+
+    def __getstate__(self) -> Dict[Any, Any]:
+        # memoized hashes depend on the string hashing of the process and registry handles are local to it,
+        # both are rebuilt on first use after unpickling
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_hash_cache": {}, "_gridmap_handle": None}
+        return state
+
+    def __setattr__(self, name: str, value: Any):
+        if name in type(self).__pydantic_fields__:
+            old_value = self.__dict__.get(name)
+            super().__setattr__(name, value)
+            if name == "entities":
+                self.rebuild_entity_index()
+            observe_field_write(self, name, old_value, value)
+        else:
+            super().__setattr__(name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        # nodes with different IDs never compare equal, skip pydantic's comparison of private state and fields
+        if self is other:
+            return True
+        if isinstance(other, Node) and self.id != other.id:
+            return False
+        return super().__eq__(other)
+
+    @property
+    def version(self) -> int:
+        """
+        Returns a counter that is bumped every time the entity list, a field or an owned attribute value of the node changes.
+        """
+        return self.__pydantic_private__["_version"]
+
+    def touch(self):
+        """
+        Bumps the version of the node, invalidating every cache keyed on it.
+        """
+        self.__pydantic_private__["_version"] += 1
 
     @classmethod
     def get_instance(cls, instance_id: str) -> Optional["Node"]:
@@ -342,6 +469,33 @@ class Node(BaseModel, RegistryHolder):
             raise TypeError(f"Instance with ID {instance_id} is not of type {cls.__name__}")
         return instance
 
+    @classmethod
+    def get_instance_by_handle(cls, handle: int) -> Optional["Node"]:
+        instance = super().get_instance_by_handle(handle)
+        if instance is not None and not isinstance(instance, cls):
+            raise TypeError(f"Instance with handle {handle} is not of type {cls.__name__}")
+        return instance
+
+    def get_grid_map(self) -> Optional["GridMap"]:
+        """
+        Returns the grid map the node belongs to, resolving gridmap_id to a registry handle on first use.
+
+        Returns:
+            Optional[GridMap]: The grid map, or None if it is not registered.
+        """
+        private = self.__pydantic_private__
+        handle = private["_gridmap_handle"]
+        if handle is not None:
+            grid_map = RegistryHolder.get_instance_by_handle(handle)
+            # handles are local to a process, a node loaded from another process carries a foreign one
+            if grid_map is not None and grid_map.id == self.gridmap_id:
+                return grid_map
+        handle = RegistryHolder.get_handle(self.gridmap_id)
+        if handle is None:
+            return None
+        private["_gridmap_handle"] = handle
+        return RegistryHolder.get_instance_by_handle(handle)
+
     def add_entity(self, entity: GameEntity):
         """
         Adds an entity to the node.
@@ -354,7 +508,7 @@ class Node(BaseModel, RegistryHolder):
         """
         if entity.stored_in:
             raise ValueError("Cannot add an entity stored inside another entity's inventory directly to a node")
-        self.entities.append(entity)
+        self.attach(entity)
         entity.node = self
         self.update_blocking_properties()
 
@@ -370,10 +524,72 @@ class Node(BaseModel, RegistryHolder):
         """
         if entity.stored_in:
             raise ValueError("Cannot remove an entity stored inside another entity's inventory directly from a node")
-        self.entities.remove(entity)
+        self.detach(entity)
         entity.node = None
         self.update_blocking_properties()
 
+    def rebuild_entity_index(self):
+        """
+        Rebuilds the type and ID indexes used by find_entity from the entity list.
+        """
+        private = self.__pydantic_private__
+        private["_type_index"] = {}
+        private["_id_index"] = {}
+        for entity in self.entities:
+            self._index_entity(entity)
+
+    def _index_entity(self, entity: GameEntity):
+        type_index = self.__pydantic_private__["_type_index"]
+        for entity_class in type(entity).__mro__:
+            if isinstance(entity_class, type) and issubclass(entity_class, GameEntity):
+                type_index.setdefault(entity_class, []).append(entity)
+        self.__pydantic_private__["_id_index"][entity.id] = entity
+
+    def _unindex_entity(self, entity: GameEntity):
+        type_index = self.__pydantic_private__["_type_index"]
+        for entity_class in type(entity).__mro__:
+            if isinstance(entity_class, type) and issubclass(entity_class, GameEntity):
+                bucket = type_index[entity_class]
+                bucket.remove(entity)
+                if not bucket:
+                    del type_index[entity_class]
+        if not any(other is entity for other in self.entities):
+            self.__pydantic_private__["_id_index"].pop(entity.id, None)
+
+    def attach(self, entity: GameEntity, index: Optional[int] = None):
+        """
+        Adds an entity to the entity list without touching its node reference or the blocking properties.
+
+        Args:
+            entity (GameEntity): The entity to add.
+            index (Optional[int]): The position at which to insert the entity. If not provided, the entity is appended.
+        """
+        if index is None or index >= len(self.entities):
+            index = len(self.entities)
+            self.entities.append(entity)
+            self._index_entity(entity)
+        else:
+            self.entities.insert(index, entity)
+            # the index lists follow the order of the entity list
+            self.rebuild_entity_index()
+        self.touch()
+        if ChangeBus.active:
+            ChangeBus.emit(NodeEntitiesChanged(node_id=self.id, entity_id=entity.id, added=True, index=index))
+
+    def detach(self, entity: GameEntity):
+        """
+        Removes an entity from the entity list without touching its node reference or the blocking properties.
+
+        Args:
+            entity (GameEntity): The entity to remove.
+        """
+        index = self.entities.index(entity)
+        del self.entities[index]
+        self._unindex_entity(entity)
+        self.touch()
+        if ChangeBus.active:
+            ChangeBus.emit(NodeEntitiesChanged(node_id=self.id, entity_id=entity.id, added=False, index=index))
+
     def update_entity(self, old_entity: GameEntity, new_entity: GameEntity):
         """
         Updates an entity in the node.
@@ -403,7 +619,8 @@ class Node(BaseModel, RegistryHolder):
         """
         Resets the node by clearing its entities and resetting the blocking properties.
         """
-        self.entities.clear()
+        for entity in list(self.entities):
+            self.detach(entity)
         self.blocks_movement = False
         self.blocks_light = False
 
@@ -420,20 +637,28 @@ class Node(BaseModel, RegistryHolder):
 
         Returns:
             Optional[Union[GameEntity, AmbiguousEntityError]]: The found entity, an AmbiguousEntityError if multiple entities match the criteria, or None if no entity is found.
+
+        Candidates are taken from the node's ID index when an ID is given, and from its type index
+        (which files every entity under all of its GameEntity base classes) otherwise.
         """
+        private = self.__pydantic_private__
+        if entity_id is not None:
+            entity = private["_id_index"].get(entity_id)
+            candidates = [entity] if isinstance(entity, entity_type) else []
+        elif isinstance(entity_type, type) and issubclass(entity_type, GameEntity):
+            candidates = private["_type_index"].get(entity_type, [])
+        else:
+            candidates = [entity for entity in self.entities if isinstance(entity, entity_type)]
         matching_entities = []
-        for entity in self.entities:
-            if isinstance(entity, entity_type):
-                if entity_id is not None and entity.id != entity_id:
-                    continue
-                if entity_name is not None and entity.name != entity_name:
+        for entity in candidates:
+            if entity_name is not None and entity.name != entity_name:
+                continue
+            if attributes is not None:
+                entity_attributes = {attr_name: entity.get_attr(attr_name) for attr_name in attributes}
+                if any(attr_name not in entity_attributes or entity_attributes[attr_name] != attr_value
+                       for attr_name, attr_value in attributes.items()):
                     continue
-                if attributes is not None:
-                    entity_attributes = {attr_name: entity.get_attr(attr_name) for attr_name in attributes}
-                    if any(attr_name not in entity_attributes or entity_attributes[attr_name] != attr_value
-                           for attr_name, attr_value in attributes.items()):
-                        continue
-                matching_entities.append(entity)
+            matching_entities.append(entity)
         if len(matching_entities) == 1:
             return matching_entities[0]
         elif len(matching_entities) > 1:
@@ -463,7 +688,7 @@ class Node(BaseModel, RegistryHolder):
         Returns:
             List[Node]: The neighboring nodes.
         """
-        grid_map: Optional[GridMap] = RegistryHolder.get_instance(self.gridmap_id)
+        grid_map: Optional[GridMap] = self.get_grid_map()
         if grid_map:
             return grid_map.get_neighbors(self.position.value)
         return []
@@ -535,18 +760,74 @@ class Node(BaseModel, RegistryHolder):
         return f"{self.__class__.__name__}({attrs_str})"
 
     def __hash__(self, resolution: Optional[str] = None) -> int:
+        """
+        Returns the hash value of the node.
+
+        Args:
+            resolution (Optional[str]): The resolution level for hashing. If not provided, uses the node's hash_resolution.
+
+        Returns:
+            int: The hash value of the node.
+
+        The "entities" and "full" hashes are memoized per resolution and invalidated by the node version,
+        which is also bumped when one of its entities changes.
+        """
         resolution = resolution or self.hash_resolution
         if resolution == "default":
             return hash(self.id)
-        elif resolution == "entities":
-            entity_hashes = tuple(hash(entity) for entity in self.entities)
-            return hash((self.id, entity_hashes))
-        elif resolution == "full":
-            entity_hashes = tuple(hash(entity) for entity in self.entities)
-            return hash((self.id, entity_hashes, self.blocks_movement.value, self.blocks_light.value))
-        else:
+        if resolution not in ("entities", "full"):
             raise ValueError(f"Invalid resolution level: {resolution}")
-            
+        private = self.__pydantic_private__
+        stamp = (private["_version"], tuple(entity.hash_resolution for entity in self.entities))
+        cached = private["_hash_cache"].get(resolution)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        entity_hashes = tuple(hash(entity) for entity in self.entities)
+        if resolution == "entities":
+            hash_value = hash((self.id, entity_hashes))
+        else:
+            hash_value = hash((self.id, entity_hashes, self.blocks_movement.value, self.blocks_light.value))
+        private["_hash_cache"][resolution] = (stamp, hash_value)
+        return hash_value
+
+
+
+def grid_map_id_of(instance: Any) -> Optional[str]:
+    """
+    Returns the ID of the grid map a node or an entity belongs to, following the containers of stored entities,
+    or None for objects outside any grid map.
+    """
+    while isinstance(instance, GameEntity):
+        if instance.node is not None:
+            return instance.node.gridmap_id
+        instance = instance.stored_in
+    if isinstance(instance, Node):
+        return instance.gridmap_id
+    return None
+
+
+def change_in_grid_map(event: ChangeEvent, grid_map_id: str) -> bool:
+    """
+    Returns whether a change event concerns a grid map: its owner belongs to the grid map, or, for the node and
+    container references of entities moving in or out of it, the previous or new value does.
+
+    Args:
+        event (ChangeEvent): The change event.
+        grid_map_id (str): The ID of the grid map.
+
+    Returns:
+        bool: Whether the event concerns the grid map.
+    """
+    if isinstance(event, NodeEntitiesChanged):
+        return grid_map_id_of(RegistryHolder.get_instance(event.node_id)) == grid_map_id
+    if grid_map_id_of(RegistryHolder.get_instance(event.owner_id)) == grid_map_id:
+        return True
+    if isinstance(event, FieldChanged):
+        return grid_map_id_of(event.old_value) == grid_map_id or grid_map_id_of(event.new_value) == grid_map_id
+    if isinstance(event, InventoryChanged):
+        return grid_map_id_of(RegistryHolder.get_instance(event.item_id)) == grid_map_id
+    return False
+
 
 class AmbiguousEntityError(BaseModel):
     """
@@ -1,8 +1,9 @@
 # payloads.py
 
 from typing import List, Optional, Dict, Any, Tuple, Union
-from pydantic import BaseModel, Field
-from infinipy.actions import Action
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+from infinipy.entity import Attribute, WRITE_JOURNALS
+from infinipy.actions import Action, PrerequisiteFailure
 from infinipy.nodes import GameEntity, Node
 from infinipy.errors import ActionConversionError, AmbiguousEntityError
 import typing
@@ -14,13 +15,164 @@ class ActionInstance(BaseModel):
     target_id: str
     action: Action
 
+    def get_source(self) -> Optional[GameEntity]:
+        return GameEntity.get_instance(self.source_id)
+
+    def get_target(self) -> Optional[GameEntity]:
+        return GameEntity.get_instance(self.target_id)
+
+StateChanges = Dict[str, Dict[str, Tuple[Any, Any]]]
+
+
+def state_changes(state_before: Dict[str, Any], state_after: Dict[str, Any]) -> StateChanges:
+    """
+    Returns the (before, after) values of the fields that differ between two states given by role, skipping the
+    roles missing from either state.
+    """
+    changes = {}
+    for role in ("source", "target"):
+        before, after = state_before.get(role), state_after.get(role)
+        if before is None or after is None:
+            continue
+        role_changes = {field_name: (before.get(field_name), after.get(field_name)) for field_name in {**before, **after} if before.get(field_name) != after.get(field_name)}
+        if role_changes:
+            changes[role] = role_changes
+    return changes
+
+
+class ActionStates:
+    """
+    The changes made by an action to its source and target, recorded while the action is applied.
+
+    While the action is applied, a write journal (see WRITE_JOURNALS) collects the previous value of every attribute
+    written on the source, the target and the items stored in them, whose positions derive from theirs. Positions
+    and inventories are read before the action and compared by close(), which also takes the states of the source
+    and target after the action. The states before are obtained by reverting the changes from those, so an action
+    reads the full states of its entities once instead of twice.
+
+    Attributes:
+        source (GameEntity): The source entity.
+        target (GameEntity): The target entity.
+        entity_changes (StateChanges): The (before, after) values of the changed state fields, by entity ID.
+        states_after (Dict[str, Dict[str, Any]]): The states of the source and target after the action, by role, taken by close().
+    """
+
+    def __init__(self, source: GameEntity, target: GameEntity):
+        self.source = source
+        self.target = target
+        self.role_ids = (("source", source.id), ("target", target.id))
+        self.entities: Dict[str, GameEntity] = {source.id: source, target.id: target}
+        stack = source.inventory + target.inventory
+        while stack:
+            entity = stack.pop()
+            if entity.id not in self.entities:
+                self.entities[entity.id] = entity
+                stack.extend(entity.inventory)
+        self.locations_before = [(entity, entity.position.value, list(entity.inventory)) for entity in self.entities.values()]
+        self.journal: List[Tuple[str, str, Any]] = []
+        WRITE_JOURNALS.append(self.journal)
+        self.entity_changes: StateChanges = {}
+        self.states_after: Dict[str, Dict[str, Any]] = {}
+
+    def close(self):
+        """
+        Closes the write journal once the action was applied, computes the changes and takes the states of the
+        source and target after the action.
+        """
+        WRITE_JOURNALS.remove(self.journal)
+        entity_changes = self.entity_changes
+        for owner_id, field_name, old_value in self.journal:
+            entity = self.entities.get(owner_id)
+            if entity is None:
+                continue
+            changes = entity_changes.setdefault(owner_id, {})
+            if field_name in changes:
+                continue
+            attribute = getattr(entity, field_name, None)
+            if isinstance(old_value, Attribute):
+                old_value = old_value.value
+            elif not isinstance(attribute, Attribute):
+                # node, stored_in and inventory writes are reported through the position and the inventory
+                continue
+            changes[field_name] = (old_value, attribute.value if isinstance(attribute, Attribute) else None)
+        for entity, position_before, inventory_before in self.locations_before:
+            position_after = entity.position.value
+            inventory_after = entity.inventory
+            if position_after != position_before:
+                entity_changes.setdefault(entity.id, {})["position"] = (position_before, position_after)
+            if len(inventory_after) != len(inventory_before) or any(item is not previous for item, previous in zip(inventory_after, inventory_before)):
+                entity_changes.setdefault(entity.id, {})["inventory"] = ([item.id for item in inventory_before], [item.id for item in inventory_after])
+        for entity_id in list(entity_changes):
+            changes = entity_changes[entity_id]
+            for field_name in [field_name for field_name, (old_value, new_value) in changes.items() if field_name != "inventory" and old_value == new_value]:
+                del changes[field_name]
+            if not changes:
+                del entity_changes[entity_id]
+        # the states are taken now, later changes of the entities must not show in the results of earlier actions
+        self.states_after = {"source": self.source.get_state(), "target": self.target.get_state()}
+        self.journal = []
+        self.locations_before = []
+        self.entities = {}
+
+    def role_changes(self) -> StateChanges:
+        """
+        Returns the (before, after) values of the changed state fields of the source and target, by role.
+        """
+        return {role: self.entity_changes[entity_id] for role, entity_id in self.role_ids if entity_id in self.entity_changes}
+
+    def report(self, result: "ActionResult"):
+        """
+        Fills the states of the source and target before and after the action in its result, by role. Failed
+        actions report no state after.
+
+        Args:
+            result (ActionResult): The result of the action, once the states are closed.
+        """
+        state_before = {}
+        for role, entity_id in self.role_ids:
+            before = dict(self.states_after[role])
+            for field_name, (old_value, _) in self.entity_changes.get(entity_id, {}).items():
+                before[field_name] = old_value
+            state_before[role] = before
+        result.state_before = state_before
+        result.state_after = self.states_after if result.success else {}
+
+
 class ActionResult(BaseModel):
+    """
+    The outcome of applying an action instance.
+
+    When the apply step records states, it keeps the changes made by the action (see ActionStates) and fills
+    state_before and state_after from them.
+    Attributes:
+        action_instance (ActionInstance): The applied action instance.
+        success (bool): Whether the action was applied.
+        error (Optional[str]): The reason of the failure.
+        failed_prerequisites (List[str]): The descriptions of the prerequisite checks that did not hold.
+        failures (List[PrerequisiteFailure]): The prerequisite checks that did not hold, with the expected and actual values.
+        state_before (Dict[str, Any]): The states of the source and target before the action, by role.
+        state_after (Dict[str, Any]): The states of the source and target after the action, by role, empty for failed actions.
+        states (Optional[ActionStates]): The changes recorded by the apply step.
+    """
     action_instance: ActionInstance
     success: bool
     error: Optional[str] = None
     failed_prerequisites: List[str] = Field(default_factory=list)
+    failures: List[PrerequisiteFailure] = Field(default_factory=list)
     state_before: Dict[str, Any] = Field(default_factory=dict)
     state_after: Dict[str, Any] = Field(default_factory=dict)
+    states: Optional[ActionStates] = Field(default=None, exclude=True, repr=False, description="The changes recorded by the apply step")
+
+    class Config(ConfigDict):
+        arbitrary_types_allowed = True
+
+    @computed_field
+    @property
+    def changes(self) -> StateChanges:
+        if self.states is not None:
+            return self.states.role_changes()
+        return state_changes(self.state_before, self.state_after)
+
 
 class ActionsResults(BaseModel):
     results: List[ActionResult]
@@ -91,7 +243,7 @@ class SummarizedActionPayload(BaseModel):
         action_class = grid_map.actions.get(self.action_name)
         if action_class is None:
             return ActionConversionError(message=f"Action '{self.action_name}' not found")
-        action_instance = ActionInstance(source_id=source_entity.id, target_id=target_entity.id, action=action_class())
+        action_instance = ActionInstance(source_id=source_entity.id, target_id=target_entity.id, action=action_class.template())
         return ActionsPayload(actions=[action_instance])
 
 class SummarizedEgoActionPayload(SummarizedActionPayload):
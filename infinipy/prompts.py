@@ -0,0 +1,242 @@
+# prompts.py
+from typing import Any, Callable, Dict, List, Optional
+from pydantic import BaseModel, Field
+from collections import OrderedDict
+import re
+
+TokenCounter = Callable[[str], int]
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimates the number of tokens of a text at four characters per token, for when no tokenizer is available.
+    """
+    return (len(text) + 3) // 4
+
+
+class CachedTokenCounter:
+    """
+    Memoizes a token counter, since the same action log entries and sections are counted at every step.
+    Attributes:
+        count_tokens (TokenCounter): The wrapped counter.
+        capacity (int): The maximum number of memoized texts.
+    """
+
+    def __init__(self, count_tokens: TokenCounter, capacity: int = 4096):
+        self.count_tokens = count_tokens
+        self.capacity = capacity
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+
+    def __call__(self, text: str) -> int:
+        count = self._counts.get(text)
+        if count is None:
+            count = self._counts[text] = self.count_tokens(text)
+            if len(self._counts) > self.capacity:
+                self._counts.popitem(last=False)
+        else:
+            self._counts.move_to_end(text)
+        return count
+
+
+def tokenizer_counter(llm: Any) -> TokenCounter:
+    """
+    Returns a counter using the tokenizer of a model: the llama.cpp tokenizer of an outlines llamacpp model, or
+    the encode method of a Hugging Face style tokenizer. Falls back to approximate_token_count.
+
+    Args:
+        llm (Any): The model.
+
+    Returns:
+        TokenCounter: The memoized counter.
+    """
+    model = getattr(llm, "model", None)
+    if model is not None and hasattr(model, "tokenize"):
+        return CachedTokenCounter(lambda text: len(model.tokenize(text.encode("utf-8"), add_bos=False)))
+    tokenizer = getattr(llm, "tokenizer", None)
+    if tokenizer is not None and hasattr(tokenizer, "encode"):
+        return CachedTokenCounter(lambda text: len(tokenizer.encode(text)))
+    return CachedTokenCounter(approximate_token_count)
+
+
+class PromptSection(BaseModel):
+    """
+    A part of a prompt. Sections are allocated the token budget in order of priority and laid out in the order
+    they are given in.
+    Attributes:
+        name (str): The name of the section.
+        header (str): Text placed before the content, kept only if some content is.
+        text (str): The content of a text section, truncated from the end when it does not fit.
+        entries (List[str]): The content of a log section, oldest first; the oldest entries are dropped when they do not fit.
+        separator (str): The separator between entries.
+        priority (int): The allocation order, lower first.
+        required (bool): Whether the section is always included in full, e.g. the system prompt.
+    """
+    name: str = Field(description="The name of the section")
+    header: str = Field(default="", description="Text placed before the content, kept only if some content is")
+    text: str = Field(default="", description="The content of a text section")
+    entries: List[str] = Field(default_factory=list, description="The content of a log section, oldest first")
+    separator: str = Field(default="\n", description="The separator between entries")
+    priority: int = Field(default=0, description="The allocation order, lower first")
+    required: bool = Field(default=False, description="Whether the section is always included in full")
+
+
+class AssembledPrompt(BaseModel):
+    """
+    A prompt built by the PromptAssembler.
+    Attributes:
+        text (str): The prompt.
+        tokens (int): The number of tokens of the prompt, as the sum of the tokens of its sections.
+        section_tokens (Dict[str, int]): The number of tokens allocated to each section.
+        dropped_entries (Dict[str, int]): The number of oldest entries dropped from each log section.
+        truncated (List[str]): The names of the text sections truncated to fit.
+    """
+    text: str
+    tokens: int
+    section_tokens: Dict[str, int] = Field(default_factory=dict)
+    dropped_entries: Dict[str, int] = Field(default_factory=dict)
+    truncated: List[str] = Field(default_factory=list)
+
+
+class PromptAssembler:
+    """
+    Builds prompts within a token budget. Required sections are always included; the remaining budget is
+    allocated to the other sections by priority. A text section that does not fit keeps its leading lines,
+    a log section keeps its most recent entries.
+
+    Attributes:
+        budget (int): The maximum number of prompt tokens.
+        count_tokens (TokenCounter): The token counter.
+    """
+
+    def __init__(self, budget: int, count_tokens: TokenCounter = approximate_token_count):
+        self.budget = budget
+        self.count_tokens = count_tokens
+
+    def assemble(self, sections: List[PromptSection]) -> AssembledPrompt:
+        """
+        Assembles the sections within the budget.
+
+        Args:
+            sections (List[PromptSection]): The sections, in layout order.
+
+        Returns:
+            AssembledPrompt: The prompt and the allocation.
+        """
+        contents: Dict[str, str] = {}
+        section_tokens: Dict[str, int] = {}
+        dropped_entries: Dict[str, int] = {}
+        truncated: List[str] = []
+        remaining = self.budget
+        for section in sections:
+            if section.required:
+                content = section.header + self._join(section)
+                contents[section.name] = content
+                section_tokens[section.name] = self.count_tokens(content)
+                remaining -= section_tokens[section.name]
+        for section in sorted((section for section in sections if not section.required), key=lambda section: section.priority):
+            header_tokens = self.count_tokens(section.header) if section.header else 0
+            available = remaining - header_tokens
+            if section.entries:
+                kept, tokens = self._fit_entries(section, available)
+                dropped_entries[section.name] = len(section.entries) - len(kept)
+                body = section.separator.join(kept)
+            else:
+                tokens = self.count_tokens(section.text) if section.text else 0
+                body = section.text
+                if tokens > available:
+                    body, tokens = self._fit_text(section.text, available)
+                    truncated.append(section.name)
+            if not body:
+                contents[section.name] = ""
+                section_tokens[section.name] = 0
+                continue
+            contents[section.name] = section.header + body
+            section_tokens[section.name] = header_tokens + tokens
+            remaining -= section_tokens[section.name]
+        text = "".join(contents[section.name] for section in sections)
+        return AssembledPrompt(text=text, tokens=sum(section_tokens.values()), section_tokens=section_tokens,
+                               dropped_entries=dropped_entries, truncated=truncated)
+
+    @staticmethod
+    def _join(section: PromptSection) -> str:
+        return section.separator.join(section.entries) if section.entries else section.text
+
+    def _fit_entries(self, section: PromptSection, available: int):
+        kept: List[str] = []
+        tokens = 0
+        separator_tokens = self.count_tokens(section.separator) if section.separator else 0
+        for entry in reversed(section.entries):
+            entry_tokens = self.count_tokens(entry) + (separator_tokens if kept else 0)
+            if tokens + entry_tokens > available:
+                break
+            kept.append(entry)
+            tokens += entry_tokens
+        kept.reverse()
+        return kept, tokens
+
+    def _fit_text(self, text: str, available: int):
+        if available <= 0:
+            return "", 0
+        lines = text.split("\n")
+        # binary search on the number of leading lines that fit
+        low, high = 0, len(lines)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens("\n".join(lines[:middle])) <= available:
+                low = middle
+            else:
+                high = middle - 1
+        body = "\n".join(lines[:low])
+        return body, self.count_tokens(body) if body else 0
+
+
+class RollingSummary:
+    """
+    Compressed digest of the action log entries dropped from the prompt. Entries are folded in as they age out,
+    in O(1) each, and the digest stays a few lines long however many entries it covers: the number of actions,
+    the successes and failures per action name and the latest failure.
+
+    Attributes:
+        count (int): The number of folded entries.
+    """
+    ACTION_PATTERN = re.compile(r"## Action: (\S+)")
+    RESULT_PATTERN = re.compile(r"### Result: (\w+)")
+    ERROR_PATTERN = re.compile(r"### (?:Error|Reason): (.*)")
+
+    def __init__(self):
+        self.count = 0
+        self._actions: Dict[str, List[int]] = {}
+        self._last_failure: Optional[str] = None
+
+    def add(self, entry: str):
+        """
+        Folds an ActionState entry into the summary.
+        """
+        self.count += 1
+        action_match = self.ACTION_PATTERN.search(entry)
+        if action_match is None:
+            return
+        result_match = self.RESULT_PATTERN.search(entry)
+        succeeded = result_match is not None and result_match.group(1) == "Success"
+        counts = self._actions.setdefault(action_match.group(1), [0, 0])
+        counts[0 if succeeded else 1] += 1
+        if not succeeded:
+            error_match = self.ERROR_PATTERN.search(entry)
+            self._last_failure = f"{action_match.group(1)}: {error_match.group(1) if error_match else 'failed'}"
+
+    def extend(self, entries: List[str]):
+        for entry in entries:
+            self.add(entry)
+
+    @property
+    def text(self) -> str:
+        if self.count == 0:
+            return ""
+        attempted = sum(succeeded + failed for succeeded, failed in self._actions.values())
+        summary = f"# Summary of the {self.count} earliest steps\n"
+        summary += f"- {attempted} actions attempted, {sum(succeeded for succeeded, _ in self._actions.values())} succeeded\n"
+        for action_name, (succeeded, failed) in sorted(self._actions.items()):
+            summary += f"- {action_name}: {succeeded} succeeded, {failed} failed\n"
+        if self._last_failure:
+            summary += f"- Latest failure: {self._last_failure}\n"
+        return summary
@@ -0,0 +1,271 @@
+# trace.py
+from typing import Any, BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from collections import deque
+from enum import IntEnum
+import json
+import struct
+import time
+
+
+class TraceLevel(IntEnum):
+    """
+    Verbosity of the simulation trace. An event is recorded when the level of the tracer is at least its own.
+    """
+    OFF = 0
+    INFO = 1
+    DEBUG = 2
+
+
+# Events are named tuples rather than models so that an enabled trace stays cheap on the hot paths.
+
+class Message(NamedTuple):
+    """
+    A free text message, replacing the print based debugging output.
+    """
+    time_ns: int
+    level: int
+    text: str
+
+
+class ActionAttempted(NamedTuple):
+    time_ns: int
+    action_name: str
+    source_id: str
+    target_id: str
+
+
+class PrerequisiteFailed(NamedTuple):
+    """
+    A prerequisite statement of an action that did not hold.
+
+    Attributes:
+        kind (str): Which statements the failed one belongs to: "source", "target", "source_target" or "callable".
+        statement (str): The failed statement, or the name of the failed callable.
+    """
+    time_ns: int
+    action_name: str
+    source_id: str
+    target_id: str
+    kind: str
+    statement: str
+
+
+class ActionCompleted(NamedTuple):
+    time_ns: int
+    action_name: str
+    source_id: str
+    target_id: str
+    success: bool
+    error: Optional[str]
+    duration_ns: int
+
+
+class StateDiff(NamedTuple):
+    """
+    The attributes changed by an action, as {role: {attribute: [old value, new value]}}.
+    """
+    time_ns: int
+    action_name: str
+    source_id: str
+    target_id: str
+    changes: Dict[str, Dict[str, Any]]
+
+
+class Timing(NamedTuple):
+    time_ns: int
+    name: str
+    duration_ns: int
+
+
+TraceEvent = Any
+EVENT_TYPES: Tuple[type, ...] = (Message, ActionAttempted, PrerequisiteFailed, ActionCompleted, StateDiff, Timing)
+_EVENT_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+_EVENT_NAMES = {event_type.__name__: event_type for event_type in EVENT_TYPES}
+
+BINARY_MAGIC = b"IPTRACE1"
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR_REF, _STR_NEW, _JSON = range(8)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_jsonable(item) for item in value]
+    return repr(value)
+
+
+class Tracer:
+    """
+    Ring buffer of typed simulation events.
+
+    Call sites check the level before building an event, so a disabled trace costs a single comparison:
+
+        if TRACE.level >= TraceLevel.DEBUG:
+            TRACE.message(f"Applying {action.name}")
+
+    Attributes:
+        level (TraceLevel): The current level, OFF by default.
+        echo (bool): Whether messages are also printed to stdout when recorded.
+        events (deque): The most recent events, oldest first.
+    """
+
+    def __init__(self, capacity: int = 100_000, level: TraceLevel = TraceLevel.OFF, echo: bool = True):
+        self.level = level
+        self.echo = echo
+        self.events: deque = deque(maxlen=capacity)
+
+    @property
+    def capacity(self) -> int:
+        return self.events.maxlen
+
+    def configure(self, level: Optional[TraceLevel] = None, capacity: Optional[int] = None, echo: Optional[bool] = None) -> "Tracer":
+        """
+        Changes the settings of the tracer. Changing the capacity keeps the most recent events.
+
+        Returns:
+            Tracer: The tracer itself.
+        """
+        if level is not None:
+            self.level = TraceLevel(level)
+        if echo is not None:
+            self.echo = echo
+        if capacity is not None and capacity != self.capacity:
+            self.events = deque(self.events, maxlen=capacity)
+        return self
+
+    def enabled(self, level: TraceLevel) -> bool:
+        return self.level >= level
+
+    def record(self, event: TraceEvent):
+        self.events.append(event)
+
+    def message(self, text: str, level: TraceLevel = TraceLevel.DEBUG):
+        self.events.append(Message(time.perf_counter_ns(), int(level), text))
+        if self.echo:
+            print(text)
+
+    def clear(self):
+        self.events.clear()
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def export_jsonl(self, path: str, events: Optional[Iterable[TraceEvent]] = None):
+        """
+        Writes the events as JSON lines of the form {"event": type name, **fields}.
+
+        Args:
+            path (str): The file to write.
+            events (Optional[Iterable[TraceEvent]]): The events to write, the buffered ones by default.
+        """
+        with open(path, "w") as file:
+            for event in self.events if events is None else events:
+                record = {"event": type(event).__name__}
+                record.update((name, _jsonable(value)) for name, value in zip(event._fields, event))
+                file.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def load_jsonl(path: str) -> List[TraceEvent]:
+        events = []
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    event_type = _EVENT_NAMES[record.pop("event")]
+                    events.append(event_type(**record))
+        return events
+
+    def export_binary(self, path: str, events: Optional[Iterable[TraceEvent]] = None):
+        """
+        Writes the events in a compact binary format: a magic header, then per event a one byte type code
+        followed by its fields as tagged values. Strings are interned, so repeated ids and action names are
+        stored once and then referenced by index; dict and list fields are stored as JSON.
+
+        Args:
+            path (str): The file to write.
+            events (Optional[Iterable[TraceEvent]]): The events to write, the buffered ones by default.
+        """
+        strings: Dict[str, int] = {}
+        with open(path, "wb") as file:
+            file.write(BINARY_MAGIC)
+            for event in self.events if events is None else events:
+                file.write(struct.pack("<B", _EVENT_CODES[type(event)]))
+                for value in event:
+                    self._write_value(file, value, strings)
+
+    @staticmethod
+    def _write_value(file: BinaryIO, value: Any, strings: Dict[str, int]):
+        if value is None:
+            file.write(struct.pack("<B", _NONE))
+        elif isinstance(value, bool):
+            file.write(struct.pack("<B", _TRUE if value else _FALSE))
+        elif isinstance(value, int) and -2**63 <= value < 2**63:
+            file.write(struct.pack("<Bq", _INT, value))
+        elif isinstance(value, float):
+            file.write(struct.pack("<Bd", _FLOAT, value))
+        elif isinstance(value, str):
+            index = strings.get(value)
+            if index is None:
+                strings[value] = len(strings)
+                encoded = value.encode()
+                file.write(struct.pack("<BI", _STR_NEW, len(encoded)) + encoded)
+            else:
+                file.write(struct.pack("<BI", _STR_REF, index))
+        else:
+            encoded = json.dumps(_jsonable(value)).encode()
+            file.write(struct.pack("<BI", _JSON, len(encoded)) + encoded)
+
+    @staticmethod
+    def load_binary(path: str) -> List[TraceEvent]:
+        """
+        Reads the events written by export_binary.
+
+        Raises:
+            ValueError: If the file is not a binary trace.
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        if not data.startswith(BINARY_MAGIC):
+            raise ValueError(f"{path} is not a binary trace")
+        strings: List[str] = []
+        events = []
+        offset = len(BINARY_MAGIC)
+        while offset < len(data):
+            event_type = EVENT_TYPES[data[offset]]
+            offset += 1
+            values = []
+            for _ in event_type._fields:
+                tag = data[offset]
+                offset += 1
+                if tag == _NONE:
+                    values.append(None)
+                elif tag in (_FALSE, _TRUE):
+                    values.append(tag == _TRUE)
+                elif tag == _INT:
+                    values.append(struct.unpack_from("<q", data, offset)[0])
+                    offset += 8
+                elif tag == _FLOAT:
+                    values.append(struct.unpack_from("<d", data, offset)[0])
+                    offset += 8
+                elif tag == _STR_REF:
+                    values.append(strings[struct.unpack_from("<I", data, offset)[0]])
+                    offset += 4
+                else:
+                    length = struct.unpack_from("<I", data, offset)[0]
+                    payload = data[offset + 4:offset + 4 + length].decode()
+                    offset += 4 + length
+                    if tag == _STR_NEW:
+                        strings.append(payload)
+                        values.append(payload)
+                    else:
+                        values.append(json.loads(payload))
+            events.append(event_type(*values))
+        return events
+
+
+TRACE = Tracer()
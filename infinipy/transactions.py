@@ -0,0 +1,148 @@
+# transactions.py
+from typing import List, Optional
+from infinipy.entity import RegistryHolder
+from infinipy.events import ChangeBus, ChangeEvent, AttributeValueChanged, FieldChanged, NodeEntitiesChanged, InventoryChanged
+
+
+def undo_change(event: ChangeEvent):
+    """
+    Reverts a single change through the same observed setters that made it, so that versions are bumped
+    and other ChangeBus subscribers see the inverse change.
+
+    Args:
+        event (ChangeEvent): The change to revert.
+    """
+    if isinstance(event, AttributeValueChanged):
+        owner = RegistryHolder.get_instance(event.owner_id)
+        getattr(owner, event.attr_name).value = event.old_value
+    elif isinstance(event, FieldChanged):
+        owner = RegistryHolder.get_instance(event.owner_id)
+        setattr(owner, event.field_name, event.old_value)
+    elif isinstance(event, NodeEntitiesChanged):
+        node = RegistryHolder.get_instance(event.node_id)
+        entity = RegistryHolder.get_instance(event.entity_id)
+        if event.added:
+            node.detach(entity)
+        else:
+            node.attach(entity, index=event.index)
+    elif isinstance(event, InventoryChanged):
+        owner = RegistryHolder.get_instance(event.owner_id)
+        item = RegistryHolder.get_instance(event.item_id)
+        if event.added:
+            owner.detach_item(item)
+        else:
+            owner.attach_item(item, index=event.index)
+
+
+def redo_change(event: ChangeEvent):
+    """
+    Re-applies a change previously reverted with undo_change, through the same observed setters that made it.
+
+    Args:
+        event (ChangeEvent): The change to re-apply.
+    """
+    if isinstance(event, AttributeValueChanged):
+        owner = RegistryHolder.get_instance(event.owner_id)
+        getattr(owner, event.attr_name).value = event.new_value
+    elif isinstance(event, FieldChanged):
+        owner = RegistryHolder.get_instance(event.owner_id)
+        setattr(owner, event.field_name, event.new_value)
+    elif isinstance(event, NodeEntitiesChanged):
+        node = RegistryHolder.get_instance(event.node_id)
+        entity = RegistryHolder.get_instance(event.entity_id)
+        if event.added:
+            node.attach(entity, index=event.index)
+        else:
+            node.detach(entity)
+    elif isinstance(event, InventoryChanged):
+        owner = RegistryHolder.get_instance(event.owner_id)
+        item = RegistryHolder.get_instance(event.item_id)
+        if event.added:
+            owner.attach_item(item, index=event.index)
+        else:
+            owner.detach_item(item)
+
+
+class Transaction:
+    """
+    Undo log for speculative changes, e.g. trying an action during lookahead search and reverting it.
+
+    While the transaction is open it records every change reported on the ChangeBus: attribute values, entity
+    and node fields, node entity lists and inventories. rollback() reverts them in reverse order, and both
+    commit() and rollback() cost O(changes). Used as a context manager, the transaction commits on normal exit
+    unless it was closed before, and rolls back if an exception escapes.
+
+        with Transaction() as transaction:
+            grid_map.apply_action_instance(action_instance, record_states=False, verbose=False)
+            ...  # inspect the resulting state
+            transaction.rollback()
+
+    Transactions can be nested: rolling back an inner transaction reports the inverse changes to the outer one.
+    Objects registered while the transaction is open (e.g. the Attributes built by Consequences.apply) stay in
+    the registry after a rollback, but are no longer referenced by the world.
+
+    Attributes:
+        changes (List[ChangeEvent]): The changes recorded so far, in order.
+    """
+
+    def __init__(self):
+        self.changes: List[ChangeEvent] = []
+        self._open = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def begin(self) -> "Transaction":
+        """
+        Starts recording changes.
+
+        Returns:
+            Transaction: The transaction itself.
+        """
+        if self._open:
+            raise RuntimeError("Transaction is already open")
+        self.changes = []
+        ChangeBus.subscribe(self.record)
+        self._open = True
+        return self
+
+    def record(self, event: ChangeEvent):
+        self.changes.append(event)
+
+    def commit(self) -> List[ChangeEvent]:
+        """
+        Stops recording and keeps the changes.
+
+        Returns:
+            List[ChangeEvent]: The changes made during the transaction.
+        """
+        self._close()
+        changes, self.changes = self.changes, []
+        return changes
+
+    def rollback(self):
+        """
+        Stops recording and reverts the changes made during the transaction, most recent first.
+        """
+        self._close()
+        changes, self.changes = self.changes, []
+        for event in reversed(changes):
+            undo_change(event)
+
+    def _close(self):
+        if not self._open:
+            raise RuntimeError("Transaction is not open")
+        ChangeBus.unsubscribe(self.record)
+        self._open = False
+
+    def __enter__(self) -> "Transaction":
+        return self.begin()
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback) -> bool:
+        if self._open:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        return False
@@ -0,0 +1,196 @@
+# vectorized.py
+from typing import Any, Dict, List, Sequence, Tuple
+import numpy as np
+from infinipy.entity import Attribute
+from infinipy.nodes import GameEntity
+from infinipy.actions import Action, Prerequisites
+import typing
+if typing.TYPE_CHECKING:
+    from infinipy.gridmap import GridMap
+
+
+def attribute_value_equals(value: Any, desired_value: Any) -> bool:
+    """
+    Scalar fallback of the condition check, with the semantics of Statement.validate_condition.
+    """
+    try:
+        return not (value != desired_value)
+    except Exception:
+        return False
+
+
+def to_column(values: List[Any], present: List[bool]) -> np.ndarray:
+    """
+    Packs attribute values into a typed array when they are all booleans, integers or floats, and into an
+    object array otherwise. The values of missing attributes are replaced by a zero of the column type.
+    """
+    value_types = {type(value) for value, is_present in zip(values, present) if is_present}
+    try:
+        if value_types <= {bool}:
+            return np.array([value if is_present else False for value, is_present in zip(values, present)], dtype=bool)
+        if value_types <= {int}:
+            return np.array([value if is_present else 0 for value, is_present in zip(values, present)], dtype=np.int64)
+        if value_types <= {int, float}:
+            return np.array([value if is_present else 0.0 for value, is_present in zip(values, present)], dtype=np.float64)
+    except OverflowError:
+        pass
+    column = np.empty(len(values), dtype=object)
+    for index, value in enumerate(values):
+        column[index] = value
+    return column
+
+
+class AttributeColumns:
+    """
+    Columnar view of the attributes of a list of entities, used to evaluate attribute conditions as masks.
+    Columns are built on demand from the memoized all_attributes of each entity.
+
+    Attributes:
+        entities (Sequence[GameEntity]): The entities, one per row.
+    """
+
+    def __init__(self, entities: Sequence[GameEntity]):
+        self.entities = entities
+        self._attributes: List[Dict[str, Attribute]] = [entity.all_attributes() for entity in entities]
+        self._columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def column(self, attr_name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the presence mask and the values of an attribute across the entities.
+
+        Args:
+            attr_name (str): The name of the attribute.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: A boolean mask of the entities having the attribute, and the attribute values.
+        """
+        column = self._columns.get(attr_name)
+        if column is None:
+            attributes = [attributes.get(attr_name) for attributes in self._attributes]
+            present = [attribute is not None for attribute in attributes]
+            values = [attribute.value if attribute is not None else None for attribute in attributes]
+            column = self._columns[attr_name] = (np.array(present, dtype=bool), to_column(values, present))
+        return column
+
+    def condition_mask(self, conditions: Sequence[Tuple[str, Any]]) -> np.ndarray:
+        """
+        Evaluates attribute conditions for every entity at once.
+
+        Args:
+            conditions (Sequence[Tuple[str, Any]]): The (attribute name, desired value) pairs, all of which must hold.
+
+        Returns:
+            np.ndarray: A boolean mask of the entities satisfying every condition.
+        """
+        mask = np.ones(len(self.entities), dtype=bool)
+        for attr_name, desired_value in conditions:
+            if not mask.any():
+                break
+            present, values = self.column(attr_name)
+            if callable(desired_value):
+                # an attribute value never equals a callable, see Statement.validate_condition
+                return np.zeros(len(self.entities), dtype=bool)
+            if values.dtype != object and type(desired_value) in (bool, int, float):
+                mask &= present & (values == desired_value)
+            else:
+                mask &= present & np.fromiter((attribute_value_equals(value, desired_value) for value in values), dtype=bool, count=len(values))
+        return mask
+
+
+def applicable_actions_batch(grid_map: "GridMap", sources: Sequence[GameEntity], radius: int) -> List[Tuple[GameEntity, Action, GameEntity]]:
+    """
+    Evaluates the registered actions of a grid map for many sources at once.
+
+    The attribute conditions of every action are evaluated as masks over the columnar attributes of the sources
+    and of the entities in their neighbourhoods. The comparisons and callables only run on the (source, target)
+    pairs that pass the conditions.
+
+    Args:
+        grid_map (GridMap): The grid map holding the sources and the registered actions.
+        sources (Sequence[GameEntity]): The source entities. Sources that are not placed on a node are skipped.
+        radius (int): The radius of the neighbourhood searched for targets around each source.
+
+    Returns:
+        List[Tuple[GameEntity, Action, GameEntity]]: The applicable (source, action template, target) triples, ordered
+        by source, then in the order of get_applicable_actions_in_neighborhood.
+    """
+    actions = [action_class.template() for action_class in grid_map.actions.values()]
+    targets: List[GameEntity] = []
+    target_rows: Dict[int, int] = {}
+    pair_sources: List[int] = []
+    pair_targets: List[int] = []
+    for source_row, source in enumerate(sources):
+        if source.node is None:
+            continue
+        for node in grid_map.get_radius(source.node, radius).nodes:
+            for target in node.entities:
+                target_row = target_rows.get(id(target))
+                if target_row is None:
+                    target_row = target_rows[id(target)] = len(targets)
+                    targets.append(target)
+                pair_sources.append(source_row)
+                pair_targets.append(target_row)
+    if not pair_sources or not actions:
+        return []
+
+    pair_source_rows = np.array(pair_sources, dtype=np.intp)
+    pair_target_rows = np.array(pair_targets, dtype=np.intp)
+    source_columns = AttributeColumns(sources)
+    target_columns = AttributeColumns(targets)
+    allowed = np.zeros((len(pair_sources), len(actions)), dtype=bool)
+    for action_column, action in enumerate(actions):
+        prerequisites = action.prerequisites
+        target_mask = target_columns.condition_mask(prerequisites.target_conditions())
+        pair_mask = target_mask[pair_target_rows]
+        if not pair_mask.any():
+            continue
+        source_mask = source_columns.condition_mask(prerequisites.source_conditions())
+        pair_mask &= source_mask[pair_source_rows]
+        residual = prerequisites.compile_residual()
+        for pair in np.flatnonzero(pair_mask):
+            allowed[pair, action_column] = residual(sources[pair_source_rows[pair]], targets[pair_target_rows[pair]])
+
+    return [(sources[pair_source_rows[pair]], actions[action_column], targets[pair_target_rows[pair]])
+            for pair, action_column in np.argwhere(allowed)]
+
+
+def shared_prerequisites(action: Action) -> Prerequisites:
+    """
+    Returns the prerequisites evaluated for an action: those declared on its class, shared by all its instances,
+    unless the instance was given its own (see Action.compiled_prerequisites).
+    """
+    if "prerequisites" not in action.__pydantic_fields_set__:
+        default = type(action).model_fields["prerequisites"].default
+        if isinstance(default, Prerequisites):
+            return default
+    return action.prerequisites
+
+
+def prerequisites_batch(triples: Sequence[Tuple[Action, GameEntity, GameEntity]]) -> np.ndarray:
+    """
+    Evaluates the prerequisites of many (action, source, target) triples at once, with the result of
+    Action.is_applicable on each. The triples sharing prerequisites are grouped, their attribute conditions are
+    evaluated as masks over the columnar attributes of their sources and targets, and the comparisons and callables
+    only run on the triples that pass them.
+
+    Args:
+        triples (Sequence[Tuple[Action, GameEntity, GameEntity]]): The (action, source, target) triples.
+
+    Returns:
+        np.ndarray: A boolean mask of the triples whose prerequisites hold.
+    """
+    groups: Dict[int, Tuple[Prerequisites, List[int]]] = {}
+    for index, (action, _, _) in enumerate(triples):
+        prerequisites = shared_prerequisites(action)
+        groups.setdefault(id(prerequisites), (prerequisites, []))[1].append(index)
+    applicable = np.zeros(len(triples), dtype=bool)
+    for prerequisites, indices in groups.values():
+        rows = np.array(indices, dtype=np.intp)
+        mask = AttributeColumns([triples[index][2] for index in indices]).condition_mask(prerequisites.target_conditions())
+        if mask.any():
+            mask &= AttributeColumns([triples[index][1] for index in indices]).condition_mask(prerequisites.source_conditions())
+        residual = prerequisites.compile_residual()
+        for row in np.flatnonzero(mask):
+            _, source, target = triples[indices[row]]
+            applicable[rows[row]] = residual(source, target)
+    return applicable
@@ -0,0 +1,37 @@
+# test_mcts.py
+from infinipy.actions import Goal, Prerequisites
+from infinipy.entity import Statement
+from infinipy.gridmap import GridMap
+from infinipy.interactions import Character, Floor, Key, Move, Pickup, Drop, is_target_in_source_inventory
+from infinipy.language_state import StrActionConverter
+from infinipy.mcts import MCTS
+
+
+def make_world():
+    grid_map = GridMap(width=5, height=5)
+    grid_map.register_actions([Move, Pickup, Drop])
+    for row in grid_map.grid:
+        for node in row:
+            node.add_entity(Floor(name=f"Floor_{node.position.value}"))
+    character = Character(name="Player")
+    key = Key(name="Golden Key")
+    grid_map.get_node((2, 2)).add_entity(character)
+    grid_map.get_node((3, 2)).add_entity(key)
+    grid_map.generate_entity_type_map()
+    return grid_map, character, key
+
+
+def test_worker_search_after_allowed_strings():
+    grid_map, character, key = make_world()
+    goal = Goal(name="Key in inventory", source_entity_id=character.id, target_entity_id=key.id,
+                prerequisites=Prerequisites(source_target_statements=[Statement(callables=[is_target_in_source_inventory])]))
+    # fills the applicability caches of the grid map, as Agent.derive_allowed_strings does before every MCTSAgent search
+    converter = StrActionConverter(actions=grid_map.actions, entity_type_map=grid_map.entity_type_map)
+    allowed_strings = converter.allowed_action_strings(grid_map, character.id, radius=1)
+    mcts = MCTS(grid_map, character.id, [goal], grid_map.actions, grid_map.entity_type_map, workers=1,
+                time_budget=None, max_rollouts=8)
+    try:
+        assert mcts.search() in allowed_strings
+        assert mcts.stats["rollouts"] == 8
+    finally:
+        mcts.close()